@@ -0,0 +1,219 @@
+"""
+API入口的准入控制
+
+按路由类别（LLM、图片、语音、渲染）限制同时处理的生成请求数，超出的请求进入有界队列按到达顺序等待；
+队列已满时立即返回429，排队超时返回503，并通过 Retry-After 告知客户端稍后重试，
+避免请求无限堆积导致所有请求一起超时。
+有名额空出时优先转交给交互通道的排队请求（见 priority 模块）。
+以后台任务方式提交的请求在入队时检查：持久化队列中该类任务的未结束数量计入并发和排队上限。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException
+
+from .config import settings, per_process
+from . import job_queue, metrics
+from .priority import current_lane, lane_rank, observe_latency
+from .deadline import DeadlineExceeded, limit_timeout
+from utils.logger import logger
+
+# 路由类别
+ROUTE_CLASSES = ("llm", "image", "tts", "render")
+
+_DEFAULT_TIMEOUT = object()
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def to_http_exception(self) -> HTTPException:
+        return HTTPException(
+            status_code=self.status_code,
+            detail=self.detail,
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+
+class AdmissionGate:
+    """单个路由类别的并发上限和有界等待队列，只能在同一个事件循环中使用"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        # 排队者：(名额转交信号, 所属通道, 开始排队时间)
+        self._waiters: Deque[Tuple[asyncio.Future, str, float]] = deque()
+        # 请求处理耗时的指数滑动平均，用于估算 Retry-After
+        self._avg_service_seconds: Optional[float] = None
+        self._update_gauges()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter, _, _ in self._waiters if not waiter.done())
+
+    def _update_gauges(self):
+        metrics.set_gauge(f"admission.{self.name}.running", self.running)
+        metrics.set_gauge(f"admission.{self.name}.queued", self.queued)
+        metrics.set_gauge(f"admission.{self.name}.limit", self.limit)
+        metrics.set_gauge(f"admission.{self.name}.queue_size", self.queue_size)
+
+    def retry_after(self) -> int:
+        """按平均处理耗时估算排在队尾的请求需要等待的秒数"""
+        average = self._avg_service_seconds or 1.0
+        return max(1, math.ceil(average * (self.queued + 1) / self.limit))
+
+    def _reject(self, status_code: int, detail: str, counter: str):
+        metrics.incr(f"admission.{self.name}.{counter}")
+        retry_after = self.retry_after()
+        logger.warning(f"准入拒绝({self.name}): {detail}，Retry-After {retry_after}秒")
+        raise AdmissionRejected(status_code, detail, retry_after)
+
+    def ensure_capacity(self):
+        """队列已满时抛出 AdmissionRejected(429)，用于入队后在后台执行的请求"""
+        if self.running >= self.limit and self.queued >= self.queue_size:
+            self._reject(429, "服务繁忙，请稍后重试", "rejected")
+
+    def ensure_job_capacity(self, unfinished: int, capacity: int):
+        """已入队未结束的后台任务数达到上限时抛出 AdmissionRejected(429)"""
+        if unfinished >= capacity:
+            self._reject(429, "后台任务已满，请稍后重试", "jobs_rejected")
+
+    def _release(self):
+        """释放名额：有排队请求时直接转交给优先级最高的最早排队者，否则名额数减一"""
+        now = time.monotonic()
+        pending = [entry for entry in self._waiters if not entry[0].done()]
+        self._waiters = deque(pending)
+        if pending:
+            # min 在优先级相同时返回最早排队者
+            entry = min(pending, key=lambda e: lane_rank(e[1], e[2], now))
+            self._waiters.remove(entry)
+            entry[0].set_result(None)
+            self._update_gauges()
+            return
+        self.running -= 1
+        self._update_gauges()
+
+    def _remove_waiter(self, waiter: asyncio.Future):
+        self._waiters = deque(entry for entry in self._waiters if entry[0] is not waiter)
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def admit(self, timeout=_DEFAULT_TIMEOUT) -> AsyncIterator[None]:
+        """
+        在并发上限内执行，名额不足时排队
+
+        Args:
+            timeout: 最长排队时间(秒)，默认使用配置值，None表示一直等待；不超过请求的剩余预算
+
+        Raises:
+            AdmissionRejected: 队列已满(429)或排队超时(503)
+            DeadlineExceeded: 排队期间请求的时间预算用尽
+        """
+        if timeout is _DEFAULT_TIMEOUT:
+            timeout = self.queue_timeout or None
+        timeout, deadline_bound = limit_timeout(timeout, f"admission.{self.name}")
+
+        lane = current_lane()
+        enqueued_at = time.monotonic()
+        if self.running < self.limit and not self.queued:
+            self.running += 1
+            self._update_gauges()
+        else:
+            self.ensure_capacity()
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((waiter, lane, enqueued_at))
+            self._update_gauges()
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                self._remove_waiter(waiter)
+                if deadline_bound:
+                    metrics.incr(f"admission.{self.name}.deadline_exceeded")
+                    raise DeadlineExceeded(f"admission.{self.name}")
+                self._reject(503, "排队超时，服务繁忙，请稍后重试", "timed_out")
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 名额已转交但请求被取消，继续转交给下一个
+                    self._release()
+                else:
+                    self._remove_waiter(waiter)
+                raise
+            metrics.observe(f"admission.{self.name}.queue_wait_seconds", time.monotonic() - enqueued_at)
+        observe_latency(f"admission.{self.name}", lane, time.monotonic() - enqueued_at)
+
+        metrics.incr(f"admission.{self.name}.admitted")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._avg_service_seconds = elapsed if self._avg_service_seconds is None \
+                else 0.8 * self._avg_service_seconds + 0.2 * elapsed
+            self._release()
+
+
+_gates: Dict[str, AdmissionGate] = {}
+
+
+def get_gate(route_class: str) -> AdmissionGate:
+    """进程内共享的路由类别准入闸门，多工作进程部署时各进程均分并发和排队上限"""
+    if route_class not in ROUTE_CLASSES:
+        raise ValueError(f"未知的路由类别: {route_class}")
+    gate = _gates.get(route_class)
+    if gate is None:
+        key = route_class.upper()
+        gate = AdmissionGate(
+            route_class,
+            per_process(getattr(settings, f"ADMISSION_{key}_CONCURRENCY")),
+            per_process(getattr(settings, f"ADMISSION_{key}_QUEUE")),
+            settings.ADMISSION_QUEUE_TIMEOUT
+        )
+        _gates[route_class] = gate
+    return gate
+
+
+def admission(route_class: str):
+    """FastAPI依赖：请求在所属路由类别的准入闸门内处理"""
+    async def dependency():
+        try:
+            async with get_gate(route_class).admit():
+                yield
+        except AdmissionRejected as e:
+            raise e.to_http_exception()
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+    return Depends(dependency)
+
+
+def admission_check(route_class: str, job_kind: str):
+    """
+    FastAPI依赖：后台任务入队前检查容量（任务执行时再通过 get_gate().admit() 排队）
+
+    进程内闸门的排队已满，或持久化队列中 job_kind 类任务的未结束数量达到该类别的
+    并发与排队上限之和（整个服务的总量，已入队的任务都计入）时返回429
+    """
+    async def dependency():
+        gate = get_gate(route_class)
+        try:
+            gate.ensure_capacity()
+            key = route_class.upper()
+            capacity = getattr(settings, f"ADMISSION_{key}_CONCURRENCY") + getattr(settings, f"ADMISSION_{key}_QUEUE")
+            gate.ensure_job_capacity(await job_queue.in_session(job_queue.count_unfinished, job_kind), capacity)
+        except AdmissionRejected as e:
+            raise e.to_http_exception()
+    return Depends(dependency)
@@ -0,0 +1,233 @@
+"""
+db_service 中供 async 接口使用的异步版本
+
+参数和返回值与 db_service 中的同名函数一致，使用 AsyncSession（见 database.get_async_db）；
+返回的对象不能在异步上下文中访问未加载的关联关系（如 story.paragraphs），需要时单独查询。
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from . import db_models
+from . import models
+
+
+async def _save(db: AsyncSession, records: list) -> list:
+    """提交并刷新记录（创建时间等由数据库生成的字段）"""
+    db.add_all(records)
+    await db.commit()
+    for record in records:
+        await db.refresh(record)
+    return records
+
+# Story 相关操作
+async def create_story(db: AsyncSession, story_request: models.StoryRequest) -> db_models.Story:
+    """创建故事记录"""
+    db_story = db_models.Story(
+        theme=story_request.theme,
+        story_type=story_request.story_type.value,
+        age_range=story_request.age_range,
+        language=story_request.language.value,
+        word_count=story_request.word_count,
+        pages=story_request.pages
+    )
+    await _save(db, [db_story])
+    return db_story
+
+async def get_story(db: AsyncSession, story_id: str) -> Optional[db_models.Story]:
+    """获取故事记录"""
+    return await db.get(db_models.Story, story_id)
+
+# Paragraph 相关操作
+async def create_paragraphs(db: AsyncSession, story_id: str, paragraphs: List[str]) -> List[db_models.Paragraph]:
+    """创建段落记录"""
+    return await _save(db, [
+        db_models.Paragraph(story_id=story_id, content=content, page_number=i + 1)
+        for i, content in enumerate(paragraphs)
+    ])
+
+async def get_paragraphs(db: AsyncSession, story_id: str) -> List[db_models.Paragraph]:
+    """获取故事的所有段落"""
+    result = await db.scalars(
+        select(db_models.Paragraph)
+        .where(db_models.Paragraph.story_id == story_id)
+        .order_by(db_models.Paragraph.page_number)
+    )
+    return list(result)
+
+# Character 相关操作
+async def create_characters(
+    db: AsyncSession, story_id: str, characters: List[models.CharacterDescription]
+) -> List[db_models.Character]:
+    """创建人物记录"""
+    return await _save(db, [
+        db_models.Character(
+            story_id=story_id,
+            name=character.name,
+            role=character.role,
+            appearance=character.appearance,
+            traits=character.traits,
+            age=character.age
+        ) for character in characters
+    ])
+
+async def get_characters(db: AsyncSession, story_id: str) -> List[db_models.Character]:
+    """获取故事的所有人物"""
+    result = await db.scalars(select(db_models.Character).where(db_models.Character.story_id == story_id))
+    return list(result)
+
+# ImageDescription 相关操作
+async def create_image_descriptions(
+    db: AsyncSession,
+    story_id: str,
+    descriptions: List[str],
+    cover_description: str,
+    style: str,
+    paragraphs: List[db_models.Paragraph] = None
+) -> List[db_models.ImageDescription]:
+    """创建图片描述记录，第一个为封面"""
+    if paragraphs is None:
+        paragraphs = await get_paragraphs(db, story_id)
+
+    records = [db_models.ImageDescription(
+        story_id=story_id,
+        description=cover_description,
+        is_cover=True,
+        style=style
+    )]
+    for desc, paragraph in zip(descriptions, paragraphs):
+        records.append(db_models.ImageDescription(
+            story_id=story_id,
+            paragraph_id=paragraph.id,
+            description=desc,
+            is_cover=False,
+            style=style
+        ))
+    return await _save(db, records)
+
+async def add_missing_image_descriptions(
+    db: AsyncSession,
+    story_id: str,
+    descriptions: List[str],
+    cover_description: str,
+    style: str,
+    paragraphs: List[db_models.Paragraph]
+) -> List[db_models.ImageDescription]:
+    """
+    只为缺少描述的封面和段落创建图片描述记录，已有的描述及其图片保留，避免重复记录
+
+    Returns:
+        List[ImageDescription]: 按页面顺序排列的描述，第一个为封面
+    """
+    existing = await get_image_descriptions(db, story_id)
+    cover = next((desc for desc in existing if desc.is_cover), None)
+    by_paragraph = {desc.paragraph_id: desc for desc in existing if not desc.is_cover}
+    created = []
+    if cover is None:
+        cover = db_models.ImageDescription(
+            story_id=story_id,
+            description=cover_description,
+            is_cover=True,
+            style=style
+        )
+        created.append(cover)
+    ordered = [cover]
+    for desc, paragraph in zip(descriptions, paragraphs):
+        record = by_paragraph.get(paragraph.id)
+        if record is None:
+            record = db_models.ImageDescription(
+                story_id=story_id,
+                paragraph_id=paragraph.id,
+                description=desc,
+                is_cover=False,
+                style=style
+            )
+            created.append(record)
+        ordered.append(record)
+    await _save(db, created)
+    return ordered
+
+async def get_image_descriptions(db: AsyncSession, story_id: str) -> List[db_models.ImageDescription]:
+    """获取故事的所有图片描述"""
+    result = await db.scalars(
+        select(db_models.ImageDescription).where(db_models.ImageDescription.story_id == story_id))
+    return list(result)
+
+# Image 相关操作
+async def create_image(
+    db: AsyncSession,
+    story_id: str,
+    image_description_id: str,
+    file_path: str,
+    is_cover: bool,
+    aspect_ratio: str,
+    model: str = None,
+    seed: int = None,
+    paragraph_id: str = None
+) -> db_models.Image:
+    """创建图片记录"""
+    db_image = db_models.Image(
+        story_id=story_id,
+        image_description_id=image_description_id,
+        paragraph_id=paragraph_id,
+        file_path=file_path,
+        is_cover=is_cover,
+        aspect_ratio=aspect_ratio,
+        model=model,
+        seed=seed
+    )
+    await _save(db, [db_image])
+    return db_image
+
+async def get_images(db: AsyncSession, story_id: str) -> List[db_models.Image]:
+    """获取故事的所有图片"""
+    result = await db.scalars(select(db_models.Image).where(db_models.Image.story_id == story_id))
+    return list(result)
+
+# Speech 相关操作
+async def create_speech(
+    db: AsyncSession,
+    story_id: str,
+    paragraph_id: str,
+    file_path: str,
+    emotion: str = None,
+    duration: float = None
+) -> db_models.Speech:
+    """创建语音记录"""
+    db_speech = db_models.Speech(
+        story_id=story_id,
+        paragraph_id=paragraph_id,
+        file_path=file_path,
+        emotion=emotion,
+        duration=duration
+    )
+    await _save(db, [db_speech])
+    return db_speech
+
+async def get_speech(db: AsyncSession, story_id: str, paragraph_id: str) -> Optional[db_models.Speech]:
+    """获取故事中某个段落的最新语音"""
+    return await db.scalar(
+        select(db_models.Speech)
+        .where(db_models.Speech.story_id == story_id, db_models.Speech.paragraph_id == paragraph_id)
+        .order_by(db_models.Speech.created_at.desc())
+        .limit(1)
+    )
+
+# Video 相关操作
+async def create_video(
+    db: AsyncSession,
+    story_id: str,
+    file_path: str,
+    duration: float = None,
+    resolution: str = None,
+    playlist_path: str = None
+) -> db_models.Video:
+    """创建视频记录"""
+    db_video = db_models.Video(
+        story_id=story_id,
+        file_path=file_path,
+        duration=duration,
+        resolution=resolution,
+        playlist_path=playlist_path
+    )
+    await _save(db, [db_video])
+    return db_video
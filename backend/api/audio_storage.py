@@ -0,0 +1,197 @@
+"""
+音频压缩存储与格式协商
+
+对外的音频URL始终保持 .mp3 形式（数据库和前端无需感知存储格式），
+开启压缩存储后磁盘上只保留同名的 Opus/AAC 文件。读取时根据请求的
+Accept 头返回压缩文件，或为旧客户端临时转换出MP3。
+"""
+import asyncio
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Scope
+
+from .config import settings, AUDIO_STORAGE_FORMATS
+from . import metrics
+from utils.logger import logger
+
+# 音频转码工作池，转码都是ffmpeg子进程，用线程池即可并行
+_transcode_pool = ThreadPoolExecutor(
+    max_workers=max(1, settings.AUDIO_TRANSCODE_WORKERS),
+    thread_name_prefix="audio-transcode"
+)
+
+# 需要做格式协商的静态子目录
+NEGOTIATED_AUDIO_DIRS = ("audio/", "speech/")
+
+
+def storage_format() -> dict:
+    """当前配置的音频存储格式"""
+    return AUDIO_STORAGE_FORMATS.get(settings.AUDIO_STORAGE_CODEC, AUDIO_STORAGE_FORMATS["mp3"])
+
+
+def compact_storage_enabled() -> bool:
+    """是否开启了压缩存储"""
+    return storage_format()["ext"] != ".mp3"
+
+
+def url_to_path(url: Union[str, Path]) -> Path:
+    """将 /static/ 开头的URL转换为本地路径"""
+    return Path(str(url).replace("/static/", "static/", 1))
+
+
+def resolve_audio_file(url: Union[str, Path]) -> Path:
+    """
+    找到音频URL实际对应的本地文件
+
+    优先返回MP3原文件，不存在时返回任一格式的压缩文件（配置切换过格式也能找到）；
+    都不存在时原样返回MP3路径，由调用方处理文件不存在的情况
+    """
+    mp3_path = url_to_path(url)
+    if mp3_path.exists():
+        return mp3_path
+    for fmt in AUDIO_STORAGE_FORMATS.values():
+        candidate = mp3_path.with_suffix(fmt["ext"])
+        if candidate.exists():
+            return candidate
+    return mp3_path
+
+
+def _transcode(src: Path, dst: Path, codec_args: list):
+    """调用ffmpeg转码，先写临时文件再替换，避免读到写了一半的文件"""
+    tmp_dst = dst.with_name(f".{dst.name}.part{dst.suffix}")
+    cmd = ['ffmpeg', '-y', '-i', str(src), '-vn', '-map_metadata', '-1',
+           *codec_args, str(tmp_dst)]
+    subprocess.run(cmd, check=True, capture_output=True)
+    os.replace(tmp_dst, dst)
+
+
+def compact_audio_file(mp3_path: Union[str, Path]) -> Optional[Path]:
+    """
+    将MP3文件转码为配置的压缩格式并删除原MP3
+
+    Returns:
+        Optional[Path]: 压缩后的文件路径，未开启压缩或转码失败时返回None
+    """
+    mp3_path = Path(mp3_path)
+    if not compact_storage_enabled() or not mp3_path.exists():
+        return None
+
+    fmt = storage_format()
+    target = mp3_path.with_suffix(fmt["ext"])
+    try:
+        _transcode(mp3_path, target, [
+            '-c:a', fmt["codec"],
+            '-b:a', settings.AUDIO_STORAGE_BITRATE,
+        ])
+        original_size = mp3_path.stat().st_size
+        mp3_path.unlink()
+        metrics.incr("audio.compacted")
+        metrics.incr("audio.compacted.bytes_saved",
+                     original_size - target.stat().st_size)
+        return target
+    except Exception as e:
+        logger.error(f"音频压缩转码失败: {mp3_path}, {e}")
+        return None
+
+
+def schedule_compaction(url: Union[str, Path]) -> Optional[Future]:
+    """把音频文件提交到转码工作池，未开启压缩存储时不做任何事"""
+    if not compact_storage_enabled():
+        return None
+    return _transcode_pool.submit(compact_audio_file, url_to_path(url))
+
+
+async def wait_compactions(futures):
+    """等待一批压缩任务完成"""
+    pending = [asyncio.wrap_future(f) for f in futures if f is not None]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _ensure_mp3_sync(stored: Path, mp3_path: Path) -> Path:
+    """为旧客户端准备MP3：转码结果缓存到 MP3_CACHE_DIR，源文件更新后重新生成"""
+    from .services import canonical_audio_args
+
+    cache_path = settings.MP3_CACHE_DIR / mp3_path.parent.name / mp3_path.name
+    if cache_path.exists() and cache_path.stat().st_mtime >= stored.stat().st_mtime:
+        return cache_path
+
+    os.makedirs(cache_path.parent, exist_ok=True)
+    _transcode(stored, cache_path, canonical_audio_args())
+    metrics.incr("audio.mp3_fallback.transcoded")
+    return cache_path
+
+
+async def ensure_mp3(url: Union[str, Path]) -> Path:
+    """返回可直接发送给旧客户端的MP3文件路径"""
+    mp3_path = url_to_path(url)
+    stored = resolve_audio_file(mp3_path)
+    if stored.suffix == ".mp3":
+        return stored
+    metrics.incr("audio.mp3_fallback")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_transcode_pool, _ensure_mp3_sync, stored, mp3_path)
+
+
+def accepts_media_type(accept: str, media_type: str) -> bool:
+    """
+    判断Accept头是否明确接受指定媒体类型
+
+    只认可精确类型或 audio/* 通配；仅有 */* 的客户端按旧客户端处理，返回MP3
+    """
+    family = media_type.split("/")[0] + "/*"
+    for item in (accept or "").split(","):
+        parts = [p.strip() for p in item.split(";")]
+        if parts[0].lower() not in (media_type, family):
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            return True
+    return False
+
+
+async def negotiate_audio(url: Union[str, Path], accept: str) -> Optional[Tuple[Path, str]]:
+    """
+    根据Accept头选择要返回的音频文件
+
+    Returns:
+        Optional[Tuple[Path, str]]: (文件路径, 媒体类型)，文件不存在时返回None
+    """
+    stored = resolve_audio_file(url)
+    if not stored.exists():
+        return None
+
+    for fmt in AUDIO_STORAGE_FORMATS.values():
+        if stored.suffix == fmt["ext"]:
+            if fmt["ext"] == ".mp3" or accepts_media_type(accept, fmt["media_type"]):
+                return stored, fmt["media_type"]
+            break
+
+    return await ensure_mp3(url), AUDIO_STORAGE_FORMATS["mp3"]["media_type"]
+
+
+class NegotiatedStaticFiles(StaticFiles):
+    """对音频目录下的 .mp3 请求做格式协商的静态文件服务"""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        normalized = path.replace("\\", "/")
+        if normalized.endswith(".mp3") and normalized.startswith(NEGOTIATED_AUDIO_DIRS):
+            accept = Headers(scope=scope).get("accept", "")
+            negotiated = await negotiate_audio(Path(self.directory) / normalized, accept)
+            if negotiated:
+                file_path, media_type = negotiated
+                return FileResponse(file_path, media_type=media_type, headers={"Vary": "Accept"})
+        return await super().get_response(path, scope)
@@ -0,0 +1,71 @@
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from . import job_queue, story_batch
+
+# 创建路由
+batch_router = APIRouter(tags=["批量生成"])
+
+
+def _ndjson_response(summary: Dict[str, Any], batch_id: str) -> StreamingResponse:
+    """第一行为批次概况，之后每本书完成时输出一行结果"""
+    async def lines() -> AsyncIterator[str]:
+        yield json.dumps(summary, ensure_ascii=False) + "\n"
+        async for item in story_batch.watch_batch(batch_id):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@batch_router.post("/")
+async def submit_batch(
+    request: Request,
+    batch_id: Optional[str] = Query(None, description="续跑已有批次时指定批次ID"),
+    build: bool = Query(False, description="生成正文后继续生成配图、语音和视频")
+):
+    """
+    提交批量生成任务
+
+    请求体为JSONL，每行一个故事参数（与 /story/generate-story 相同）。条目进入批量通道的持久化任务队列，
+    按 BATCH_CONCURRENCY 和 BATCH_ITEMS_PER_MINUTE 限制执行；响应为NDJSON，每本书完成时输出一行。
+    连接断开不影响批次执行，可通过 GET /batches/{batch_id}/results 重新订阅结果，
+    或使用同一批次ID重新提交，只重新执行失败和取消的条目（行数更少时删除多出的旧条目）
+    """
+    try:
+        requests = story_batch.parse_jsonl((await request.body()).decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        summary = await job_queue.in_session(story_batch.submit_batch, requests, batch_id, build)
+    except story_batch.BatchConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _ndjson_response(summary, summary["batch_id"])
+
+
+async def _get_summary(batch_id: str) -> Dict[str, Any]:
+    summary = await job_queue.in_session(story_batch.batch_summary, batch_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return summary
+
+
+@batch_router.get("/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """查询批次中各状态的条目数"""
+    return await _get_summary(batch_id)
+
+
+@batch_router.get("/{batch_id}/results")
+async def stream_batch_results(batch_id: str):
+    """
+    订阅批次结果（NDJSON）
+
+    先输出已完成条目的结果，之后每本书完成时输出一行，所有条目结束后关闭连接
+    """
+    return _ndjson_response(await _get_summary(batch_id), batch_id)
@@ -0,0 +1,71 @@
+"""
+进程启动前的一次性准备工作
+
+验证配置、初始化数据库和创建静态文件/临时文件目录只需执行一次。多工作进程部署时由 run.py 的主进程执行后
+设置 APP_RUNTIME_PREPARED 环境变量，工作进程继承该变量后跳过；开发模式的重载子进程不继承该标记，
+每次重载都重新执行。直接使用 uvicorn --workers 启动时各工作进程通过文件锁依次执行，
+避免并发建表和补充列时互相冲突。
+"""
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .config import validate_settings
+from .db_init import init_db
+
+# 主进程完成准备工作并启动生产工作进程前设置，工作进程通过环境变量继承
+PREPARED_ENV = "APP_RUNTIME_PREPARED"
+
+STATIC_ROOT = "static"
+TEMP_ROOT = "temp"
+DB_ROOT = "database"
+
+_LOCK_FILE = os.path.join(DB_ROOT, ".startup.lock")
+
+
+def _make_dirs():
+    # 静态文件目录 - 所有静态文件都放在backend/static下
+    for name in ("images", "speech", "subtitles", "audio", "videos"):
+        os.makedirs(os.path.join(STATIC_ROOT, name), exist_ok=True)
+    # 临时文件目录 - 所有临时文件都放在backend/temp下
+    for name in ("audio", "video"):
+        os.makedirs(os.path.join(TEMP_ROOT, name), exist_ok=True)
+    os.makedirs(DB_ROOT, exist_ok=True)
+
+
+@contextmanager
+def _startup_lock() -> Iterator[None]:
+    """同一台机器上的进程依次执行准备工作"""
+    os.makedirs(DB_ROOT, exist_ok=True)
+    with open(_LOCK_FILE, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def prepare_runtime():
+    """执行启动准备工作"""
+    with _startup_lock():
+        validate_settings()
+        _make_dirs()
+        init_db()
+
+
+def mark_prepared():
+    """标记准备工作已完成，之后启动的工作进程跳过（只在启动生产工作进程前调用）"""
+    os.environ[PREPARED_ENV] = "1"
+
+
+def ensure_runtime():
+    """尚未由主进程完成准备工作时执行（各准备步骤都可以重复执行）"""
+    if os.environ.get(PREPARED_ENV) != "1":
+        prepare_runtime()
@@ -75,6 +75,30 @@ IMAGE_SIZES = {
 }
 
 
+# 音频存储格式映射：文件扩展名、HTTP媒体类型和ffmpeg编码器
+AUDIO_STORAGE_FORMATS = {
+    "mp3": {"ext": ".mp3", "media_type": "audio/mpeg", "codec": "libmp3lame"},
+    "opus": {"ext": ".ogg", "media_type": "audio/ogg", "codec": "libopus"},
+    "aac": {"ext": ".m4a", "media_type": "audio/mp4", "codec": "aac"},
+}
+
+
+# 支持的视频渲染引擎
+VIDEO_RENDER_ENGINES = ("segments", "filtergraph")
+
+# 支持的字幕模式：burn 烧录到画面 / soft 封装为MP4软字幕轨道 / sidecar WebVTT旁路文件
+SUBTITLE_MODES = ("burn", "soft", "sidecar")
+
+# 支持的视频输出格式：mp4 单文件 / hls 分片播放列表（首个分片到达即可开始播放）
+VIDEO_OUTPUT_FORMATS = ("mp4", "hls")
+
+# HLS码率档位：source 直接复制成片的音视频流，其余档位按指定分辨率和码率重新编码
+HLS_RENDITIONS = {
+    "source": {"copy": True},
+    "360p": {"width": 640, "height": 360, "video_bitrate": "500k", "audio_bitrate": "64k"},
+}
+
+
 class Settings(BaseSettings):
     """应用配置类"""
 
@@ -88,6 +112,11 @@ class Settings(BaseSettings):
 
     # DeepInfra API设置
     DEEPINFRA_API_KEY: str = os.environ.get("DEEPINFRA_API_KEY", "")
+    # 多个密钥（逗号分隔）组成密钥池，未设置时使用 DEEPINFRA_API_KEY
+    DEEPINFRA_API_KEYS: str = os.environ.get("DEEPINFRA_API_KEYS", "")
+    # 单个密钥每分钟的请求数和令牌数上限（图片按张数计），0表示不限制
+    DEEPINFRA_RPM: int = int(os.environ.get("DEEPINFRA_RPM", "60"))
+    DEEPINFRA_TPM: int = int(os.environ.get("DEEPINFRA_TPM", "0"))
     DEFAULT_SEED: int = int(os.environ.get("DEFAULT_SEED", 1))
     # 可用的图片生成模型
     IMAGE_MODELS: list = [
@@ -112,8 +141,126 @@ class Settings(BaseSettings):
     # 临时文件目录
     TEMP_AUDIO_DIR: Path = TEMP_ROOT / "audio"
 
+    # 规范音频格式（TTS输出统一为该格式，保证拼接时可直接 -c copy）
+    AUDIO_SAMPLE_RATE: int = int(os.environ.get("AUDIO_SAMPLE_RATE", "32000"))
+    AUDIO_CHANNELS: int = int(os.environ.get("AUDIO_CHANNELS", "1"))
+    AUDIO_BITRATE: str = os.environ.get("AUDIO_BITRATE", "128k")
+
+    # 音频存储格式：mp3（默认，不转码）/ opus / aac，压缩格式可显著减少磁盘和流量
+    AUDIO_STORAGE_CODEC: str = os.environ.get("AUDIO_STORAGE_CODEC", "mp3")
+    AUDIO_STORAGE_BITRATE: str = os.environ.get("AUDIO_STORAGE_BITRATE", "32k")
+    AUDIO_TRANSCODE_WORKERS: int = int(
+        os.environ.get("AUDIO_TRANSCODE_WORKERS", "2"))
+    # 为不支持压缩格式的旧客户端临时转换出的MP3缓存目录
+    MP3_CACHE_DIR: Path = TEMP_ROOT / "mp3_cache"
+
+    # 波形峰值：播放器绘制进度/波形用的下采样桶数和解码采样率
+    WAVEFORM_BUCKETS: int = int(os.environ.get("WAVEFORM_BUCKETS", "800"))
+    WAVEFORM_SAMPLE_RATE: int = int(
+        os.environ.get("WAVEFORM_SAMPLE_RATE", "8000"))
+
+    # 规范视频片段编码参数（所有片段参数一致，保证拼接时可直接 -c copy）
+    VIDEO_WIDTH: int = int(os.environ.get("VIDEO_WIDTH", "1024"))
+    VIDEO_HEIGHT: int = int(os.environ.get("VIDEO_HEIGHT", "576"))
+    VIDEO_FPS: int = int(os.environ.get("VIDEO_FPS", "25"))
+    VIDEO_PIX_FMT: str = "yuv420p"
+    VIDEO_CODEC: str = "libx264"
+    VIDEO_PRESET: str = os.environ.get("VIDEO_PRESET", "medium")
+    VIDEO_CRF: int = int(os.environ.get("VIDEO_CRF", "23"))
+    VIDEO_AUDIO_CODEC: str = "aac"
+    VIDEO_AUDIO_BITRATE: str = os.environ.get("VIDEO_AUDIO_BITRATE", "128k")
+
+    # 视频渲染引擎：segments（逐页编码后拼接）/ filtergraph（单条滤镜图一次编码，带交叉淡化）
+    VIDEO_RENDER_ENGINE: str = os.environ.get("VIDEO_RENDER_ENGINE", "segments")
+
+    # 字幕模式，默认烧录，兼容不支持软字幕的播放平台
+    VIDEO_SUBTITLE_MODE: str = os.environ.get("VIDEO_SUBTITLE_MODE", "burn")
+
+    # 视频输出格式和HLS切片设置，切片时长与成片档位的GOP（10秒）一致，直接复制流时切片时长固定
+    VIDEO_OUTPUT_FORMAT: str = os.environ.get("VIDEO_OUTPUT_FORMAT", "mp4")
+    HLS_SEGMENT_SECONDS: int = int(os.environ.get("HLS_SEGMENT_SECONDS", "10"))
+    # 默认输出的HLS码率档位，逗号分隔，如 "source,360p"
+    VIDEO_HLS_RENDITIONS: str = os.environ.get("VIDEO_HLS_RENDITIONS", "source")
+
+    # 视频片段缓存：按内容哈希保存已编码的页面片段，只重新编码有变化的页面
+    SEGMENT_CACHE_DIR: Path = Path(
+        os.environ.get("SEGMENT_CACHE_DIR", "cache/segments"))
+    SEGMENT_CACHE_MAX_BYTES: int = int(
+        os.environ.get("SEGMENT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+    # 淘汰缓存时跳过最近这么多秒内生成或命中的片段（预编码后可能即将被整本视频拼接，或正被其他进程使用）
+    SEGMENT_CACHE_MIN_AGE: float = float(os.environ.get("SEGMENT_CACHE_MIN_AGE", "600"))
+
+    # 全局渲染调度：CPU令牌总数和单个渲染任务申请的令牌数（0表示自动：总数为可用核数，单任务最多4个）
+    RENDER_CPU_TOKENS: int = int(os.environ.get("RENDER_CPU_TOKENS", "0"))
+    RENDER_JOB_TOKENS: int = int(os.environ.get("RENDER_JOB_TOKENS", "0"))
+
+    # 视频片段并行编码：并发ffmpeg进程数和每个进程的线程数（0表示按可用核数自动计算）
+    VIDEO_SEGMENT_WORKERS: int = int(os.environ.get("VIDEO_SEGMENT_WORKERS", "0"))
+    VIDEO_THREADS_PER_SEGMENT: int = int(
+        os.environ.get("VIDEO_THREADS_PER_SEGMENT", "0"))
+
+    # 外部进程：ffmpeg/ffprobe超时时间(秒，0表示不限制)和保留的stderr最大字节数
+    FFMPEG_TIMEOUT: float = float(os.environ.get("FFMPEG_TIMEOUT", "1800"))
+    FFPROBE_TIMEOUT: float = float(os.environ.get("FFPROBE_TIMEOUT", "60"))
+    PROCESS_STDERR_LIMIT: int = int(
+        os.environ.get("PROCESS_STDERR_LIMIT", str(64 * 1024)))
+
+    # API准入控制：各路由类别同时处理的请求数和排队上限，排队超过超时时间(秒)返回503
+    ADMISSION_LLM_CONCURRENCY: int = int(os.environ.get("ADMISSION_LLM_CONCURRENCY", "4"))
+    ADMISSION_LLM_QUEUE: int = int(os.environ.get("ADMISSION_LLM_QUEUE", "16"))
+    ADMISSION_IMAGE_CONCURRENCY: int = int(os.environ.get("ADMISSION_IMAGE_CONCURRENCY", "4"))
+    ADMISSION_IMAGE_QUEUE: int = int(os.environ.get("ADMISSION_IMAGE_QUEUE", "16"))
+    ADMISSION_TTS_CONCURRENCY: int = int(os.environ.get("ADMISSION_TTS_CONCURRENCY", "4"))
+    ADMISSION_TTS_QUEUE: int = int(os.environ.get("ADMISSION_TTS_QUEUE", "16"))
+    ADMISSION_RENDER_CONCURRENCY: int = int(os.environ.get("ADMISSION_RENDER_CONCURRENCY", "2"))
+    ADMISSION_RENDER_QUEUE: int = int(os.environ.get("ADMISSION_RENDER_QUEUE", "8"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+    # 请求截止时间：各路由类别接口的总时间预算(秒)，外部调用、排队、重试和ffmpeg都不超过剩余预算，0表示不限制
+    DEADLINE_LLM_SECONDS: float = float(os.environ.get("DEADLINE_LLM_SECONDS", "180"))
+    DEADLINE_IMAGE_SECONDS: float = float(os.environ.get("DEADLINE_IMAGE_SECONDS", "600"))
+    DEADLINE_TTS_SECONDS: float = float(os.environ.get("DEADLINE_TTS_SECONDS", "300"))
+    DEADLINE_RENDER_SECONDS: float = float(os.environ.get("DEADLINE_RENDER_SECONDS", "1800"))
+    # 后台任务（内存任务和持久化任务）的默认时间预算(秒)，0表示不限制
+    JOB_DEADLINE_SECONDS: float = float(os.environ.get("JOB_DEADLINE_SECONDS", "7200"))
+
+    # 优先级通道：交互请求(interactive)优先于批量任务(batch)，批量任务等待超过该时长(秒)后与交互请求同等调度，避免饿死
+    PRIORITY_BATCH_MAX_WAIT: float = float(os.environ.get("PRIORITY_BATCH_MAX_WAIT", "30"))
+
+    # 相同生成请求合并：完成后结果的重放时长(秒，0表示只合并执行中的请求)
+    SINGLE_FLIGHT_REPLAY_TTL: float = float(os.environ.get("SINGLE_FLIGHT_REPLAY_TTL", "60"))
+
+    # 持久化任务队列：in_process 在API进程内运行工作协程，external 只入队（另行运行 python -m api.job_worker）
+    JOB_WORKER_MODE: str = os.environ.get("JOB_WORKER_MODE", "in_process")
+    JOB_WORKER_CONCURRENCY: int = int(os.environ.get("JOB_WORKER_CONCURRENCY", "2"))
+    JOB_POLL_INTERVAL: float = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+    # 执行租约时长(秒)：工作进程定期续约，进程崩溃后租约到期的任务由其他工作进程接手
+    JOB_LEASE_SECONDS: int = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+    JOB_MAX_ATTEMPTS: int = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+    # 任务失败后重新入队的基础等待时间(秒)，按执行次数指数增长
+    JOB_RETRY_BACKOFF: float = float(os.environ.get("JOB_RETRY_BACKOFF", "5"))
+    # 任务内单个步骤（如一页配图）失败时的重试次数
+    JOB_STEP_RETRIES: int = int(os.environ.get("JOB_STEP_RETRIES", "2"))
+
+    # 批量生成绘本：同时执行的条目数（每个工作进程）和每分钟开始的条目数上限
+    BATCH_CONCURRENCY: int = int(os.environ.get("BATCH_CONCURRENCY", "2"))
+    BATCH_ITEMS_PER_MINUTE: int = int(os.environ.get("BATCH_ITEMS_PER_MINUTE", "10"))
+    BATCH_MAX_ITEMS: int = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+
+    # 一键生成绘本：各阶段的并发上限（视频片段编码另受渲染调度器的CPU令牌限制，0表示不限制）
+    BUILD_IMAGE_CONCURRENCY: int = int(os.environ.get("BUILD_IMAGE_CONCURRENCY", "2"))
+    BUILD_TTS_CONCURRENCY: int = int(os.environ.get("BUILD_TTS_CONCURRENCY", "2"))
+    BUILD_SEGMENT_CONCURRENCY: int = int(os.environ.get("BUILD_SEGMENT_CONCURRENCY", "0"))
+
     # 语音API设置
     SILICONFLOW_API_KEY: str = os.environ.get("SILICONFLOW_API_KEY", "")
+    # 多个密钥（逗号分隔）组成密钥池，未设置时使用 SILICONFLOW_API_KEY
+    SILICONFLOW_API_KEYS: str = os.environ.get("SILICONFLOW_API_KEYS", "")
+    # 单个密钥每分钟的请求数和令牌数上限（语音按字符数计），0表示不限制
+    SILICONFLOW_RPM: int = int(os.environ.get("SILICONFLOW_RPM", "60"))
+    SILICONFLOW_TPM: int = int(os.environ.get("SILICONFLOW_TPM", "0"))
+    # 密钥被限流(429)且响应未提供 Retry-After 时的冷却秒数
+    PROVIDER_KEY_COOLDOWN: float = float(os.environ.get("PROVIDER_KEY_COOLDOWN", "30"))
     SILICONFLOW_URL: str = os.environ.get(
         "SILICONFLOW_URL", "https://api.siliconflow.cn/v1")
     SILICONFLOW_MODEL: str = os.environ.get(
@@ -124,6 +271,24 @@ class Settings(BaseSettings):
     # 服务器设置
     HOST: str = os.environ.get("HOST", "0.0.0.0")
     PORT: int = int(os.environ.get("PORT", "8001"))
+    # 运行模式：development 单进程并在代码修改后自动重载，production 多工作进程、不重载
+    SERVER_MODE: str = os.environ.get("SERVER_MODE", "development")
+    # production 模式的工作进程数，0表示按CPU核数。
+    # 渲染CPU令牌(RENDER_CPU_TOKENS)、准入并发和排队上限(ADMISSION_*)、密钥额度(*_RPM/*_TPM)和批量开始速率
+    # (BATCH_ITEMS_PER_MINUTE)都是整个服务的总量，由各工作进程均分（见 per_process）；
+    # 相同请求合并(SingleFlight)只在同一进程内生效；后台任务保存在持久化队列中，任意进程都可以查询和取消
+    SERVER_WORKERS: int = int(os.environ.get("SERVER_WORKERS", "0"))
+    # 实际运行的工作进程数，由 run.py 启动多工作进程时设置；直接使用 uvicorn --workers 启动时需手动设置为相同值
+    SERVER_PROCESS_COUNT: int = int(os.environ.get("SERVER_PROCESS_COUNT", "1"))
+    # 事件循环(auto/uvloop/asyncio)和HTTP解析(auto/httptools/h11)实现，auto 在已安装时使用 uvloop 和 httptools
+    SERVER_LOOP: str = os.environ.get("SERVER_LOOP", "auto")
+    SERVER_HTTP: str = os.environ.get("SERVER_HTTP", "auto")
+    # 空闲keep-alive连接的保持时长(秒)，位于反向代理之后时应大于代理的空闲超时
+    SERVER_KEEPALIVE_TIMEOUT: int = int(os.environ.get("SERVER_KEEPALIVE_TIMEOUT", "30"))
+    # 监听套接字的等待连接队列长度
+    SERVER_BACKLOG: int = int(os.environ.get("SERVER_BACKLOG", "2048"))
+    # 关闭时停止接受新连接后等待进行中请求完成的最长时间(秒)，超时后强制关闭
+    SERVER_GRACEFUL_TIMEOUT: int = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", "30"))
 
     class Config:
         env_file = ".env"
@@ -134,6 +299,47 @@ class Settings(BaseSettings):
 # 创建全局设置实例
 settings = Settings()
 
+# 视频渲染档位：preview 供编辑时快速预览（低分辨率、低帧率、最快编码），
+# final 为最终成片（slow 编码 + 静态画面调优 + 长GOP，同等码率下画质更好）
+RENDER_PROFILES = {
+    "preview": {
+        "width": 640,
+        "height": 360,
+        "fps": 2,
+        "preset": "ultrafast",
+        "tune": "stillimage",
+        "crf": 30,
+        "gop": 20,
+        "audio_bitrate": "64k",
+        # 预览是交互操作，优先于成片调度
+        "priority": 0,
+    },
+    "final": {
+        "width": settings.VIDEO_WIDTH,
+        "height": settings.VIDEO_HEIGHT,
+        "fps": settings.VIDEO_FPS,
+        "preset": "slow",
+        "tune": "stillimage",
+        "crf": settings.VIDEO_CRF,
+        "gop": settings.VIDEO_FPS * 10,
+        "audio_bitrate": settings.VIDEO_AUDIO_BITRATE,
+        "priority": 10,
+    },
+}
+
+
+def per_process(limit: int) -> int:
+    """
+    把整个服务的限额平均分给各工作进程（每个进程至少1），0（不限制）保持不变
+
+    限流器和闸门都在进程内实现，多工作进程部署时按该份额创建，总量不超过配置值
+    """
+    processes = max(1, settings.SERVER_PROCESS_COUNT)
+    if limit <= 0 or processes == 1:
+        return limit
+    return max(1, limit // processes)
+
+
 # 验证必要设置
 
 
@@ -142,10 +348,10 @@ def validate_settings():
     if not settings.GEMINI_API_KEY:
         raise ValueError("未设置GEMINI_API_KEY环境变量，请在.env文件中添加")
 
-    if not settings.SILICONFLOW_API_KEY:
-        raise ValueError("未设置SILICONFLOW_API_KEY环境变量，请在.env文件中添加")
+    if not (settings.SILICONFLOW_API_KEY or settings.SILICONFLOW_API_KEYS):
+        raise ValueError("未设置SILICONFLOW_API_KEY或SILICONFLOW_API_KEYS环境变量，请在.env文件中添加")
 
-    if not settings.DEEPINFRA_API_KEY:
-        raise ValueError("未设置DEEPINFRA_API_KEY环境变量，请在.env文件中添加")
+    if not (settings.DEEPINFRA_API_KEY or settings.DEEPINFRA_API_KEYS):
+        raise ValueError("未设置DEEPINFRA_API_KEY或DEEPINFRA_API_KEYS环境变量，请在.env文件中添加")
 
     # 可以添加更多验证
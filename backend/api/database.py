@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -11,14 +12,31 @@ DB_DIR.mkdir(exist_ok=True)
 
 # 数据库URL
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_DIR}/app.db"
+# 异步接口使用的数据库URL（同一个数据库文件，通过 aiosqlite 访问）
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DB_DIR}/app.db"
 
-# 创建SQLAlchemy引擎
+# 创建SQLAlchemy引擎（独立的任务工作进程会同时写库，写锁等待最多30秒）
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30}
 )
 
+
+# 异步引擎：async 接口中的数据库操作在 aiosqlite 的后台线程中执行，提交时不阻塞事件循环
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, connect_args={"timeout": 30})
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """WAL模式下读写互不阻塞，API进程和任务工作进程可以并发访问"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 异步会话工厂（提交后不使对象过期，避免在异步上下文中隐式加载属性）
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # 创建Base类
 Base = declarative_base()
@@ -29,4 +47,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# 获取异步数据库会话的依赖项（用于 async 接口）
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,9 +1,33 @@
+from sqlalchemy import inspect, text
 from .database import engine, Base
 from . import db_models
 
+def _add_missing_columns():
+    """为已存在的表补充后来新增的可空列（create_all 不会修改已存在的表）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+def _add_missing_indexes():
+    """为已存在的表补充后来新增的索引"""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
 def init_db():
     """初始化数据库，创建所有表"""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _add_missing_indexes()
 
 if __name__ == "__main__":
     init_db()
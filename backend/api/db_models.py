@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey, Enum, JSON
+from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey, Enum, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -86,7 +86,7 @@ class Image(Base):
     __tablename__ = "images"
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    story_id = Column(String(36), ForeignKey("stories.id"), nullable=False)
+    story_id = Column(String(36), ForeignKey("stories.id"), nullable=False, index=True)
     paragraph_id = Column(String(36), ForeignKey("paragraphs.id"), nullable=True)
     image_description_id = Column(String(36), ForeignKey("image_descriptions.id"), nullable=False)
     file_path = Column(String(255), nullable=False, comment="文件路径")
@@ -122,11 +122,52 @@ class Video(Base):
     __tablename__ = "videos"
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    story_id = Column(String(36), ForeignKey("stories.id"), nullable=False)
+    story_id = Column(String(36), ForeignKey("stories.id"), nullable=False, index=True)
     file_path = Column(String(255), nullable=False, comment="文件路径")
     duration = Column(Float, nullable=True, comment="视频时长(秒)")
     resolution = Column(String(20), nullable=True, comment="视频分辨率")
+    playlist_path = Column(String(255), nullable=True, comment="HLS主播放列表路径")
     created_at = Column(DateTime, default=func.now(), comment="创建时间")
     
     # 关系
-    story = relationship("Story", back_populates="videos") 
\ No newline at end of file
+    story = relationship("Story", back_populates="videos")
+
+class BackgroundJob(Base):
+    """持久化后台任务表"""
+    __tablename__ = "background_jobs"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    kind = Column(String(50), nullable=False, index=True, comment="任务类型")
+    status = Column(String(20), nullable=False, default="pending", index=True, comment="任务状态")
+    payload = Column(JSON, nullable=False, comment="任务参数")
+    result = Column(JSON, nullable=True, comment="任务结果")
+    error = Column(Text, nullable=True, comment="最近一次错误信息")
+    progress = Column(Float, nullable=False, default=0.0, comment="进度百分比")
+    attempts = Column(Integer, nullable=False, default=0, comment="已执行次数")
+    max_attempts = Column(Integer, nullable=False, default=3, comment="最多执行次数")
+    lane = Column(String(20), nullable=True, default="batch", comment="优先级通道(interactive/batch)")
+    deadline_at = Column(Float, nullable=True, comment="截止时间(Unix时间戳)，超过后不再执行或重试")
+    batch_id = Column(String(36), nullable=True, index=True, comment="所属批量任务ID")
+    batch_index = Column(Integer, nullable=True, comment="在批量任务中的序号")
+    worker_id = Column(String(100), nullable=True, comment="当前执行的工作进程")
+    available_at = Column(Float, nullable=False, comment="最早可执行时间(Unix时间戳)")
+    lease_expires_at = Column(Float, nullable=True, comment="执行租约到期时间(Unix时间戳)")
+    created_at = Column(DateTime, default=func.now(), comment="创建时间")
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment="更新时间")
+
+    # 关系
+    checkpoints = relationship("JobCheckpoint", back_populates="job", cascade="all, delete-orphan")
+
+class JobCheckpoint(Base):
+    """后台任务阶段检查点表"""
+    __tablename__ = "job_checkpoints"
+    __table_args__ = (UniqueConstraint("job_id", "key"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(36), ForeignKey("background_jobs.id"), nullable=False, index=True)
+    key = Column(String(100), nullable=False, comment="阶段节点标识")
+    value = Column(JSON, nullable=True, comment="阶段产物")
+    created_at = Column(DateTime, default=func.now(), comment="创建时间")
+
+    # 关系
+    job = relationship("BackgroundJob", back_populates="checkpoints")
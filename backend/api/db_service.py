@@ -1,4 +1,5 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session, selectinload
 from typing import List, Dict, Any, Optional
 import json
 from . import db_models
@@ -20,13 +21,70 @@ def create_story(db: Session, story_request: models.StoryRequest) -> db_models.S
     db.refresh(db_story)
     return db_story
 
-def get_story(db: Session, story_id: str) -> Optional[db_models.Story]:
-    """获取故事记录"""
-    return db.query(db_models.Story).filter(db_models.Story.id == story_id).first()
+# story_to_response 用到的关联关系：每个关联用一条 IN 查询批量加载，查询次数与故事数量无关
+_STORY_DETAILS = tuple(
+    selectinload(getattr(db_models.Story, name))
+    for name in ("paragraphs", "characters", "image_descriptions", "images", "speeches", "videos")
+)
+
+def get_story(db: Session, story_id: str, with_details: bool = False) -> Optional[db_models.Story]:
+    """
+    获取故事记录
+
+    Args:
+        with_details: 是否同时加载段落、人物、图片描述、图片、语音和视频（用于 story_to_response）
+    """
+    query = db.query(db_models.Story)
+    if with_details:
+        query = query.options(*_STORY_DETAILS)
+    return query.filter(db_models.Story.id == story_id).first()
 
 def get_stories(db: Session, skip: int = 0, limit: int = 100) -> List[db_models.Story]:
-    """获取故事列表"""
-    return db.query(db_models.Story).order_by(db_models.Story.created_at.desc()).offset(skip).limit(limit).all()
+    """获取故事列表，同时加载 story_to_response 用到的所有关联（共7条查询）"""
+    return db.query(db_models.Story).options(*_STORY_DETAILS).order_by(
+        db_models.Story.created_at.desc()).offset(skip).limit(limit).all()
+
+def get_story_summaries(db: Session, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    获取故事列表的摘要（标题、主题、封面、页数和时间），供列表页使用
+
+    只查询需要的列，最新的封面图片和是否已有视频通过相关子查询在同一条SQL中得到
+    """
+    story = db_models.Story
+    cover = (
+        select(db_models.Image.file_path)
+        .where(db_models.Image.story_id == story.id, db_models.Image.is_cover.is_(True))
+        .order_by(db_models.Image.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    has_video = exists().where(db_models.Video.story_id == story.id)
+    rows = db.execute(
+        select(
+            story.id, story.theme, story.story_type, story.age_range, story.language, story.pages,
+            story.created_at, story.updated_at,
+            cover.label("cover_image"), has_video.label("has_video")
+        )
+        .order_by(story.created_at.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return [
+        {
+            "id": row.id,
+            # 故事没有单独的标题字段，与一键生成一致使用主题作为标题
+            "title": row.theme,
+            "theme": row.theme,
+            "story_type": row.story_type,
+            "age_range": row.age_range,
+            "language": row.language,
+            "pages": row.pages,
+            "cover_image": row.cover_image,
+            "has_video": bool(row.has_video),
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        } for row in rows
+    ]
 
 def delete_story(db: Session, story_id: str) -> bool:
     """删除故事记录"""
@@ -191,20 +249,29 @@ def get_speeches(db: Session, story_id: str) -> List[db_models.Speech]:
     """获取故事的所有语音"""
     return db.query(db_models.Speech).filter(db_models.Speech.story_id == story_id).all()
 
+def get_speech(db: Session, story_id: str, paragraph_id: str) -> Optional[db_models.Speech]:
+    """获取故事中某个段落的最新语音"""
+    return db.query(db_models.Speech).filter(
+        db_models.Speech.story_id == story_id,
+        db_models.Speech.paragraph_id == paragraph_id
+    ).order_by(db_models.Speech.created_at.desc()).first()
+
 # Video 相关操作
 def create_video(
     db: Session,
     story_id: str,
     file_path: str,
     duration: float = None,
-    resolution: str = None
+    resolution: str = None,
+    playlist_path: str = None
 ) -> db_models.Video:
     """创建视频记录"""
     db_video = db_models.Video(
         story_id=story_id,
         file_path=file_path,
         duration=duration,
-        resolution=resolution
+        resolution=resolution,
+        playlist_path=playlist_path
     )
     db.add(db_video)
     db.commit()
@@ -256,6 +323,8 @@ def story_to_response(story: db_models.Story) -> Dict[str, Any]:
     
     # 获取视频
     videos = [video.file_path for video in story.videos]
+    # HLS播放列表，与 videos 一一对应，未生成HLS的视频为 None
+    video_playlists = [video.playlist_path for video in story.videos]
     
     return {
         "id": story.id,
@@ -272,5 +341,6 @@ def story_to_response(story: db_models.Story) -> Dict[str, Any]:
         "image_descriptions": image_descriptions,
         "images": images,
         "speeches": speeches,
-        "videos": videos
+        "videos": videos,
+        "video_playlists": video_playlists
     } 
\ No newline at end of file
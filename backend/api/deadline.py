@@ -0,0 +1,113 @@
+"""
+请求级截止时间
+
+每个接口（按路由类别）或后台任务设置一个总的时间预算，保存在上下文变量中，随请求传递到 services 中的各个阶段：
+外部API调用、ffmpeg子进程、排队等待和重试都以剩余预算为上限，预算用尽时抛出 DeadlineExceeded，
+由调用方决定返回已完成的部分结果还是返回504。
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, Tuple, TypeVar
+
+from fastapi import Depends, Header
+
+from .config import settings
+from . import metrics
+
+T = TypeVar("T")
+
+# 客户端通过该请求头声明愿意等待的秒数，与接口的默认预算取较小值
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# 截止时间（time.monotonic() 时钟），None 表示不限制
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """请求的时间预算已用尽"""
+
+    def __init__(self, stage: str = ""):
+        super().__init__(f"请求已超过截止时间{f'（{stage}）' if stage else ''}")
+        self.stage = stage
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    在指定预算内执行，已有更早的截止时间时保持不变；其中创建的任务继承截止时间
+
+    Args:
+        seconds: 时间预算(秒)，None或不大于0表示不额外限制
+    """
+    current = _deadline.get()
+    if seconds and seconds > 0:
+        candidate = time.monotonic() + seconds
+        current = candidate if current is None else min(current, candidate)
+    token = _deadline.set(current)
+    try:
+        yield current
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """剩余预算(秒)，None 表示不限制"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(stage: str = ""):
+    """预算已用尽时抛出 DeadlineExceeded"""
+    budget = remaining()
+    if budget is not None and budget <= 0:
+        metrics.incr("deadline.exceeded")
+        raise DeadlineExceeded(stage)
+
+
+def limit_timeout(timeout: Optional[float], stage: str = "") -> Tuple[Optional[float], bool]:
+    """
+    把单次调用自己的超时时间限制在剩余预算内
+
+    Returns:
+        Tuple[Optional[float], bool]: 实际超时时间（None表示不限制），以及是否由截止时间决定
+    """
+    check_deadline(stage)
+    budget = remaining()
+    if budget is None:
+        return timeout or None, False
+    if not timeout or budget < timeout:
+        return budget, True
+    return timeout, False
+
+
+async def within_deadline(aw: Awaitable[T], stage: str = "") -> T:
+    """在剩余预算内等待，超时时取消等待并抛出 DeadlineExceeded"""
+    budget = remaining()
+    if budget is None:
+        return await aw
+    if budget <= 0:
+        # 不再执行尚未开始的协程
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        check_deadline(stage)
+    try:
+        return await asyncio.wait_for(aw, budget)
+    except asyncio.TimeoutError:
+        metrics.incr("deadline.exceeded")
+        raise DeadlineExceeded(stage)
+
+
+def request_deadline(route_class: str):
+    """
+    FastAPI依赖：请求在路由类别的默认预算（DEADLINE_<类别>_SECONDS）和 X-Request-Timeout 中较小者内完成
+
+    需要放在 admission 依赖之前，使排队等待也受预算限制
+    """
+    async def dependency(x_request_timeout: Optional[float] = Header(None)):
+        budgets = [b for b in (getattr(settings, f"DEADLINE_{route_class.upper()}_SECONDS"), x_request_timeout)
+                   if b and b > 0]
+        with deadline_scope(min(budgets) if budgets else None):
+            yield
+    return Depends(dependency)
@@ -0,0 +1,56 @@
+"""
+客户端断开时取消请求处理
+
+用户离开页面或重新开始时浏览器会中止请求，但服务端默认仍会把已发出的Gemini、DeepInfra、TTS调用和ffmpeg渲染执行完。
+该中间件在响应完成前收到断开消息时取消请求的处理任务，取消会传递到下游的生成调用和ffmpeg子进程，及时释放容量。
+"""
+import asyncio
+
+from . import metrics
+from utils.logger import logger
+
+
+class CancelOnDisconnectMiddleware:
+    """ASGI中间件：响应完成前客户端断开时取消请求处理"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages: asyncio.Queue = asyncio.Queue()
+        state = {"response_complete": False, "disconnected": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["response_complete"] = True
+            await send(message)
+
+        # 处理任务继承当前上下文（如优先级通道）
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+
+        async def listen():
+            # 持续读取请求消息并转交给处理任务，从中发现断开消息
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not state["response_complete"] and not handler.done():
+                        state["disconnected"] = True
+                        metrics.incr("http.client_disconnected")
+                        logger.info(f"客户端已断开，取消请求处理: {scope['method']} {scope['path']}")
+                        handler.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                handler.cancel()
+                raise
+        finally:
+            listener.cancel()
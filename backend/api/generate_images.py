@@ -1,17 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Header
 from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
 from .services import generate_images
 from .models import (
     ImageGenerationRequest, ImageGenerationResponse
 )
 from .config import IMAGE_SIZES
 from pydantic import BaseModel, Field
-from .database import get_db
-from . import db_service
+from .database import AsyncSessionLocal
+from . import async_db_service
+from .single_flight import SingleFlight, IdempotencyConflict
+from .admission import admission
+from .deadline import DeadlineExceeded, request_deadline
 
 image_router = APIRouter(tags=["图片生成"])
 
+# 合并重复的图片生成请求
+_image_flights = SingleFlight("generate_images")
+
 
 # 添加新的请求模型
 class PromptImageGenerationRequest(BaseModel):
@@ -29,23 +34,9 @@ class PromptImageGenerationRequest(BaseModel):
         protected_namespaces = ()
 
 
-@image_router.post("/generate-images-from-prompts", response_model=ImageGenerationResponse)
-async def create_images_from_prompts(request: PromptImageGenerationRequest, db: Session = Depends(get_db)):
-    """
-    直接根据提示词生成图片API
-
-    - **title**: 图片标题，用于命名生成的图片文件
-    - **cover_description**: 封面图片描述
-    - **descriptions**: 内容图片描述列表
-    - **aspect_ratio**: 图片比例 (默认 16:9)
-    - **num**: 每个描述生成的图片数量 (默认 1)
-    - **image_model**: 图片生成模型名称 (可选)
-    - **seed**: 随机种子值，用于固定生成结果 (可选)
-    - **story_id**: 故事ID，用于关联到数据库 (可选)
-
-    返回生成图片的路径列表
-    """
-    try:
+async def _generate_images_from_prompts(request: PromptImageGenerationRequest) -> ImageGenerationResponse:
+    """生成图片并保存到数据库；使用独立的数据库会话，合并的请求共享结果时不依赖发起请求的会话"""
+    async with AsyncSessionLocal() as db:
         # 合并封面描述和内容描述
         all_descriptions = [request.cover_description] + request.descriptions
 
@@ -60,16 +51,16 @@ async def create_images_from_prompts(request: PromptImageGenerationRequest, db:
 
         # 如果提供了故事ID，保存到数据库
         if request.story_id:
-            story = db_service.get_story(db, request.story_id)
+            story = await async_db_service.get_story(db, request.story_id)
             if story:
                 # 获取图片描述
-                image_descriptions = db_service.get_image_descriptions(db, request.story_id)
-                
+                image_descriptions = await async_db_service.get_image_descriptions(db, request.story_id)
+
                 # 保存封面图片
                 if image_paths and len(image_paths) > 0:
                     cover_desc = next((desc for desc in image_descriptions if desc.is_cover), None)
                     if cover_desc:
-                        db_service.create_image(
+                        await async_db_service.create_image(
                             db,
                             request.story_id,
                             cover_desc.id,
@@ -79,14 +70,14 @@ async def create_images_from_prompts(request: PromptImageGenerationRequest, db:
                             request.image_model,
                             request.seed
                         )
-                
+
                 # 保存内容图片
-                paragraphs = db_service.get_paragraphs(db, request.story_id)
+                paragraphs = await async_db_service.get_paragraphs(db, request.story_id)
                 for i, path in enumerate(image_paths[1:], 0):
                     if i < len(paragraphs):
                         desc = next((desc for desc in image_descriptions if desc.paragraph_id == paragraphs[i].id), None)
                         if desc:
-                            db_service.create_image(
+                            await async_db_service.create_image(
                                 db,
                                 request.story_id,
                                 desc.id,
@@ -102,6 +93,37 @@ async def create_images_from_prompts(request: PromptImageGenerationRequest, db:
             status="success",
             image_paths=image_paths
         )
+
+
+@image_router.post("/generate-images-from-prompts", response_model=ImageGenerationResponse,
+                   dependencies=[request_deadline("image"), admission("image")])
+async def create_images_from_prompts(
+    request: PromptImageGenerationRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    直接根据提示词生成图片API
+
+    - **title**: 图片标题，用于命名生成的图片文件
+    - **cover_description**: 封面图片描述
+    - **descriptions**: 内容图片描述列表
+    - **aspect_ratio**: 图片比例 (默认 16:9)
+    - **num**: 每个描述生成的图片数量 (默认 1)
+    - **image_model**: 图片生成模型名称 (可选)
+    - **seed**: 随机种子值，用于固定生成结果 (可选)
+    - **story_id**: 故事ID，用于关联到数据库 (可选)
+    - **Idempotency-Key** 请求头: 幂等键 (可选)
+
+    相同的请求（或相同的幂等键）在执行中时合并为一次生成，完成后短时间内直接返回同一结果。
+    返回生成图片的路径列表
+    """
+    try:
+        return await _image_flights.run(
+            request.dict(), lambda: _generate_images_from_prompts(request), idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2,22 +2,34 @@ import os
 import time
 from pathlib import Path
 from openai import OpenAI
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Header
 from typing import List, Dict, Any, Union, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .services import generate_speech, split_text, generate_paragraph_audio, create_paragraph_video
+from .services import generate_speech, split_text, generate_paragraph_audio, create_paragraph_video, remux_subtitles, hls_playlist_path
 from .models import (
     SpeechGenerationRequest, SpeechGenerationResponse,
     TextSplitRequest, TextSplitResponse
 )
 from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
-from .database import get_db
-from . import db_service
+from .database import get_db, get_async_db, AsyncSessionLocal
+from .config import settings, RENDER_PROFILES
+from . import async_db_service, job_queue
+from .audio_storage import negotiate_audio, schedule_compaction
+from .jobs import ProgressCallback
+from .job_queue import JobContext, register_job_handler
+from .priority import INTERACTIVE
+from .single_flight import SingleFlight, IdempotencyConflict
+from .admission import admission, admission_check, get_gate
+from .deadline import DeadlineExceeded, request_deadline
 
 # 创建路由
 speech_router = APIRouter(tags=["语音生成"])
 
+# 合并重复的段落语音生成请求
+_paragraph_audio_flights = SingleFlight("paragraph_audio")
+
 # 段落语音生成请求模型
 class ParagraphAudioRequest(BaseModel):
     title: str = Field(..., description="标题")
@@ -32,6 +44,8 @@ class ParagraphAudioResponse(BaseModel):
     audio_paths: List[str] = Field(..., description="音频文件路径列表")
     subtitle_paths: List[str] = Field(..., description="字幕文件路径列表")
     paragraph_ids: List[str] = Field(..., description="段落ID列表")
+    peaks_paths: List[Optional[str]] = Field(
+        default=[], description="波形峰值文件路径列表，用于播放器在音频加载前绘制波形")
 
 # 段落视频生成请求模型
 class ParagraphVideoRequest(BaseModel):
@@ -42,16 +56,43 @@ class ParagraphVideoRequest(BaseModel):
     output_filename: str = Field(None, description="输出视频文件名，默认根据时间戳生成")
     transition_duration: float = Field(1.0, description="图片过渡持续时间(秒)")
     fade_duration: float = Field(0.5, description="淡入淡出持续时间(秒)")
+    render_engine: Optional[str] = Field(
+        None, description="渲染引擎：segments（逐页编码后拼接）或 filtergraph（单次编码，页面间交叉淡化）",
+        example="filtergraph")
+    profile: str = Field("final", description="渲染档位：preview（快速预览）或 final（最终成片）",
+                         example="preview")
+    subtitle_mode: Optional[str] = Field(
+        None, description="字幕模式：burn（烧录到画面）、soft（MP4软字幕轨道）或 sidecar（WebVTT旁路文件）",
+        example="soft")
+    output_format: Optional[str] = Field(
+        None, description="输出格式：mp4（单文件）或 hls（额外生成分片播放列表，首个分片到达即可播放）",
+        example="hls")
+    hls_renditions: Optional[List[str]] = Field(
+        None, description="HLS码率档位，如 [\"source\", \"360p\"]", example=["source", "360p"])
     story_id: Optional[str] = Field(None, description="故事ID，用于关联到数据库")
 
 # 段落视频生成响应模型
 class ParagraphVideoResponse(BaseModel):
     status: str = Field(..., description="响应状态", example="success")
     video_path: str = Field(..., description="生成的视频文件路径")
+    subtitle_path: Optional[str] = Field(None, description="WebVTT旁路字幕文件路径，仅 sidecar 模式返回")
+    playlist_path: Optional[str] = Field(None, description="HLS主播放列表路径，仅 hls 输出格式返回")
+
+# 后台任务响应模型
+class JobResponse(BaseModel):
+    status: str = Field(..., description="任务状态", example="pending")
+    job_id: str = Field(..., description="任务ID，通过 /jobs/{job_id} 查询进度和结果")
+
+# 字幕重新封装请求模型
+class SubtitleRemuxRequest(BaseModel):
+    video_path: str = Field(..., description="已生成的视频文件路径")
+    subtitle_paths: List[str] = Field(..., description="新的字幕文件路径列表，与视频页面一一对应", min_items=1)
+    subtitle_mode: str = Field("soft", description="字幕模式：soft 或 sidecar", example="soft")
 
 
-@speech_router.post("/generate", response_model=SpeechGenerationResponse)
-async def create_speech(request: SpeechGenerationRequest, db: Session = Depends(get_db)):
+@speech_router.post("/generate", response_model=SpeechGenerationResponse,
+                    dependencies=[request_deadline("tts"), admission("tts")])
+async def create_speech(request: SpeechGenerationRequest):
     """
     生成语音API
 
@@ -66,32 +107,40 @@ async def create_speech(request: SpeechGenerationRequest, db: Session = Depends(
             emotion=request.emotion
         )
 
+        # 单句语音直接在后台转为压缩存储格式
+        schedule_compaction(speech_path)
+
         return SpeechGenerationResponse(
             status="success",
             speech_path=speech_path
         )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @speech_router.get("/download/{filename}")
-async def download_speech(filename: str):
+async def download_speech(filename: str, request: Request):
     """
     下载语音文件API
 
     - **filename**: 语音文件名
 
-    返回语音文件
+    根据请求的Accept头返回压缩格式（Opus/AAC）或MP3格式的语音文件
     """
     try:
-        file_path = Path(f"static/speech/{filename}")
-        if not file_path.exists():
+        negotiated = await negotiate_audio(
+            Path(f"static/speech/{filename}"), request.headers.get("accept", ""))
+        if not negotiated:
             raise HTTPException(status_code=404, detail="文件不存在")
 
+        file_path, media_type = negotiated
         return FileResponse(
             path=file_path,
-            filename=filename,
-            media_type="audio/mpeg"
+            filename=f"{Path(filename).stem}{file_path.suffix}",
+            media_type=media_type,
+            headers={"Vary": "Accept"}
         )
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -115,8 +164,67 @@ async def get_emotions():
     return emotions
 
 
-@speech_router.post("/generate_paragraph_audio", response_model=ParagraphAudioResponse)
-async def create_paragraph_audio(request: ParagraphAudioRequest, db: Session = Depends(get_db)):
+async def _generate_paragraph_audio(
+    request: ParagraphAudioRequest,
+    db: AsyncSession,
+    on_progress: ProgressCallback = None
+) -> ParagraphAudioResponse:
+    """生成段落语音并保存到数据库，供同步接口和后台任务共用"""
+    # 生成音频和字幕
+    results = await generate_paragraph_audio(
+        title=request.title,
+        paragraphs=request.paragraphs,
+        emotion=request.emotion,
+        on_progress=on_progress
+    )
+    
+    # 从结果中提取音频路径、字幕路径和段落ID
+    audio_paths = []
+    subtitle_paths = []
+    paragraph_ids = []
+    peaks_paths = []
+    durations = []
+    
+    for result in results:
+        if "error" not in result:
+            audio_paths.append(result["audio_path"])
+            subtitle_paths.append(result["subtitle_path"])
+            paragraph_ids.append(result["paragraph_id"])
+            peaks_paths.append(result.get("peaks_path"))
+            durations.append(result.get("duration"))
+
+    # 如果提供了故事ID和段落ID，保存到数据库
+    if request.story_id and request.paragraph_ids:
+        story = await async_db_service.get_story(db, request.story_id)
+        if story and len(audio_paths) == len(request.paragraph_ids):
+            for i, (audio_path, paragraph_id) in enumerate(zip(audio_paths, request.paragraph_ids)):
+                # 音频时长在计算波形峰值时已经得到
+                duration = durations[i] or 0.0
+                
+                await async_db_service.create_speech(
+                    db,
+                    request.story_id,
+                    paragraph_id,
+                    audio_path,
+                    request.emotion,
+                    duration
+                )
+
+    return ParagraphAudioResponse(
+        status="success",
+        audio_paths=audio_paths,
+        subtitle_paths=subtitle_paths,
+        paragraph_ids=paragraph_ids,
+        peaks_paths=peaks_paths
+    )
+
+
+@speech_router.post("/generate_paragraph_audio", response_model=ParagraphAudioResponse,
+                    dependencies=[request_deadline("tts"), admission("tts")])
+async def create_paragraph_audio(
+    request: ParagraphAudioRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     生成段落语音API
 
@@ -125,57 +233,108 @@ async def create_paragraph_audio(request: ParagraphAudioRequest, db: Session = D
     - **emotion**: 语音情感类型 (默认 happy)
     - **story_id**: 故事ID，用于关联到数据库 (可选)
     - **paragraph_ids**: 段落ID列表，用于关联到数据库 (可选)
+    - **Idempotency-Key** 请求头: 幂等键 (可选)
 
+    相同的请求（或相同的幂等键）在执行中时合并为一次生成，完成后短时间内直接返回同一结果。
     返回生成的音频文件路径列表和字幕文件路径列表
     """
+    async def run():
+        # 使用独立的数据库会话，合并的请求共享结果时不依赖发起请求的会话
+        async with AsyncSessionLocal() as db:
+            return await _generate_paragraph_audio(request, db)
+
     try:
-        # 生成音频和字幕
-        results = await generate_paragraph_audio(
-            title=request.title,
-            paragraphs=request.paragraphs,
-            emotion=request.emotion
-        )
-        
-        # 从结果中提取音频路径、字幕路径和段落ID
-        audio_paths = []
-        subtitle_paths = []
-        paragraph_ids = []
-        
-        for result in results:
-            if "error" not in result:
-                audio_paths.append(result["audio_path"])
-                subtitle_paths.append(result["subtitle_path"])
-                paragraph_ids.append(result["paragraph_id"])
-
-        # 如果提供了故事ID和段落ID，保存到数据库
-        if request.story_id and request.paragraph_ids:
-            story = db_service.get_story(db, request.story_id)
-            if story and len(audio_paths) == len(request.paragraph_ids):
-                for i, (audio_path, paragraph_id) in enumerate(zip(audio_paths, request.paragraph_ids)):
-                    # 获取音频时长（这里简化处理，实际应该从音频文件中获取）
-                    duration = 0.0
-                    
-                    db_service.create_speech(
-                        db,
-                        request.story_id,
-                        paragraph_id,
-                        audio_path,
-                        request.emotion,
-                        duration
-                    )
-
-        return ParagraphAudioResponse(
-            status="success",
-            audio_paths=audio_paths,
-            subtitle_paths=subtitle_paths,
-            paragraph_ids=paragraph_ids
-        )
+        return await _paragraph_audio_flights.run(request.dict(), run, idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@speech_router.post("/generate_paragraph_video", response_model=ParagraphVideoResponse)
-async def create_video_from_paragraphs(request: ParagraphVideoRequest, db: Session = Depends(get_db)):
+@speech_router.post("/generate_paragraph_audio/jobs", response_model=JobResponse,
+                    dependencies=[admission_check("tts", "paragraph_audio")])
+def create_paragraph_audio_job(request: ParagraphAudioRequest, db: Session = Depends(get_db)):
+    """
+    以后台任务方式生成段落语音API
+
+    参数与 /generate_paragraph_audio 相同，立即返回任务ID；任务保存在持久化队列的交互通道中，
+    通过 GET /jobs/{job_id} 轮询或 GET /jobs/{job_id}/events 订阅进度，完成后结果中包含音频和字幕路径
+    """
+    job = job_queue.enqueue_job(db, "paragraph_audio", request.dict(), lane=INTERACTIVE)
+    return JobResponse(status=job.status, job_id=job.id)
+
+
+@register_job_handler("paragraph_audio")
+async def run_paragraph_audio_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """持久化任务处理函数：payload 为 ParagraphAudioRequest 的参数"""
+    request = ParagraphAudioRequest(**payload)
+    # 后台任务同样占用语音类别的准入名额，排队时不设超时
+    async with get_gate("tts").admit(timeout=None):
+        async with AsyncSessionLocal() as db:
+            response = await _generate_paragraph_audio(request, db, context.on_progress)
+            return response.dict()
+
+
+async def _generate_paragraph_video(
+    request: ParagraphVideoRequest,
+    db: AsyncSession,
+    on_progress: ProgressCallback = None
+) -> ParagraphVideoResponse:
+    """生成段落视频并保存到数据库，供同步接口和后台任务共用"""
+    # 生成视频
+    video_path = await create_paragraph_video(
+        image_paths=request.image_paths,
+        audio_paths=request.audio_paths,
+        subtitle_paths=request.subtitle_paths,
+        output_filename=request.output_filename,
+        transition_duration=request.transition_duration,
+        fade_duration=request.fade_duration,
+        render_engine=request.render_engine,
+        profile=request.profile,
+        subtitle_mode=request.subtitle_mode,
+        output_format=request.output_format,
+        hls_renditions=request.hls_renditions,
+        on_progress=on_progress
+    )
+    subtitle_path = None
+    if (request.subtitle_mode or settings.VIDEO_SUBTITLE_MODE) == "sidecar":
+        subtitle_path = str(Path(video_path).with_suffix(".vtt"))
+    playlist_path = None
+    if (request.output_format or settings.VIDEO_OUTPUT_FORMAT) == "hls":
+        playlist_path = str(hls_playlist_path(video_path))
+
+    # 如果提供了故事ID，保存到数据库
+    if request.story_id:
+        story = await async_db_service.get_story(db, request.story_id)
+        if story:
+            # 获取视频时长（这里简化处理，实际应该从视频文件中获取）
+            duration = 0.0
+            # 视频分辨率即渲染档位的规范分辨率
+            render_profile = RENDER_PROFILES.get(request.profile, RENDER_PROFILES["final"])
+            resolution = f"{render_profile['width']}x{render_profile['height']}"
+            
+            await async_db_service.create_video(
+                db,
+                request.story_id,
+                video_path,
+                duration,
+                resolution,
+                playlist_path
+            )
+
+    return ParagraphVideoResponse(
+        status="success",
+        video_path=video_path,
+        subtitle_path=subtitle_path,
+        playlist_path=playlist_path
+    )
+
+
+@speech_router.post("/generate_paragraph_video", response_model=ParagraphVideoResponse,
+                    dependencies=[request_deadline("render"), admission("render")])
+async def create_video_from_paragraphs(request: ParagraphVideoRequest, db: AsyncSession = Depends(get_async_db)):
     """
     生成段落视频API
 
@@ -185,41 +344,70 @@ async def create_video_from_paragraphs(request: ParagraphVideoRequest, db: Sessi
     - **output_filename**: 输出视频文件名 (可选)
     - **transition_duration**: 图片过渡持续时间(秒) (默认 1.0)
     - **fade_duration**: 淡入淡出持续时间(秒) (默认 0.5)
+    - **render_engine**: 渲染引擎 segments 或 filtergraph (可选)
+    - **profile**: 渲染档位 preview 或 final (默认 final)
+    - **subtitle_mode**: 字幕模式 burn、soft 或 sidecar (可选，默认使用配置值)
+    - **output_format**: 输出格式 mp4 或 hls (可选，默认使用配置值)
+    - **hls_renditions**: HLS码率档位列表 (可选)
     - **story_id**: 故事ID，用于关联到数据库 (可选)
 
     返回生成的视频文件路径
     """
     try:
-        # 生成视频
-        video_path = await create_paragraph_video(
-            image_paths=request.image_paths,
-            audio_paths=request.audio_paths,
-            subtitle_paths=request.subtitle_paths,
-            output_filename=request.output_filename,
-            transition_duration=request.transition_duration,
-            fade_duration=request.fade_duration
-        )
+        return await _generate_paragraph_video(request, db)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 如果提供了故事ID，保存到数据库
-        if request.story_id:
-            story = db_service.get_story(db, request.story_id)
-            if story:
-                # 获取视频时长（这里简化处理，实际应该从视频文件中获取）
-                duration = 0.0
-                # 获取视频分辨率（这里简化处理，实际应该从视频文件中获取）
-                resolution = "1920x1080"
-                
-                db_service.create_video(
-                    db,
-                    request.story_id,
-                    video_path,
-                    duration,
-                    resolution
-                )
 
+@speech_router.post("/generate_paragraph_video/jobs", response_model=JobResponse,
+                    dependencies=[admission_check("render", "paragraph_video")])
+def create_paragraph_video_job(request: ParagraphVideoRequest, db: Session = Depends(get_db)):
+    """
+    以后台任务方式生成段落视频API
+
+    参数与 /generate_paragraph_video 相同，立即返回任务ID；任务保存在持久化队列的交互通道中，
+    通过 GET /jobs/{job_id} 轮询或 GET /jobs/{job_id}/events 订阅渲染进度，完成后结果中包含视频路径
+    """
+    job = job_queue.enqueue_job(db, "paragraph_video", request.dict(), lane=INTERACTIVE)
+    return JobResponse(status=job.status, job_id=job.id)
+
+
+@register_job_handler("paragraph_video")
+async def run_paragraph_video_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """持久化任务处理函数：payload 为 ParagraphVideoRequest 的参数"""
+    request = ParagraphVideoRequest(**payload)
+    # 后台任务同样占用渲染类别的准入名额，排队时不设超时
+    async with get_gate("render").admit(timeout=None):
+        async with AsyncSessionLocal() as db:
+            response = await _generate_paragraph_video(request, db, context.on_progress)
+            return response.dict()
+
+
+@speech_router.post("/remux_subtitles", response_model=ParagraphVideoResponse,
+                    dependencies=[request_deadline("render"), admission("render")])
+async def remux_video_subtitles(request: SubtitleRemuxRequest):
+    """
+    只更新视频字幕API，无需重新渲染画面
+
+    - **video_path**: 以 soft 或 sidecar 字幕模式生成的视频文件路径
+    - **subtitle_paths**: 修改后的字幕文件路径列表
+    - **subtitle_mode**: soft（重新封装MP4字幕轨道）或 sidecar（重写WebVTT文件）
+
+    返回视频文件路径和旁路字幕文件路径
+    """
+    try:
+        subtitle_path = await remux_subtitles(
+            request.video_path, request.subtitle_paths, request.subtitle_mode)
         return ParagraphVideoResponse(
             status="success",
-            video_path=video_path
+            video_path=request.video_path,
+            subtitle_path=subtitle_path
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Dict
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from .services import generate_story, generate_image_descriptions, generate_images, split_text
 from .models import (
     StoryRequest, StoryResponse,
@@ -10,15 +10,18 @@ from .models import (
 )
 from .config import ArtStyle, AgeRange, IMAGE_SIZES
 from pydantic import BaseModel, Field
-from .database import get_db
-from . import db_service
+from .database import get_async_db
+from . import async_db_service
+from .admission import admission
+from .deadline import DeadlineExceeded, request_deadline
 
 # 创建路由
 story_router = APIRouter(tags=["Story generation"])
 
 
-@story_router.post("/generate-story", response_model=StoryResponse)
-async def create_story(request: StoryRequest, db: Session = Depends(get_db)):
+@story_router.post("/generate-story", response_model=StoryResponse,
+                   dependencies=[request_deadline("llm"), admission("llm")])
+async def create_story(request: StoryRequest, db: AsyncSession = Depends(get_async_db)):
     """
     生成儿童故事API
 
@@ -53,20 +56,23 @@ async def create_story(request: StoryRequest, db: Session = Depends(get_db)):
         ]
 
         # 保存到数据库
-        db_story = db_service.create_story(db, request)
-        db_service.create_paragraphs(db, db_story.id, paragraphs)
-        db_service.create_characters(db, db_story.id, character_descriptions)
+        db_story = await async_db_service.create_story(db, request)
+        await async_db_service.create_paragraphs(db, db_story.id, paragraphs)
+        await async_db_service.create_characters(db, db_story.id, character_descriptions)
 
         return StoryResponse(
             paragraphs=paragraphs,
             characters=character_descriptions
         )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@story_router.post("/generate-image-descriptions", response_model=ImageDescriptionResponse)
-async def create_image_descriptions(request: ImageDescriptionRequest, db: Session = Depends(get_db)):
+@story_router.post("/generate-image-descriptions", response_model=ImageDescriptionResponse,
+                   dependencies=[request_deadline("llm"), admission("llm")])
+async def create_image_descriptions(request: ImageDescriptionRequest, db: AsyncSession = Depends(get_async_db)):
     """
     生成图片描述API
 
@@ -92,9 +98,9 @@ async def create_image_descriptions(request: ImageDescriptionRequest, db: Sessio
 
         # 如果有故事ID，保存到数据库
         if story_id:
-            story = db_service.get_story(db, story_id)
+            story = await async_db_service.get_story(db, story_id)
             if story:
-                db_service.create_image_descriptions(
+                await async_db_service.create_image_descriptions(
                     db, story_id, descriptions, cover_description, request.style.value
                 )
 
@@ -102,6 +108,8 @@ async def create_image_descriptions(request: ImageDescriptionRequest, db: Sessio
             cover_description=cover_description,
             descriptions=descriptions
         )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
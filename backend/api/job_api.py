@@ -0,0 +1,72 @@
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from . import job_queue
+from .jobs import JOB_CANCELLED
+from .job_worker import cancel_local_job
+
+# 创建路由
+job_router = APIRouter(tags=["后台任务"])
+
+
+def _cancel_durable_job(db: Session, job_id: str) -> Optional[bool]:
+    """取消任务，任务不存在时返回None，已结束时返回False"""
+    if not job_queue.get_job(db, job_id):
+        return None
+    return job_queue.cancel_job(db, job_id)
+
+
+@job_router.get("/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    查询后台任务状态
+
+    返回任务状态（pending/running/succeeded/failed/cancelled）、进度百分比，以及完成后的结果或错误信息；
+    任务保存在持久化队列中，可以由任意工作进程查询
+    """
+    snapshot = await job_queue.in_session(job_queue.get_job_snapshot, job_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return snapshot
+
+
+@job_router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    取消后台任务
+
+    执行中的生成请求和ffmpeg子进程随任务取消终止，临时文件被清理，任务状态变为 cancelled；
+    已结束的任务返回409
+    """
+    cancelled = await job_queue.in_session(_cancel_durable_job, job_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    if not cancelled:
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    # 在本进程执行时立即停止，在其他工作进程执行时由其轮询发现
+    cancel_local_job(job_id)
+    return {"job_id": job_id, "status": JOB_CANCELLED}
+
+
+@job_router.get("/{job_id}/events")
+async def subscribe_job_events(job_id: str):
+    """
+    订阅后台任务进度（Server-Sent Events）
+
+    每次状态或进度变化推送一条事件，任务结束后关闭连接；任务可能在其他进程执行，按固定间隔轮询数据库
+    """
+    if not await job_queue.in_session(job_queue.get_job_snapshot, job_id):
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    updates = job_queue.watch_job(job_id)
+
+    async def event_stream():
+        async for snapshot in updates:
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,396 @@
+"""
+持久化后台任务队列
+
+任务保存在SQLite的 background_jobs 表中，API进程重启或崩溃后不会丢失。
+工作进程通过条件更新原子地领取任务并持有执行租约，定期续约；租约过期的任务可被其他工作进程接手。
+任务内部各阶段的产物保存为检查点（job_checkpoints 表），重新执行时跳过已完成的阶段。
+交互通道的任务先于批量任务领取，批量任务等待超过 PRIORITY_BATCH_MAX_WAIT 后按入队顺序同等领取。
+任务有截止时间，执行时作为请求级预算传递给各阶段，超过截止时间后不再领取或重试。
+事件循环中的调用方通过 in_session 在工作线程中执行队列操作，提交和SQLite写锁等待不阻塞事件循环。
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+from sqlalchemy import and_, case, or_
+from sqlalchemy.orm import Session
+
+from . import db_models, metrics
+from .config import settings
+from .database import SessionLocal
+from .key_pool import TokenBucket
+from .jobs import JOB_PENDING, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED, FINISHED_STATES, ProgressCallback
+from .priority import BATCH, INTERACTIVE, normalize_lane, observe_latency
+
+
+class JobContext:
+    """传给任务处理函数的执行上下文"""
+
+    def __init__(self, job: db_models.BackgroundJob, on_progress: ProgressCallback, checkpoints: Dict[str, Any]):
+        self.job_id = job.id
+        self.attempt = job.attempts
+        self.on_progress = on_progress
+        self.checkpoints = checkpoints
+
+    async def save_checkpoint(self, key: str, value: Any):
+        """保存阶段产物，任务重新执行时通过 checkpoints 读取（在工作线程中写库，不阻塞事件循环）"""
+        await in_session(save_checkpoint, self.job_id, key, value)
+        self.checkpoints[key] = value
+
+
+# 任务处理函数：接收任务参数和执行上下文，返回可JSON序列化的结果
+JobHandler = Callable[[Dict[str, Any], JobContext], Awaitable[Any]]
+
+_handlers: Dict[str, JobHandler] = {}
+# 任务类型 -> 单个工作进程中同时执行的上限
+_concurrency_limits: Dict[str, int] = {}
+# 任务类型 -> 单个工作进程中开始执行的速率限制
+_start_limits: Dict[str, TokenBucket] = {}
+
+
+def register_job_handler(
+    kind: str,
+    concurrency: int = None,
+    starts_per_minute: int = None
+) -> Callable[[JobHandler], JobHandler]:
+    """
+    注册某类任务的处理函数（装饰器）
+
+    Args:
+        kind: 任务类型
+        concurrency: 单个工作进程中同时执行该类任务的上限，None或0表示只受工作进程总并发限制
+        starts_per_minute: 单个工作进程每分钟最多领取的该类任务数，None或0表示不限制；
+            额度不足时工作进程不领取该类任务，任务留在队列中，不占用执行名额和租约
+    """
+    def decorator(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        if concurrency:
+            _concurrency_limits[kind] = concurrency
+        if starts_per_minute:
+            _start_limits[kind] = TokenBucket(starts_per_minute)
+        return handler
+    return decorator
+
+
+def run_in_session(operation: Callable[..., Any], *args) -> Any:
+    """在新的会话中执行一次队列操作"""
+    db = SessionLocal()
+    try:
+        return operation(db, *args)
+    finally:
+        db.close()
+
+
+async def in_session(operation: Callable[..., Any], *args) -> Any:
+    """在工作线程中用独立的会话执行一次队列操作，提交和SQLite写锁等待不阻塞事件循环"""
+    return await asyncio.to_thread(run_in_session, operation, *args)
+
+
+def get_job_handler(kind: str) -> Optional[JobHandler]:
+    return _handlers.get(kind)
+
+
+def get_concurrency_limit(kind: str) -> Optional[int]:
+    return _concurrency_limits.get(kind)
+
+
+def can_start(kind: str) -> bool:
+    """该类任务当前是否还有开始执行的速率额度"""
+    bucket = _start_limits.get(kind)
+    return bucket is None or bucket.wait_time(1, time.monotonic()) == 0
+
+
+def record_start(kind: str):
+    """领取到任务后扣除开始执行的速率额度"""
+    bucket = _start_limits.get(kind)
+    if bucket is not None:
+        bucket.consume(1)
+
+
+def registered_kinds() -> Iterable[str]:
+    return list(_handlers)
+
+
+def enqueue_job(
+    db: Session,
+    kind: str,
+    payload: Dict[str, Any],
+    max_attempts: int = None,
+    lane: str = BATCH,
+    deadline_seconds: float = None,
+    batch_id: str = None,
+    batch_index: int = None,
+    commit: bool = True
+) -> db_models.BackgroundJob:
+    """
+    创建待执行的持久化任务，默认进入批量通道
+
+    Args:
+        deadline_seconds: 从入队开始计算的时间预算(秒)，默认使用 JOB_DEADLINE_SECONDS，0表示不限制
+        batch_id: 所属批量任务ID
+        batch_index: 在批量任务中的序号
+        commit: 是否立即提交，批量入队时由调用方统一提交
+    """
+    now = time.time()
+    if deadline_seconds is None:
+        deadline_seconds = settings.JOB_DEADLINE_SECONDS
+    job = db_models.BackgroundJob(
+        kind=kind,
+        status=JOB_PENDING,
+        payload=payload,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        lane=normalize_lane(lane, BATCH),
+        available_at=now,
+        deadline_at=now + deadline_seconds if deadline_seconds and deadline_seconds > 0 else None,
+        batch_id=batch_id,
+        batch_index=batch_index
+    )
+    db.add(job)
+    if commit:
+        db.commit()
+        db.refresh(job)
+    metrics.incr(f"jobs.{kind}.enqueued")
+    return job
+
+
+def get_job(db: Session, job_id: str) -> Optional[db_models.BackgroundJob]:
+    return db.query(db_models.BackgroundJob).filter(db_models.BackgroundJob.id == job_id).first()
+
+
+def count_unfinished(db: Session, kind: str) -> int:
+    """某类任务中待执行和执行中的数量"""
+    job = db_models.BackgroundJob
+    return db.query(job).filter(job.kind == kind, job.status.in_([JOB_PENDING, JOB_RUNNING])).count()
+
+
+def _claimable(now: float):
+    """可领取的任务：到期的待执行任务，或租约已过期且还有执行次数的任务（原工作进程已退出）"""
+    job = db_models.BackgroundJob
+    return or_(
+        and_(job.status == JOB_PENDING, job.available_at <= now),
+        and_(job.status == JOB_RUNNING, job.lease_expires_at < now, job.attempts < job.max_attempts)
+    )
+
+
+def _fail_abandoned_jobs(db: Session, now: float):
+    """
+    租约过期且执行次数已用尽的任务直接标记失败，避免反复拖垮工作进程的任务无限重试；
+    超过截止时间仍未开始执行的任务也标记失败
+    """
+    job = db_models.BackgroundJob
+    expired = db.query(job).filter(
+        job.status == JOB_PENDING,
+        job.deadline_at.isnot(None),
+        job.deadline_at <= now
+    ).update({
+        job.status: JOB_FAILED,
+        job.error: "任务超过截止时间，未执行",
+    }, synchronize_session=False)
+    if expired:
+        metrics.incr("jobs.expired", expired)
+    abandoned = db.query(job).filter(
+        job.status == JOB_RUNNING,
+        job.lease_expires_at < now,
+        job.attempts >= job.max_attempts
+    ).update({
+        job.status: JOB_FAILED,
+        job.error: "工作进程在执行期间退出，执行次数已用尽",
+        job.worker_id: None,
+        job.lease_expires_at: None
+    }, synchronize_session=False)
+    db.commit()
+    if abandoned:
+        metrics.incr("jobs.abandoned", abandoned)
+
+
+def claim_job(db: Session, worker_id: str, kinds: Iterable[str]) -> Optional[db_models.BackgroundJob]:
+    """
+    原子地领取一个任务
+
+    先查询候选任务，再用带原条件的UPDATE抢占，只有影响行数为1的工作进程领取成功，
+    多个进程同时领取同一任务时只有一个会成功
+
+    Returns:
+        Optional[BackgroundJob]: 领取到的任务，没有可执行任务时返回None
+    """
+    job = db_models.BackgroundJob
+    kinds = list(kinds)
+    now = time.time()
+    _fail_abandoned_jobs(db, now)
+
+    # 交互任务和等待过久的批量任务优先（旧版本创建的任务没有通道，按批量处理）
+    lane_rank = case(
+        (job.lane == INTERACTIVE, 0),
+        (job.available_at <= now - settings.PRIORITY_BATCH_MAX_WAIT, 0),
+        else_=1
+    )
+    candidates = db.query(job.id).filter(job.kind.in_(kinds), _claimable(now)) \
+        .order_by(lane_rank, job.available_at).limit(5).all()
+    for (job_id,) in candidates:
+        claimed = db.query(job).filter(job.id == job_id, _claimable(now)).update({
+            job.status: JOB_RUNNING,
+            job.worker_id: worker_id,
+            job.lease_expires_at: now + settings.JOB_LEASE_SECONDS,
+            job.attempts: job.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            claimed_job = get_job(db, job_id)
+            observe_latency("jobs", normalize_lane(claimed_job.lane, BATCH), max(0.0, now - claimed_job.available_at))
+            return claimed_job
+    return None
+
+
+def renew_lease(db: Session, job_id: str, worker_id: str) -> bool:
+    """续约执行租约，返回False表示任务已不归当前工作进程所有"""
+    job = db_models.BackgroundJob
+    renewed = db.query(job).filter(
+        job.id == job_id, job.worker_id == worker_id, job.status == JOB_RUNNING
+    ).update({job.lease_expires_at: time.time() + settings.JOB_LEASE_SECONDS}, synchronize_session=False)
+    db.commit()
+    return bool(renewed)
+
+
+def update_progress(db: Session, job_id: str, percent: float):
+    """写入执行中任务的进度，任务已结束时不再覆盖"""
+    job = db_models.BackgroundJob
+    db.query(job).filter(job.id == job_id, job.status == JOB_RUNNING) \
+        .update({job.progress: percent}, synchronize_session=False)
+    db.commit()
+
+
+def complete_job(db: Session, job_id: str, result: Any) -> bool:
+    """记录成功，返回False表示任务已被取消（处理函数恰好在取消请求之后完成时保留已取消状态）"""
+    job = get_job(db, job_id)
+    if job is None or job.status == JOB_CANCELLED:
+        return False
+    job.status = JOB_SUCCEEDED
+    job.progress = 100.0
+    job.result = result
+    job.error = None
+    job.worker_id = None
+    job.lease_expires_at = None
+    db.commit()
+    metrics.incr(f"jobs.{job.kind}.succeeded")
+    return True
+
+
+def fail_job(db: Session, job_id: str, error: str) -> bool:
+    """
+    记录失败：还有执行次数且退避后仍在截止时间内时按指数退避重新入队，否则标记为失败；
+    返回False表示任务已被取消
+    """
+    job = get_job(db, job_id)
+    if job is None or job.status == JOB_CANCELLED:
+        return False
+    job.error = error
+    job.worker_id = None
+    job.lease_expires_at = None
+    retry_at = time.time() + settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+    if job.attempts < job.max_attempts and (job.deadline_at is None or retry_at < job.deadline_at):
+        job.status = JOB_PENDING
+        job.available_at = retry_at
+        metrics.incr(f"jobs.{job.kind}.retried")
+    else:
+        job.status = JOB_FAILED
+        metrics.incr(f"jobs.{job.kind}.failed")
+    db.commit()
+    return True
+
+
+def release_job(db: Session, job_id: str):
+    """工作进程停止时归还正在执行的任务，不计入执行次数，下次启动时从检查点继续"""
+    job = get_job(db, job_id)
+    if job is None or job.status != JOB_RUNNING:
+        return
+    job.status = JOB_PENDING
+    job.attempts = max(0, job.attempts - 1)
+    job.available_at = time.time()
+    job.worker_id = None
+    job.lease_expires_at = None
+    db.commit()
+
+
+def cancel_job(db: Session, job_id: str) -> bool:
+    """
+    取消未结束的任务，返回False表示任务不存在或已结束
+
+    待执行的任务不会再被领取；执行中的任务由所属工作进程在下一次检查时发现并停止
+    """
+    job = db_models.BackgroundJob
+    cancelled = db.query(job).filter(
+        job.id == job_id, job.status.in_([JOB_PENDING, JOB_RUNNING])
+    ).update({
+        job.status: JOB_CANCELLED,
+        job.error: "任务已取消",
+        job.lease_expires_at: None
+    }, synchronize_session=False)
+    db.commit()
+    return bool(cancelled)
+
+
+def is_cancelled(db: Session, job_id: str) -> bool:
+    status = db.query(db_models.BackgroundJob.status).filter(db_models.BackgroundJob.id == job_id).scalar()
+    return status == JOB_CANCELLED
+
+
+def load_checkpoints(db: Session, job_id: str) -> Dict[str, Any]:
+    rows = db.query(db_models.JobCheckpoint).filter(db_models.JobCheckpoint.job_id == job_id).all()
+    return {row.key: row.value for row in rows}
+
+
+def save_checkpoint(db: Session, job_id: str, key: str, value: Any):
+    row = db.query(db_models.JobCheckpoint).filter(
+        db_models.JobCheckpoint.job_id == job_id, db_models.JobCheckpoint.key == key).first()
+    if row:
+        row.value = value
+    else:
+        db.add(db_models.JobCheckpoint(job_id=job_id, key=key, value=value))
+    db.commit()
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    """SQLite的 CURRENT_TIMESTAMP 为不带时区的UTC时间"""
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else None
+
+
+def get_job_snapshot(db: Session, job_id: str) -> Optional[Dict[str, Any]]:
+    """任务的当前状态，任务不存在时返回None"""
+    job = get_job(db, job_id)
+    return job_to_dict(job) if job else None
+
+
+def job_to_dict(job: db_models.BackgroundJob) -> Dict[str, Any]:
+    """与内存任务 Job.to_dict 相同的响应格式"""
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": round(job.progress or 0.0, 1),
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "lane": normalize_lane(job.lane, BATCH),
+        "created_at": _timestamp(job.created_at),
+        "updated_at": _timestamp(job.updated_at),
+    }
+
+
+async def watch_job(job_id: str, interval: float = 1.0) -> AsyncIterator[Dict[str, Any]]:
+    """
+    轮询持久化任务的状态：先返回当前状态，之后每次变化返回一次，任务结束后停止
+
+    任务可能由其他进程执行，只能通过数据库轮询获取进度
+    """
+    last = None
+    while True:
+        snapshot = await in_session(get_job_snapshot, job_id)
+        if snapshot is None:
+            return
+        if snapshot != last:
+            yield snapshot
+            last = snapshot
+        if snapshot["status"] in FINISHED_STATES:
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,233 @@
+"""
+持久化任务工作进程
+
+可以随API进程一起启动（JOB_WORKER_MODE=in_process），也可以单独运行多个进程：
+
+    python -m api.job_worker --concurrency 2
+
+领取、续约、进度和状态写入都通过 job_queue.in_session 在工作线程中执行，
+随API进程运行时SQLite写锁等待不会阻塞同一事件循环上的请求。
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+from . import db_models, job_queue, metrics
+from .config import settings
+from .jobs import ProgressCallback
+from .priority import BATCH, lane_scope, normalize_lane
+from .deadline import deadline_scope
+# 导入以注册各类任务的处理函数
+from . import generate_speech, story_build, story_batch  # noqa: F401
+from utils.logger import logger
+
+# 当前进程中运行的工作协程，取消接口通过它们立即停止本进程内执行中的任务
+_local_workers: Set["JobWorker"] = set()
+
+
+def cancel_local_job(job_id: str) -> bool:
+    """立即停止本进程内执行中的任务，返回False表示任务不在本进程执行（由所属工作进程轮询发现）"""
+    return any(worker.cancel(job_id) for worker in list(_local_workers))
+
+
+class JobWorker:
+    """从持久化队列领取并执行任务"""
+
+    def __init__(self, concurrency: int = None, kinds: Iterable[str] = None, poll_interval: float = None):
+        self.concurrency = max(1, concurrency or settings.JOB_WORKER_CONCURRENCY)
+        self.kinds = list(kinds or job_queue.registered_kinds())
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running: Dict[str, asyncio.Task] = {}
+        # 任务ID -> 任务类型，用于按类型限制并发
+        self._running_kinds: Dict[str, str] = {}
+        # 任务ID -> 处理函数的执行任务
+        self._executions: Dict[str, asyncio.Task] = {}
+        self._cancelled: Set[str] = set()
+        self._stopping = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        """在当前事件循环中后台运行"""
+        _local_workers.add(self)
+        self._loop_task = asyncio.get_running_loop().create_task(self.run())
+        return self._loop_task
+
+    async def stop(self):
+        """停止领取新任务，取消执行中的任务并归还到队列（已保存的检查点保留）"""
+        self._stopping.set()
+        _local_workers.discard(self)
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+        if self._loop_task:
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+
+    def _claimable_kinds(self) -> List[str]:
+        """未达到各自并发上限、且还有开始速率额度的任务类型"""
+        kinds = []
+        for kind in self.kinds:
+            limit = job_queue.get_concurrency_limit(kind)
+            if limit is not None and sum(1 for k in self._running_kinds.values() if k == kind) >= limit:
+                continue
+            if job_queue.can_start(kind):
+                kinds.append(kind)
+        return kinds
+
+    async def run(self):
+        logger.info(f"任务工作进程启动: {self.worker_id}，并发 {self.concurrency}，任务类型 {self.kinds}")
+        while not self._stopping.is_set():
+            metrics.set_gauge("jobs.worker_running", len(self._running))
+            job = None
+            kinds = self._claimable_kinds()
+            if len(self._running) < self.concurrency and kinds:
+                try:
+                    job = await job_queue.in_session(job_queue.claim_job, self.worker_id, kinds)
+                except Exception as e:
+                    logger.error(f"领取任务失败: {e}")
+
+            if job:
+                job_id = job.id
+                job_queue.record_start(job.kind)
+                self._running_kinds[job_id] = job.kind
+                task = asyncio.get_running_loop().create_task(self._execute(job))
+                self._running[job_id] = task
+                task.add_done_callback(lambda _, job_id=job_id: self._finished(job_id))
+                continue
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finished(self, job_id: str):
+        self._running.pop(job_id, None)
+        self._running_kinds.pop(job_id, None)
+
+    def _progress_writer(self, job: db_models.BackgroundJob) -> ProgressCallback:
+        """进度变化不足1%时不写库；写库在后台进行，写入期间的多次变化合并为最新的一次"""
+        job_id = job.id
+        written = int(job.progress or 0)
+        latest: Optional[float] = None
+        writer: Optional[asyncio.Task] = None
+
+        async def flush():
+            nonlocal latest
+            while latest is not None:
+                percent, latest = latest, None
+                try:
+                    await job_queue.in_session(job_queue.update_progress, job_id, percent)
+                except Exception as e:
+                    logger.warning(f"写入任务进度失败: {job_id}, {e}")
+
+        def report(fraction: float):
+            nonlocal written, latest, writer
+            percent = max(0.0, min(100.0, fraction * 100))
+            if int(percent) == written:
+                return
+            written, latest = int(percent), percent
+            if writer is None or writer.done():
+                writer = asyncio.get_running_loop().create_task(flush())
+        return report
+
+    def cancel(self, job_id: str) -> bool:
+        """取消本工作协程中执行中的任务（任务状态已由 job_queue.cancel_job 标记）"""
+        execution = self._executions.get(job_id)
+        if execution is None or execution.done():
+            return False
+        self._cancelled.add(job_id)
+        execution.cancel()
+        return True
+
+    async def _heartbeat(self, job_id: str, execution: asyncio.Task):
+        """定期检查任务是否已被取消并续约，租约被其他工作进程接手时取消本地执行"""
+        renew_interval = settings.JOB_LEASE_SECONDS / 3
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.poll_interval, renew_interval))
+            if await job_queue.in_session(job_queue.is_cancelled, job_id):
+                # 取消请求可能来自其他进程，在这里发现后停止执行
+                self.cancel(job_id)
+                return
+            if time.monotonic() - renewed_at < renew_interval:
+                continue
+            owned = await job_queue.in_session(job_queue.renew_lease, job_id, self.worker_id)
+            renewed_at = time.monotonic()
+            if not owned:
+                logger.warning(f"任务 {job_id} 的租约已失效，停止本地执行")
+                execution.cancel()
+                return
+
+    async def _execute(self, job: db_models.BackgroundJob):
+        job_id = job.id
+        handler = job_queue.get_job_handler(job.kind)
+        if handler is None:
+            await job_queue.in_session(job_queue.fail_job, job_id, f"未注册的任务类型: {job.kind}")
+            return
+        if job.deadline_at and job.deadline_at <= time.time():
+            await job_queue.in_session(job_queue.fail_job, job_id, "任务超过截止时间")
+            return
+        logger.info(f"开始执行任务: {job.kind} {job.id}（第 {job.attempts} 次）")
+
+        checkpoints = await job_queue.in_session(job_queue.load_checkpoints, job_id)
+        context = job_queue.JobContext(job, self._progress_writer(job), checkpoints)
+        # 处理函数及其创建的子任务都在任务所属通道内调度，并以任务剩余的时间预算为截止时间
+        budget = job.deadline_at - time.time() if job.deadline_at else None
+        with lane_scope(normalize_lane(job.lane, BATCH)), deadline_scope(budget):
+            execution = asyncio.ensure_future(handler(job.payload, context))
+        self._executions[job_id] = execution
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job_id, execution))
+        try:
+            result = await execution
+            # 处理函数恰好在取消请求之后完成时保留已取消状态
+            if await job_queue.in_session(job_queue.complete_job, job_id, result):
+                logger.info(f"任务完成: {job.kind} {job.id}")
+        except asyncio.CancelledError:
+            if self._stopping.is_set():
+                await job_queue.in_session(job_queue.release_job, job_id)
+                logger.info(f"工作进程停止，任务已归还队列: {job.kind} {job.id}")
+            elif job_id in self._cancelled:
+                logger.info(f"任务已取消: {job.kind} {job.id}")
+                metrics.incr(f"jobs.{job.kind}.cancelled")
+                return
+            raise
+        except Exception as e:
+            if await job_queue.in_session(job_queue.fail_job, job_id, str(e)):
+                logger.error(f"任务执行失败: {job.kind} {job.id}, {e}")
+        finally:
+            heartbeat.cancel()
+            self._executions.pop(job_id, None)
+            self._cancelled.discard(job_id)
+            if not execution.done():
+                # 等待处理函数响应取消（终止其ffmpeg子进程）后再结束
+                execution.cancel()
+                await asyncio.gather(execution, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="持久化任务工作进程")
+    parser.add_argument("--concurrency", type=int, default=None, help="同时执行的任务数，默认使用配置值")
+    parser.add_argument("--kinds", nargs="*", default=None, help="只领取指定类型的任务")
+    args = parser.parse_args()
+
+    from .db_init import init_db
+    init_db()
+
+    async def run():
+        worker = JobWorker(concurrency=args.concurrency, kinds=args.kinds)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(worker.stop()))
+        await worker.run()
+        await worker.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+后台任务的状态和进度回调
+
+耗时的音频/视频生成在后台任务中执行，客户端通过任务ID轮询状态或订阅进度事件，
+不再需要保持长时间阻塞的HTTP请求。任务保存在持久化队列中（见 job_queue），
+多工作进程部署时任意进程都可以查询、订阅和取消。
+"""
+from typing import Callable, Optional
+
+# 进度回调：参数为 0~1 之间的完成比例
+ProgressCallback = Callable[[float], None]
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+def progress_range(on_progress: Optional[ProgressCallback], start: float, end: float) -> Optional[ProgressCallback]:
+    """把子步骤的 0~1 进度映射到整体进度的 [start, end] 区间"""
+    if on_progress is None:
+        return None
+    return lambda fraction: on_progress(start + (end - start) * max(0.0, min(1.0, fraction)))
@@ -0,0 +1,199 @@
+"""
+外部API密钥池
+
+同一服务商可以配置多个API密钥，每个密钥有独立的令牌桶（每分钟请求数RPM和每分钟令牌数TPM）。
+每次调用选择剩余额度最多的密钥；某个密钥收到429后进入冷却期，冷却结束前不再被选中。
+所有密钥的额度都用完时等待最早恢复的密钥，而不是把请求打到必然被限流的密钥上；
+等待中有交互通道的请求时，额度恢复后先交给交互请求（见 priority 模块）。
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from .config import settings, per_process
+from . import metrics
+from .priority import INTERACTIVE, current_lane, lane_rank, observe_latency
+from .deadline import DeadlineExceeded, remaining
+from utils.logger import logger
+
+# 批量请求让位给等待中的交互请求时的重新检查间隔（秒）
+_YIELD_INTERVAL = 0.05
+
+# 服务商 -> 配置项前缀
+PROVIDERS = {
+    "deepinfra": "DEEPINFRA",
+    "siliconflow": "SILICONFLOW",
+}
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按每秒 额度/60 的速度补充；容量为0表示不限制"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(0, per_minute))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity == 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def headroom(self, now: float) -> float:
+        """剩余额度占容量的比例"""
+        if self.unlimited:
+            return 1.0
+        self._refill(now)
+        return self.tokens / self.capacity
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离可以扣除 amount 个令牌还需等待的秒数"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # 单次请求超过桶容量时按容量计算，避免永远无法满足
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= min(amount, self.capacity)
+
+
+class ApiKey:
+    """密钥池中的单个密钥"""
+
+    def __init__(self, key: str, rpm: int, tpm: int):
+        self.key = key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+
+    @property
+    def label(self) -> str:
+        """日志中使用的脱敏标识"""
+        return f"{self.key[:6]}…{self.key[-4:]}" if len(self.key) > 12 else "***"
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        cooldown = max(0.0, self.cooldown_until - now)
+        return max(cooldown, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def headroom(self, now: float) -> float:
+        return min(self.requests.headroom(now), self.tokens.headroom(now))
+
+
+class KeyPool:
+    """单个服务商的密钥池，只能在同一个事件循环中使用"""
+
+    def __init__(self, name: str, keys: List[str], rpm: int = 0, tpm: int = 0, cooldown: float = 30.0):
+        if not keys:
+            raise ValueError(f"{name} 没有配置API密钥")
+        self.name = name
+        self.keys = [ApiKey(key, rpm, tpm) for key in keys]
+        self.cooldown = cooldown
+        # 因额度不足正在等待的交互请求数
+        self._interactive_waiting = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _update_gauges(self, now: float):
+        cooling = sum(1 for key in self.keys if key.cooldown_until > now)
+        metrics.set_gauge(f"key_pool.{self.name}.cooling_down", cooling)
+        metrics.set_gauge(f"key_pool.{self.name}.available", len(self.keys) - cooling)
+
+    async def acquire(self, tokens: float = 1) -> ApiKey:
+        """
+        选择当前可用且剩余额度最多的密钥并扣除额度，所有密钥都不可用时等待
+
+        Args:
+            tokens: 本次调用预计消耗的令牌数（如TTS的字符数）
+
+        Returns:
+            ApiKey: 选中的密钥
+
+        Raises:
+            DeadlineExceeded: 等到额度恢复时已超过请求的截止时间
+        """
+        lane = current_lane()
+        started = time.monotonic()
+        throttled = False
+        try:
+            while True:
+                now = time.monotonic()
+                ready = [key for key in self.keys if key.wait_time(tokens, now) == 0]
+                # 有交互请求在等待额度时，未等待太久的批量请求继续让位
+                yield_to_interactive = self._interactive_waiting > 0 and lane_rank(lane, started, now) > 0
+                if ready and not yield_to_interactive:
+                    key = max(ready, key=lambda k: k.headroom(now))
+                    key.requests.consume(1)
+                    key.tokens.consume(tokens)
+                    if throttled:
+                        metrics.observe(f"key_pool.{self.name}.wait_seconds", now - started)
+                    observe_latency(f"key_pool.{self.name}", lane, now - started)
+                    self._update_gauges(now)
+                    return key
+                if not throttled:
+                    metrics.incr(f"key_pool.{self.name}.throttled")
+                    throttled = True
+                    if lane == INTERACTIVE:
+                        self._interactive_waiting += 1
+                delay = _YIELD_INTERVAL if ready else min(key.wait_time(tokens, now) for key in self.keys)
+                budget = remaining()
+                if budget is not None and budget <= delay:
+                    metrics.incr(f"key_pool.{self.name}.deadline_exceeded")
+                    raise DeadlineExceeded(f"key_pool.{self.name}")
+                await asyncio.sleep(delay)
+        finally:
+            if throttled and lane == INTERACTIVE:
+                self._interactive_waiting -= 1
+
+    def mark_rate_limited(self, key: ApiKey, retry_after: Optional[float] = None):
+        """密钥被服务商限流(429)后进入冷却期，优先使用服务商返回的 Retry-After"""
+        now = time.monotonic()
+        key.cooldown_until = now + (retry_after if retry_after and retry_after > 0 else self.cooldown)
+        metrics.incr(f"key_pool.{self.name}.rate_limited")
+        self._update_gauges(now)
+        logger.warning(
+            f"{self.name} 密钥 {key.label} 被限流，冷却 {key.cooldown_until - now:.0f} 秒")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析以秒为单位的 Retry-After 响应头（HTTP日期格式按未提供处理）"""
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def configured_keys(provider: str) -> List[str]:
+    """服务商配置的密钥列表：<前缀>_API_KEYS（逗号分隔）优先，否则使用单个 <前缀>_API_KEY"""
+    prefix = PROVIDERS[provider]
+    keys = [k.strip() for k in getattr(settings, f"{prefix}_API_KEYS").split(",") if k.strip()]
+    single = getattr(settings, f"{prefix}_API_KEY")
+    return keys or ([single] if single else [])
+
+
+_pools: Dict[str, KeyPool] = {}
+
+
+def get_key_pool(provider: str) -> KeyPool:
+    """进程内共享的服务商密钥池，多工作进程部署时各进程均分每个密钥的额度"""
+    pool = _pools.get(provider)
+    if pool is None:
+        prefix = PROVIDERS[provider]
+        pool = KeyPool(
+            provider,
+            configured_keys(provider),
+            rpm=per_process(getattr(settings, f"{prefix}_RPM")),
+            tpm=per_process(getattr(settings, f"{prefix}_TPM")),
+            cooldown=settings.PROVIDER_KEY_COOLDOWN
+        )
+        _pools[provider] = pool
+    return pool
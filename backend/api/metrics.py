@@ -0,0 +1,75 @@
+"""
+进程内运行指标：计数器、瞬时值、耗时统计和延迟直方图
+"""
+import bisect
+import threading
+from collections import defaultdict
+from typing import Dict, Any, Sequence
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = defaultdict(int)
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+_histograms: Dict[str, Dict[str, Any]] = {}
+
+# 延迟直方图的默认桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def incr(name: str, value: int = 1):
+    """计数器加一（或加指定值）"""
+    with _lock:
+        _counters[name] += value
+
+
+def get_counter(name: str) -> int:
+    """读取单个计数器的当前值"""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def set_gauge(name: str, value: float):
+    """设置瞬时值（如队列长度）"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float):
+    """记录一次耗时（秒），统计次数、总和与最大值"""
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["sum"] += value
+        timing["max"] = max(timing["max"], value)
+
+
+def observe_histogram(name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS):
+    """记录一次延迟（秒）到直方图，快照中各桶为不超过上界的累计次数"""
+    with _lock:
+        histogram = _histograms.setdefault(
+            name, {"bounds": tuple(buckets), "counts": [0] * (len(buckets) + 1), "count": 0, "sum": 0.0})
+        histogram["counts"][bisect.bisect_left(histogram["bounds"], value)] += 1
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+
+def _histogram_snapshot(histogram: Dict[str, Any]) -> Dict[str, Any]:
+    buckets, total = {}, 0
+    for bound, count in zip(list(histogram["bounds"]) + ["+Inf"], histogram["counts"]):
+        total += count
+        buckets[str(bound)] = total
+    return {"buckets": buckets, "count": histogram["count"], "sum": histogram["sum"]}
+
+
+def snapshot() -> Dict[str, Any]:
+    """返回所有指标的快照"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {
+                name: {**timing, "avg": timing["sum"] / timing["count"] if timing["count"] else 0.0}
+                for name, timing in _timings.items()
+            },
+            "histograms": {name: _histogram_snapshot(h) for name, h in _histograms.items()},
+        }
@@ -85,6 +85,24 @@ class TextSplitResponse(BaseModel):
     sentences: List[str] = Field(..., description="拆分后的句子列表")
 
 
+# 一键生成绘本请求模型
+class StoryBuildRequest(BaseModel):
+    title: Optional[str] = Field(None, description="绘本标题，用于封面配音和文件命名，默认使用故事主题")
+    style: ArtStyle = Field(ArtStyle.PICTURE_BOOK, description="图片风格")
+    age_range: AgeRange = Field(AgeRange.CHILD, description="适合的年龄范围")
+    aspect_ratio: str = Field("16:9", description="图片比例", example="16:9")
+    image_model: Optional[str] = Field(None, description="图片生成模型名称")
+    seed: Optional[int] = Field(None, description="随机种子值，用于固定生成结果")
+    emotion: str = Field("happy", description="语音情感类型", example="happy")
+    render_engine: Optional[str] = Field(None, description="渲染引擎 segments 或 filtergraph，默认使用配置值")
+    profile: str = Field("final", description="渲染档位 preview 或 final")
+    subtitle_mode: Optional[str] = Field(None, description="字幕模式 burn、soft 或 sidecar，默认使用配置值")
+    output_format: Optional[str] = Field(None, description="输出格式 mp4 或 hls，默认使用配置值")
+
+    class Config:
+        protected_namespaces = ()
+
+
 # 语音生成请求模型
 class SpeechGenerationRequest(BaseModel):
     text: str = Field(..., min_length=1,
@@ -0,0 +1,150 @@
+"""
+阶段化任务图执行器
+
+把一次较长的生成流程拆成带依赖关系的节点（如每页的配图、语音和视频片段），
+依赖满足的节点立即开始执行；同一阶段的节点共享一个并发上限，不同阶段之间互相重叠。
+失败的节点按配置重试；标记为检查点的节点完成后保存结果，任务中断后重新执行时直接复用。
+重试和阶段排队都不超过请求的剩余预算，预算用尽时可以返回已完成节点的部分结果。
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .deadline import DeadlineExceeded, check_deadline, remaining, within_deadline
+from .jobs import ProgressCallback
+from .process_runner import gather_or_cancel
+from utils.logger import logger
+
+
+class TaskGraph:
+    """
+    有向无环任务图
+
+    节点按依赖顺序添加（依赖必须先于节点本身添加），节点函数按依赖声明的顺序接收依赖节点的结果
+    """
+
+    def __init__(self, stage_limits: Dict[str, int] = None, retries: int = 0, retry_delay: float = 1.0):
+        """
+        Args:
+            stage_limits: 各阶段的并发上限，未列出或为0的阶段不限制并发
+            retries: 单个节点失败后的重试次数
+            retry_delay: 首次重试前的等待时间(秒)，之后每次翻倍
+        """
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._semaphores = {
+            stage: asyncio.Semaphore(limit)
+            for stage, limit in (stage_limits or {}).items() if limit and limit > 0
+        }
+        self._nodes: Dict[str, Tuple[str, Callable[..., Awaitable[Any]], List[str], bool]] = {}
+
+    def add(
+        self,
+        key: str,
+        stage: str,
+        run: Callable[..., Awaitable[Any]],
+        deps: Sequence[str] = (),
+        checkpoint: bool = False
+    ):
+        """
+        添加节点
+
+        Args:
+            key: 节点唯一标识
+            stage: 所属阶段，用于并发限制和耗时统计
+            run: 协程函数，参数为各依赖节点的结果
+            deps: 依赖的节点标识列表
+            checkpoint: 是否保存该节点的结果（结果需可JSON序列化）
+        """
+        if key in self._nodes:
+            raise ValueError(f"任务节点重复: {key}")
+        missing = [dep for dep in deps if dep not in self._nodes]
+        if missing:
+            raise ValueError(f"任务节点 {key} 的依赖尚未添加: {', '.join(missing)}")
+        self._nodes[key] = (stage, run, list(deps), checkpoint)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    async def _run_with_retries(self, key: str, run: Callable[..., Awaitable[Any]], args: List[Any]) -> Any:
+        for attempt in range(self.retries + 1):
+            try:
+                return await within_deadline(run(*args), key)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self.retry_delay * 2 ** attempt
+                budget = remaining()
+                # 重试等待结束时预算已用尽的不再重试
+                if attempt >= self.retries or (budget is not None and budget <= delay):
+                    raise
+                metrics.incr("pipeline.retries")
+                logger.warning(f"任务节点 {key} 第 {attempt + 1} 次执行失败，{delay:.0f} 秒后重试: {e}")
+                await asyncio.sleep(delay)
+
+    async def run(
+        self,
+        on_progress: Optional[ProgressCallback] = None,
+        checkpoints: Dict[str, Any] = None,
+        on_checkpoint: Callable[[str, Any], Awaitable[None]] = None,
+        allow_partial: bool = False
+    ) -> Dict[str, Any]:
+        """
+        执行整个任务图，任一节点失败（重试用尽）时取消其余节点后抛出原异常
+
+        Args:
+            on_progress: 进度回调，按已完成节点数占总节点数的比例回调
+            checkpoints: 之前保存的检查点结果，命中的节点不再执行
+            on_checkpoint: 检查点节点完成后的协程回调，参数为节点标识和结果
+            allow_partial: 超过截止时间时取消未完成的节点并返回已完成节点的结果，而不是抛出 DeadlineExceeded
+
+        Returns:
+            Dict[str, Any]: 各节点的结果（部分返回时缺少未完成的节点）
+        """
+        checkpoints = checkpoints or {}
+        tasks: Dict[str, asyncio.Task] = {}
+        results: Dict[str, Any] = {}
+        total = len(self._nodes)
+        completed = 0
+
+        async def run_node(key: str):
+            nonlocal completed
+            stage, run, deps, checkpoint = self._nodes[key]
+            args = [await tasks[dep] for dep in deps]
+
+            if checkpoint and key in checkpoints:
+                result = checkpoints[key]
+                metrics.incr("pipeline.checkpoint_hits")
+            else:
+                check_deadline(key)
+                semaphore = self._semaphores.get(stage)
+                if semaphore:
+                    await within_deadline(semaphore.acquire(), key)
+                started = time.monotonic()
+                try:
+                    result = await self._run_with_retries(key, run, args)
+                finally:
+                    if semaphore:
+                        semaphore.release()
+                metrics.observe(f"pipeline.{stage}_seconds", time.monotonic() - started)
+                logger.debug(f"任务节点完成: {key} ({time.monotonic() - started:.1f}秒)")
+                if checkpoint and on_checkpoint:
+                    await on_checkpoint(key, result)
+
+            results[key] = result
+            completed += 1
+            if on_progress:
+                on_progress(completed / total)
+            return result
+
+        for key in self._nodes:
+            tasks[key] = asyncio.ensure_future(run_node(key))
+        try:
+            await gather_or_cancel(*tasks.values())
+        except DeadlineExceeded as e:
+            if not allow_partial:
+                raise
+            metrics.incr("pipeline.partial")
+            logger.warning(f"任务图超过截止时间（{e.stage}），返回 {len(results)}/{total} 个已完成节点的结果")
+        return results
@@ -0,0 +1,85 @@
+"""
+优先级通道
+
+编辑器中的交互操作（重新生成单页配图、试听一句语音）走 interactive 通道，整本绘本的批量生成走 batch 通道。
+当前通道保存在上下文变量中，随请求和后台任务传递到准入闸门、密钥池和渲染调度器：
+排队时交互请求优先，批量请求等待超过 PRIORITY_BATCH_MAX_WAIT 后与交互请求同等调度，避免饿死。
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from .config import settings
+from . import metrics
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+
+# 客户端通过该请求头声明通道，未声明时HTTP请求按交互请求处理
+PRIORITY_HEADER = "x-priority"
+
+_current_lane: ContextVar[str] = ContextVar("priority_lane", default=INTERACTIVE)
+
+
+def normalize_lane(value: Optional[str], default: str = INTERACTIVE) -> str:
+    """未知或空的通道名按默认通道处理"""
+    value = (value or "").strip().lower()
+    return value if value in LANES else default
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+@contextmanager
+def lane_scope(lane: str) -> Iterator[str]:
+    """
+    在指定通道内执行，其中创建的任务（asyncio任务、to_thread线程）继承该通道
+    """
+    token = _current_lane.set(normalize_lane(lane))
+    try:
+        yield _current_lane.get()
+    finally:
+        _current_lane.reset(token)
+
+
+def lane_rank(lane: str, enqueued_at: float, now: float = None) -> int:
+    """
+    排队顺序的优先级：0 先于 1
+
+    Args:
+        lane: 排队者所属通道
+        enqueued_at: 开始排队的时间（与 now 同一时钟）
+        now: 当前时间，默认使用 time.monotonic()
+    """
+    if lane != BATCH:
+        return 0
+    now = time.monotonic() if now is None else now
+    return 0 if now - enqueued_at >= settings.PRIORITY_BATCH_MAX_WAIT else 1
+
+
+def observe_latency(component: str, lane: str, seconds: float):
+    """记录某个组件在某个通道上的延迟直方图"""
+    metrics.observe_histogram(f"{component}.{lane}.latency_seconds", seconds)
+
+
+class PriorityLaneMiddleware:
+    """ASGI中间件：按 X-Priority 请求头设置请求所属通道，并记录各通道的请求延迟"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        lane = normalize_lane(headers.get(PRIORITY_HEADER.encode(), b"").decode("latin-1"))
+        started = time.monotonic()
+        with lane_scope(lane):
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                observe_latency("http", lane, time.monotonic() - started)
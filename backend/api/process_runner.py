@@ -0,0 +1,228 @@
+"""
+异步子进程执行器
+
+所有 ffmpeg/ffprobe 调用统一通过 asyncio.create_subprocess_exec 执行，不再阻塞事件循环；
+支持超时、任务取消时终止子进程、有界的stderr采集和结构化的错误信息。
+"""
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from .config import settings
+from . import metrics
+from .deadline import DeadlineExceeded, limit_timeout
+from utils.logger import logger
+
+
+class ProcessError(Exception):
+    """子进程执行失败（非零退出码或超时）"""
+
+    def __init__(self, cmd: Sequence[str], returncode: Optional[int], stderr: str = "", timed_out: bool = False):
+        self.cmd = [str(arg) for arg in cmd]
+        self.returncode = returncode
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+        reason = "执行超时" if timed_out else f"退出码 {returncode}"
+        lines = stderr.strip().splitlines()
+        detail = f": {lines[-1]}" if lines else ""
+        super().__init__(f"{self.program} {reason}{detail}")
+
+    @property
+    def program(self) -> str:
+        return self.cmd[0] if self.cmd else ""
+
+    def to_dict(self) -> dict:
+        """结构化的错误信息，便于记录日志或返回给调用方"""
+        return {
+            "program": self.program,
+            "returncode": self.returncode,
+            "timed_out": self.timed_out,
+            "stderr": self.stderr,
+        }
+
+
+class ProcessResult:
+    """子进程执行结果"""
+
+    def __init__(self, cmd: Sequence[str], returncode: int, stdout: bytes, stderr: str):
+        self.cmd = list(cmd)
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def text(self) -> str:
+        """按UTF-8解码的标准输出"""
+        return self.stdout.decode("utf-8", errors="replace")
+
+
+class _TailBuffer:
+    """只保留最后 limit 字节的输出缓冲区，避免长时间运行的ffmpeg日志占满内存"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.data = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.data += chunk
+        if len(self.data) > self.limit:
+            del self.data[:len(self.data) - self.limit]
+
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+async def _drain(stream: asyncio.StreamReader, buffer: _TailBuffer):
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        buffer.feed(chunk)
+
+
+async def _kill(proc: asyncio.subprocess.Process):
+    """终止子进程并回收，防止留下孤儿ffmpeg进程"""
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+    await proc.wait()
+
+
+async def run_process(
+    cmd: Sequence[str],
+    timeout: Optional[float] = None,
+    check: bool = True,
+    capture_stdout: bool = True,
+    stderr_limit: int = None,
+    on_stdout_line: Callable[[str], None] = None
+) -> ProcessResult:
+    """
+    异步执行子进程
+
+    Args:
+        cmd: 命令及参数
+        timeout: 超时时间(秒)，None或0表示不限制；不超过请求的剩余预算
+        check: 退出码非零时是否抛出 ProcessError
+        capture_stdout: 是否采集标准输出（完整保留，用于ffprobe结果或PCM管道）
+        stderr_limit: 保留的stderr最大字节数，默认使用配置值
+        on_stdout_line: 逐行处理标准输出的回调，设置后标准输出不再保留到结果中
+
+    Returns:
+        ProcessResult: 执行结果
+
+    Raises:
+        ProcessError: 退出码非零（check=True时）或执行超时
+        DeadlineExceeded: 请求的时间预算用尽，子进程已被终止
+        asyncio.CancelledError: 调用方任务被取消，子进程已被终止
+    """
+    cmd = [str(arg) for arg in cmd]
+    timeout, deadline_bound = limit_timeout(timeout, cmd[0])
+    stdout_buffer = bytearray()
+    stderr_buffer = _TailBuffer(stderr_limit or settings.PROCESS_STDERR_LIMIT)
+
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if capture_stdout or on_stdout_line else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+    async def read_stdout():
+        if proc.stdout is None:
+            return
+        if on_stdout_line is None:
+            stdout_buffer.extend(await proc.stdout.read())
+            return
+        async for line in proc.stdout:
+            on_stdout_line(line.decode("utf-8", errors="replace").strip())
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(read_stdout(), _drain(proc.stderr, stderr_buffer), proc.wait()),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        await _kill(proc)
+        if deadline_bound:
+            metrics.incr("process.deadline_exceeded")
+            logger.warning(f"请求已超过截止时间，终止子进程: {cmd[0]} (pid={proc.pid})")
+            raise DeadlineExceeded(cmd[0])
+        metrics.incr("process.timeout")
+        error = ProcessError(cmd, proc.returncode, stderr_buffer.text(), timed_out=True)
+        logger.error(f"子进程执行超时({timeout}秒): {' '.join(cmd)}")
+        raise error
+    except asyncio.CancelledError:
+        await _kill(proc)
+        metrics.incr("process.cancelled")
+        logger.info(f"任务已取消，终止子进程: {cmd[0]} (pid={proc.pid})")
+        raise
+
+    if check and proc.returncode != 0:
+        metrics.incr("process.failed")
+        error = ProcessError(cmd, proc.returncode, stderr_buffer.text())
+        logger.error(f"子进程执行失败: {error}")
+        raise error
+
+    return ProcessResult(cmd, proc.returncode, bytes(stdout_buffer), stderr_buffer.text())
+
+
+def _progress_parser(duration: float, on_progress: Callable[[float], None]) -> Callable[[str], None]:
+    """解析ffmpeg -progress 输出的 key=value 行，按已输出时长/总时长换算完成比例"""
+    def handle(line: str):
+        key, _, value = line.partition("=")
+        if key in ("out_time_us", "out_time_ms"):
+            # 两个字段的单位实际上都是微秒
+            try:
+                seconds = int(value) / 1_000_000
+            except ValueError:
+                return
+            on_progress(min(max(seconds / duration, 0.0), 1.0))
+        elif key == "progress" and value == "end":
+            on_progress(1.0)
+    return handle
+
+
+async def run_ffmpeg(
+    cmd: Sequence[str],
+    timeout: Optional[float] = None,
+    capture_stdout: bool = False,
+    on_progress: Callable[[float], None] = None,
+    duration: float = None
+) -> ProcessResult:
+    """
+    执行ffmpeg命令，默认使用配置的ffmpeg超时时间
+
+    提供 on_progress 和输出总时长 duration 时，通过 -progress pipe:1 读取实时进度，
+    以 0~1 的完成比例回调（此时不能同时采集标准输出）
+    """
+    on_stdout_line = None
+    if on_progress and duration and not capture_stdout:
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+        on_stdout_line = _progress_parser(duration, on_progress)
+    return await run_process(
+        cmd,
+        timeout=settings.FFMPEG_TIMEOUT if timeout is None else timeout,
+        capture_stdout=capture_stdout,
+        on_stdout_line=on_stdout_line
+    )
+
+
+async def run_ffprobe(cmd: Sequence[str], timeout: Optional[float] = None) -> ProcessResult:
+    """执行ffprobe命令，默认使用配置的ffprobe超时时间"""
+    return await run_process(cmd, timeout=settings.FFPROBE_TIMEOUT if timeout is None else timeout)
+
+
+async def gather_or_cancel(*aws: Awaitable) -> List:
+    """
+    并发等待一组任务，任一任务失败时取消其余任务（连同其ffmpeg子进程）后抛出原异常
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
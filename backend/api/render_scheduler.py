@@ -0,0 +1,136 @@
+"""
+全局渲染调度器
+
+按CPU令牌预算准入视频渲染任务：每个任务占用若干令牌，并以令牌数作为ffmpeg线程数；
+令牌不足时任务按通道（交互优先，见 priority 模块）、优先级（数值越小越优先）和到达顺序排队，
+避免多个渲染同时抢占CPU导致整体变慢。
+"""
+import asyncio
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from .config import settings, per_process
+from . import metrics
+from .priority import current_lane, lane_rank, observe_latency
+from .deadline import DeadlineExceeded, within_deadline
+from utils.logger import logger
+
+
+def available_cpus() -> int:
+    """当前进程可用的CPU核数（考虑CPU亲和性限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+class _Waiter:
+    """排队中的渲染任务"""
+
+    def __init__(self, lane: str, priority: int, seq: int, tokens: int, future: asyncio.Future):
+        self.lane = lane
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    def order(self, now: float):
+        """排队顺序：批量任务等待过久后与交互任务同等调度"""
+        return lane_rank(self.lane, self.enqueued_at, now), self.priority, self.seq
+
+
+class RenderScheduler:
+    """CPU令牌调度器，只能在同一个事件循环中使用"""
+
+    def __init__(self, capacity: int = None):
+        self.capacity = max(1, capacity or available_cpus())
+        self.available = self.capacity
+        self.running = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+
+    def default_tokens(self) -> int:
+        """单个任务默认申请的令牌数"""
+        tokens = settings.RENDER_JOB_TOKENS or min(self.capacity, 4)
+        return max(1, min(tokens, self.capacity))
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for w in self._queue if not w.future.done())
+
+    def _update_gauges(self):
+        metrics.set_gauge("render.queue_depth", self.queue_depth)
+        metrics.set_gauge("render.running_jobs", self.running)
+        metrics.set_gauge("render.tokens_in_use", self.capacity - self.available)
+
+    def _dispatch(self):
+        """按队首顺序发放令牌；队首放不下时后面的任务也不插队，避免大任务饿死"""
+        self._queue = [w for w in self._queue if not w.future.done()]
+        now = time.monotonic()
+        while self._queue:
+            head = min(self._queue, key=lambda w: w.order(now))
+            if head.tokens > self.available:
+                break
+            self._queue.remove(head)
+            self.available -= head.tokens
+            self.running += 1
+            head.future.set_result(None)
+        self._update_gauges()
+
+    def _release(self, tokens: int):
+        self.available += tokens
+        self.running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = None, priority: int = 0) -> AsyncIterator[int]:
+        """
+        申请渲染令牌，返回实际分配的令牌数（即该任务可用的ffmpeg线程总数）
+
+        Args:
+            tokens: 申请的令牌数，默认使用配置值，超过总预算时按总预算分配
+            priority: 通道内的优先级，数值越小越先调度，相同优先级先到先得
+
+        Raises:
+            DeadlineExceeded: 排队期间请求的时间预算用尽
+        """
+        tokens = max(1, min(tokens or self.default_tokens(), self.capacity))
+        waiter = _Waiter(current_lane(), priority, next(self._seq), tokens,
+                         asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        self._dispatch()
+
+        try:
+            await within_deadline(waiter.future, "render_queue")
+        except (asyncio.CancelledError, DeadlineExceeded):
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 令牌已发放但任务被取消，归还令牌
+                self._release(tokens)
+            else:
+                waiter.future.cancel()
+                self._dispatch()
+            raise
+
+        wait_seconds = time.monotonic() - waiter.enqueued_at
+        metrics.observe("render.queue_wait_seconds", wait_seconds)
+        observe_latency("render", waiter.lane, wait_seconds)
+        if wait_seconds > 1:
+            logger.info(f"渲染任务排队 {wait_seconds:.1f} 秒后开始，分配 {tokens} 个CPU令牌")
+        try:
+            yield tokens
+        finally:
+            self._release(tokens)
+
+
+_scheduler: Optional[RenderScheduler] = None
+
+
+def get_render_scheduler() -> RenderScheduler:
+    """进程内共享的渲染调度器，多工作进程部署时各进程均分整机的CPU令牌"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RenderScheduler(per_process(settings.RENDER_CPU_TOKENS or available_cpus()))
+    return _scheduler
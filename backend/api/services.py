@@ -1,20 +1,31 @@
 import time
 import re
 import os
+import asyncio
 import json
 import requests
 import base64
-import subprocess
 import shutil
 import tempfile
+import hashlib
+import uuid
+import numpy as np
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple, Dict, Optional, Union
+from typing import List, Tuple, Dict, Optional, Union, Any
 from google import genai
 from pydantic import BaseModel, TypeAdapter, create_model, Field
 from dotenv import load_dotenv
-from .config import settings, validate_settings, ArtStyle, AgeRange, IMAGE_SIZES
-from openai import OpenAI
+from .config import settings, validate_settings, ArtStyle, AgeRange, IMAGE_SIZES, VIDEO_RENDER_ENGINES, RENDER_PROFILES, SUBTITLE_MODES, VIDEO_OUTPUT_FORMATS, HLS_RENDITIONS
+from openai import OpenAI, RateLimitError
 from utils.logger import logger
+from . import metrics
+from .audio_storage import schedule_compaction, wait_compactions, resolve_audio_file
+from .process_runner import run_ffmpeg, run_ffprobe, gather_or_cancel, ProcessError
+from .jobs import ProgressCallback, progress_range
+from .render_scheduler import available_cpus, get_render_scheduler
+from .key_pool import get_key_pool, parse_retry_after
+from .deadline import DeadlineExceeded, limit_timeout, within_deadline
 
 # 加载环境变量
 load_dotenv()
@@ -146,14 +157,15 @@ async def generate_story(
 """
 
         # 生成内容
-        response = client.models.generate_content(
+        response = await within_deadline(asyncio.to_thread(
+            client.models.generate_content,
             model=GEMINI_MODEL,
             contents=prompt,
             config={
                 'response_mime_type': 'application/json',
                 'response_schema': DynamicStoryContent,
             },
-        )
+        ), "gemini")
 
         # 解析响应
         story_model: DynamicStoryContent = response.parsed
@@ -211,7 +223,8 @@ async def generate_image_descriptions(
                 characters_info += f"- {char.name}：{char.role}，外观：{char.appearance}，特点：{', '.join(char.traits)}，年龄：{char.age}\n"
 
         # 生成封面描述
-        cover_response = client.models.generate_content(
+        cover_response = await within_deadline(asyncio.to_thread(
+            client.models.generate_content,
             model=GEMINI_MODEL,
             contents=f"""根据以下故事段落生成1个封面图片描述（必须用英文）：
             主题：{theme}
@@ -230,7 +243,7 @@ async def generate_image_descriptions(
                 'response_mime_type': 'application/json',
                 'response_schema': list[ImagePrompt],
             },
-        )
+        ), "gemini")
 
         # 提取封面描述
         cover_description = cover_response.parsed[0].image_prompt[0] if cover_response.parsed else ""
@@ -238,7 +251,8 @@ async def generate_image_descriptions(
         # 生成内页描述
         descriptions = []
         for para in paragraphs:
-            response = client.models.generate_content(
+            response = await within_deadline(asyncio.to_thread(
+                client.models.generate_content,
                 model=GEMINI_MODEL,
                 contents=f"""根据以下故事段落生成1个图片描述（必须用英文）：
                 {para}
@@ -255,7 +269,7 @@ async def generate_image_descriptions(
                     'response_mime_type': 'application/json',
                     'response_schema': list[ImagePrompt],
                 },
-            )
+            ), "gemini")
 
             # 提取当前段落的图片描述
             if response.parsed:
@@ -270,6 +284,38 @@ async def generate_image_descriptions(
         raise e
 
 
+async def _post_deepinfra_image(payload: Dict[str, Any]) -> requests.Response:
+    """
+    通过DeepInfra密钥池请求图片生成，每张图片计1个令牌；密钥被限流(429)时冷却并换用其他密钥重试，
+    单次请求和换密钥重试都不超过请求的剩余预算
+    """
+    pool = get_key_pool("deepinfra")
+    for _ in range(len(pool)):
+        api_key = await pool.acquire(tokens=payload.get("n", 1))
+        # 设置300秒超时，剩余预算更少时以剩余预算为准
+        timeout, deadline_bound = limit_timeout(300, "deepinfra")
+        try:
+            # 同步请求放到线程中执行，不阻塞事件循环
+            response = await asyncio.to_thread(
+                requests.post,
+                f"https://api.deepinfra.com/v1/openai/images/generations",
+                headers={
+                    "Authorization": f"Bearer {api_key.key}",
+                    "Content-Type": "application/json"
+                },
+                json=payload,
+                timeout=timeout
+            )
+        except requests.exceptions.Timeout:
+            if deadline_bound:
+                raise DeadlineExceeded("deepinfra")
+            raise
+        if response.status_code != 429:
+            return response
+        pool.mark_rate_limited(api_key, parse_retry_after(response.headers.get("Retry-After")))
+    return response
+
+
 async def generate_images(
     title: str,
     descriptions: List[str],
@@ -332,29 +378,22 @@ async def generate_images(
             #         seed = seed + j - 1
             # 生成带时间戳的文件名
             timestamp = int(time.time())
-            filename = f"{clean_title}_{timestamp}_{i}.png"
+            # 按index逐张生成时用描述的实际序号命名，避免同一秒内的并发请求互相覆盖
+            filename = f"{clean_title}_{timestamp}_{i if index is None else index - 1 + i}.png"
             img_path = static_dir / filename
 
             # 构建完整提示词
             prompt = description
 
             try:
-                # 调用DeepInfra API
-                response = requests.post(
-                    f"https://api.deepinfra.com/v1/openai/images/generations",
-                    headers={
-                        "Authorization": f"Bearer {settings.DEEPINFRA_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "prompt": prompt,
-                        "size": f"{width}x{height}",
-                        "model": model['name'],
-                        "n": 1,
-                        "seed": seed if seed is not None else settings.DEFAULT_SEED
-                    },
-                    timeout=300  # 设置300秒超时
-                )
+                # 调用DeepInfra API（经密钥池选择密钥）
+                response = await _post_deepinfra_image({
+                    "prompt": prompt,
+                    "size": f"{width}x{height}",
+                    "model": model['name'],
+                    "n": 1,
+                    "seed": seed if seed is not None else settings.DEFAULT_SEED
+                })
                 # 打印请求参数
                 # print(
                 #     f"请求参数: {json.dumps(json.loads(response.request.body), indent=4)}")
@@ -385,6 +424,14 @@ async def generate_images(
                     logger.error(f"API响应格式错误: {result}")
                     image_paths.append("")
 
+            except DeadlineExceeded:
+                if i == 0:
+                    raise
+                # 时间预算用尽：返回已生成的图片，其余描述的图片留空
+                logger.warning(f"图片生成超过截止时间，已完成 {i}/{len(targets)} 张，返回部分结果")
+                metrics.incr("images.partial")
+                paragraphs_images.extend([[""] for _ in range(len(targets) - i)])
+                break
             except requests.exceptions.RequestException as req_err:
                 logger.error(f"API请求失败: {req_err}")
                 image_paths.append("")
@@ -463,6 +510,44 @@ def split_text(text, use_newline=True, use_punctuation=True):
     return [s for s in sentences if s]
 
 
+def _request_siliconflow_speech(api_key: str, prompt: str):
+    """使用指定密钥同步调用语音合成，请求结束后关闭HTTP客户端（响应内容已完整读取）"""
+    # 创建OpenAI客户端 - 使用安全的创建方式，避免代理设置问题
+    import httpx
+    # 使用工厂模式显式创建客户端，避免全局设置影响
+    with httpx.Client() as http_client:
+        client = OpenAI(
+            api_key=api_key,
+            base_url=settings.SILICONFLOW_URL,
+            http_client=http_client
+        )
+        return client.audio.speech.create(
+            model=settings.SILICONFLOW_MODEL,
+            voice=settings.SILICONFLOW_VOICE,
+            input=prompt,
+            response_format="mp3",
+            extra_body={"sample_rate": settings.AUDIO_SAMPLE_RATE}
+        )
+
+
+async def _create_siliconflow_speech(prompt: str):
+    """
+    通过SiliconFlow密钥池调用语音合成，令牌数按字符数估算；密钥被限流时冷却并换用其他密钥重试，
+    等待结果不超过请求的剩余预算
+    """
+    pool = get_key_pool("siliconflow")
+    for attempt in range(len(pool)):
+        api_key = await pool.acquire(tokens=len(prompt))
+        try:
+            # 同步客户端放到线程中执行，不阻塞事件循环
+            return await within_deadline(asyncio.to_thread(
+                _request_siliconflow_speech, api_key.key, prompt), "siliconflow")
+        except RateLimitError as e:
+            pool.mark_rate_limited(api_key, parse_retry_after(e.response.headers.get("retry-after")))
+            if attempt == len(pool) - 1:
+                raise
+
+
 # 语音生成函数
 async def generate_speech(text: str, emotion: str = "happy") -> str:
     """
@@ -483,20 +568,11 @@ async def generate_speech(text: str, emotion: str = "happy") -> str:
         os.makedirs(speech_dir, exist_ok=True)
 
         # 生成唯一文件名
+        # 并发生成时同一秒内会有多个文件，附加随机后缀避免互相覆盖
         timestamp = int(time.time())
-        filename = f"speech-{timestamp}.mp3"
+        filename = f"speech-{timestamp}-{uuid.uuid4().hex[:8]}.mp3"
         speech_file_path = speech_dir / filename
 
-        # 创建OpenAI客户端 - 使用安全的创建方式，避免代理设置问题
-        import httpx
-        # 使用工厂模式显式创建客户端，避免全局设置影响
-        http_client = httpx.Client()
-        client = OpenAI(
-            api_key=settings.SILICONFLOW_API_KEY,
-            base_url=settings.SILICONFLOW_URL,
-            http_client=http_client
-        )
-
         # 根据情感类型构建提示词
         emotion_prompts = {
             "happy": "你能用高兴的情感说吗？",
@@ -510,15 +586,13 @@ async def generate_speech(text: str, emotion: str = "happy") -> str:
         prompt = f"{emotion_prompt}<|endofprompt|> {text}"
 
         # 调用API生成语音
-        response = client.audio.speech.create(
-            model=settings.SILICONFLOW_MODEL,
-            voice=settings.SILICONFLOW_VOICE,
-            input=prompt,
-            response_format="mp3"
-        )
+        response = await _create_siliconflow_speech(prompt)
 
         # 保存响应到文件
-        response.stream_to_file(str(speech_file_path))
+        await within_deadline(asyncio.to_thread(response.stream_to_file, str(speech_file_path)), "siliconflow")
+
+        # 统一为规范音频格式，保证后续拼接可以直接复制音频流
+        await conform_audio_clip(str(speech_file_path))
 
         # 打印文件路径信息用于调试
         # print(
@@ -531,35 +605,318 @@ async def generate_speech(text: str, emotion: str = "happy") -> str:
         raise e
 
 
+def _format_srt_time(seconds: float) -> str:
+    """将秒数转换为 srt 时间格式 (HH:MM:SS,mmm)"""
+    millis = int(round(max(seconds, 0.0) * 1000))
+    return f"{millis//3600000:02d}:{(millis % 3600000)//60000:02d}:{(millis % 60000)//1000:02d},{millis % 1000:03d}"
+
+
+def _parse_srt_time(value: str) -> float:
+    """将 srt 时间格式 (HH:MM:SS,mmm) 转换为秒数"""
+    hours, minutes, rest = value.strip().replace('.', ',').split(':')
+    secs, millis = (rest.split(',') + ['0'])[:2]
+    return int(hours) * 3600 + int(minutes) * 60 + int(secs) + int(millis) / 1000
+
+
 def generate_subtitle_file(sentences: List[Tuple[str, float, float]], output_path: str):
     """
     生成srt格式的字幕文件
     """
     with open(output_path, 'w', encoding='utf-8') as f:
         for idx, (text, start_time, end_time) in enumerate(sentences, 1):
-            # 将秒数转换为 srt 时间格式 (HH:MM:SS,mmm)
-            start = f"{int(start_time//3600):02d}:{int((start_time%3600)//60):02d}:{int(start_time%60):02d},000"
-            end = f"{int(end_time//3600):02d}:{int((end_time%3600)//60):02d}:{int(end_time%60):02d},000"
+            start = _format_srt_time(start_time)
+            end = _format_srt_time(end_time)
 
             f.write(f"{idx}\n")
             f.write(f"{start} --> {end}\n")
             f.write(f"{text}\n\n")
 
 
-# 为段落生成语音、字幕和视频文件
-async def generate_paragraph_audio(title: str, paragraphs: List[str], emotion: str = "happy") -> List[Dict[str, str]]:
+def parse_subtitle_file(path: str) -> List[Tuple[str, float, float]]:
     """
-    为一组段落文本生成语音文件、字幕文件和合并后的视频文件
+    解析srt格式的字幕文件
+
+    Returns:
+        List[Tuple[str, float, float]]: (文本, 开始时间, 结束时间) 列表
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        blocks = re.split(r'\n\s*\n', f.read().replace('\r\n', '\n').strip())
+
+    sentences = []
+    for block in blocks:
+        lines = block.split('\n')
+        timing_idx = next((i for i, line in enumerate(lines) if '-->' in line), None)
+        if timing_idx is None:
+            continue
+        start, end = lines[timing_idx].split('-->')
+        text = '\n'.join(lines[timing_idx + 1:]).strip()
+        sentences.append((text, _parse_srt_time(start), _parse_srt_time(end)))
+    return sentences
+
+
+def merge_subtitle_files(subtitle_paths: List[str], offsets: List[float], output_path: str):
+    """
+    将多个段落字幕按各自的起始时间偏移合并为一个字幕文件
 
     Args:
-        paragraphs: 段落文本列表
-        emotion: 语音情感类型，默认为happy
+        subtitle_paths: 字幕文件路径列表
+        offsets: 每个字幕文件在合并后时间轴上的起始偏移(秒)
+        output_path: 合并后的字幕文件路径
+    """
+    merged = []
+    for path, offset in zip(subtitle_paths, offsets):
+        for text, start_time, end_time in parse_subtitle_file(path):
+            merged.append((text, start_time + offset, end_time + offset))
+    generate_subtitle_file(merged, output_path)
+
+
+# 规范媒体格式：所有语音片段和视频片段都编码为相同参数，拼接时才能走 -c copy 快速路径
+def canonical_audio_format() -> Dict[str, Any]:
+    """TTS语音片段的规范格式"""
+    return {
+        "codec_name": "mp3",
+        "sample_rate": settings.AUDIO_SAMPLE_RATE,
+        "channels": settings.AUDIO_CHANNELS,
+    }
+
+
+def canonical_audio_args() -> List[str]:
+    """将音频编码为规范格式的ffmpeg参数"""
+    return [
+        '-c:a', 'libmp3lame',
+        '-ar', str(settings.AUDIO_SAMPLE_RATE),
+        '-ac', str(settings.AUDIO_CHANNELS),
+        '-b:a', settings.AUDIO_BITRATE,
+    ]
+
+
+def get_render_profile(name: str = None) -> Dict[str, Any]:
+    """按名称获取视频渲染档位，默认使用最终成片档位"""
+    name = name or "final"
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"不支持的渲染档位: {name}")
+    return RENDER_PROFILES[name]
+
+
+def canonical_segment_format(profile: Dict[str, Any] = None) -> Dict[str, Dict[str, Any]]:
+    """视频片段的规范格式（按流类型区分）"""
+    profile = profile or get_render_profile()
+    return {
+        "video": {
+            "codec_name": "h264",
+            "width": profile["width"],
+            "height": profile["height"],
+            "pix_fmt": settings.VIDEO_PIX_FMT,
+            "r_frame_rate": f"{profile['fps']}/1",
+        },
+        "audio": {
+            "codec_name": "aac",
+            "sample_rate": settings.AUDIO_SAMPLE_RATE,
+            "channels": settings.AUDIO_CHANNELS,
+        },
+    }
+
+
+def canonical_frame_filter(profile: Dict[str, Any] = None) -> str:
+    """将任意尺寸的图片缩放并补边到规范分辨率的视频滤镜"""
+    profile = profile or get_render_profile()
+    width, height = profile["width"], profile["height"]
+    return (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1")
+
+
+def canonical_segment_args(profile: Dict[str, Any] = None) -> List[str]:
+    """将视频片段按渲染档位编码为规范格式的ffmpeg参数"""
+    profile = profile or get_render_profile()
+    return [
+        '-c:v', settings.VIDEO_CODEC,
+        '-preset', profile["preset"],
+        '-tune', profile["tune"],
+        '-crf', str(profile["crf"]),
+        '-g', str(profile["gop"]),
+        '-pix_fmt', settings.VIDEO_PIX_FMT,
+        '-r', str(profile["fps"]),
+        '-video_track_timescale', '90000',
+        '-c:a', settings.VIDEO_AUDIO_CODEC,
+        '-ar', str(settings.AUDIO_SAMPLE_RATE),
+        '-ac', str(settings.AUDIO_CHANNELS),
+        '-b:a', profile["audio_bitrate"],
+    ]
+
+
+async def probe_media_streams(path: str) -> List[Dict[str, Any]]:
+    """使用ffprobe获取媒体文件中各个流的编码参数"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries',
+        'stream=codec_type,codec_name,sample_rate,channels,width,height,pix_fmt,r_frame_rate',
+        '-of', 'json', path
+    ]
+    result = await run_ffprobe(cmd)
+    return json.loads(result.text or "{}").get("streams", [])
+
+
+def _stream_matches(stream: Dict[str, Any], expected: Dict[str, Any]) -> bool:
+    """比较单个流的参数是否与期望值一致（ffprobe部分字段以字符串返回）"""
+    return all(str(stream.get(key)) == str(value) for key, value in expected.items())
+
+
+async def is_canonical_audio(path: str) -> bool:
+    """校验语音文件是否符合规范音频格式"""
+    streams = [s for s in await probe_media_streams(path)
+               if s.get("codec_type") == "audio"]
+    return len(streams) == 1 and _stream_matches(streams[0], canonical_audio_format())
+
+
+async def is_canonical_segment(path: str, profile: Dict[str, Any] = None) -> bool:
+    """校验视频片段是否符合渲染档位的规范编码参数"""
+    expected = canonical_segment_format(profile)
+    streams = await probe_media_streams(path)
+    video = [s for s in streams if s.get("codec_type") == "video"]
+    audio = [s for s in streams if s.get("codec_type") == "audio"]
+    return (len(video) == 1 and len(audio) == 1
+            and _stream_matches(video[0], expected["video"])
+            and _stream_matches(audio[0], expected["audio"]))
+
+
+async def conform_audio_clip(path: str) -> bool:
+    """
+    校验语音片段，不符合规范格式时原地转码
 
     Returns:
-        List[Dict[str, str]]: 每个段落对应的语音、字幕和视频文件路径
+        bool: 是否进行了转码
     """
-    results = []
+    if await is_canonical_audio(path):
+        return False
+
+    conformed_path = f"{path}.conform.mp3"
+    cmd = ['ffmpeg', '-y', '-i', path, '-vn', '-map_metadata', '-1',
+           *canonical_audio_args(), conformed_path]
+    await run_ffmpeg(cmd)
+    os.replace(conformed_path, path)
+    metrics.incr("audio.clip.conformed")
+    logger.info(f"语音片段已转换为规范格式: {path}")
+    return True
+
+
+async def conform_segment(path: str, profile: Dict[str, Any] = None) -> bool:
+    """
+    校验视频片段，不符合规范编码参数时单独重新编码该片段
+
+    Returns:
+        bool: 是否进行了重新编码
+    """
+    if await is_canonical_segment(path, profile):
+        return False
+
+    conformed_path = f"{path}.conform.mp4"
+    cmd = ['ffmpeg', '-y', '-i', path, '-vf', canonical_frame_filter(profile),
+           *canonical_segment_args(profile), conformed_path]
+    await run_ffmpeg(cmd)
+    os.replace(conformed_path, path)
+    metrics.incr("video.segment.conformed")
+    logger.info(f"视频片段已转换为规范格式: {path}")
+    return True
+
+
+def peaks_path_for(audio_url: str) -> Path:
+    """音频文件对应的波形峰值旁路文件路径（与音频同目录，扩展名 .peaks.json）"""
+    audio_path = Path(audio_url.replace("/static/", "static/", 1))
+    return audio_path.with_name(f"{audio_path.stem}.peaks.json")
+
+
+async def compute_waveform_peaks(audio_path: str, buckets: int = None) -> Dict[str, Any]:
+    """
+    解码音频并计算下采样后的最小/最大峰值
+
+    Args:
+        audio_path: 音频文件路径
+        buckets: 下采样桶数，默认使用配置值
 
+    Returns:
+        Dict[str, Any]: 包含时长和峰值的字典，peaks 为交替排列的 [min, max, ...]，
+                        取值范围为 -127~127
+    """
+    buckets = buckets or settings.WAVEFORM_BUCKETS
+    sample_rate = settings.WAVEFORM_SAMPLE_RATE
+
+    # 以低采样率解码为单声道16位PCM，通过管道直接读取
+    cmd = ['ffmpeg', '-v', 'error', '-i', audio_path, '-vn',
+           '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', 'pipe:1']
+    result = await run_ffmpeg(cmd, capture_stdout=True)
+    samples = np.frombuffer(result.stdout, dtype=np.int16)
+
+    duration = len(samples) / sample_rate
+    buckets = max(1, min(buckets, len(samples)))
+    if len(samples) == 0:
+        return {"version": 1, "duration": 0.0, "buckets": 0, "peaks": []}
+
+    # 补零到桶数的整数倍后按桶分组，向量化求每桶的最小/最大值
+    bucket_size = -(-len(samples) // buckets)
+    padded = np.zeros(bucket_size * buckets, dtype=np.int16)
+    padded[:len(samples)] = samples
+    frames = padded.reshape(buckets, bucket_size)
+    peaks = np.empty(buckets * 2, dtype=np.int32)
+    peaks[0::2] = frames.min(axis=1)
+    peaks[1::2] = frames.max(axis=1)
+    peaks = np.clip(np.round(peaks * 127 / 32768), -127, 127).astype(np.int8)
+
+    return {
+        "version": 1,
+        "duration": round(duration, 3),
+        "buckets": buckets,
+        "peaks": peaks.tolist(),
+    }
+
+
+async def write_waveform_peaks(audio_url: str) -> Dict[str, Any]:
+    """计算音频的波形峰值并写入旁路文件，返回峰值数据"""
+    data = await compute_waveform_peaks(str(resolve_audio_file(audio_url)))
+    with open(peaks_path_for(audio_url), 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    return data
+
+
+def _remove_files(paths: List[str]):
+    """删除文件，忽略不存在的文件"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"删除临时文件失败: {path}, {e}")
+
+
+async def _conform_before_concat(paths: List[str], conform) -> None:
+    """拼接前的校验步骤，单个文件校验失败时记录日志，交由拼接的兜底路径处理"""
+    for path in paths:
+        try:
+            await conform(path)
+        except Exception as e:
+            logger.error(f"校验媒体格式失败: {path}, {e}")
+
+
+async def generate_page_audio(
+    paragraph: str,
+    para_id: str,
+    emotion: str = "happy",
+    on_progress: ProgressCallback = None,
+    compaction_jobs: list = None
+) -> Dict[str, Any]:
+    """
+    为单个页面（段落）生成逐句语音、字幕文件和合并后的段落音频
+
+    Args:
+        paragraph: 段落文本
+        para_id: 段落标识符，用于命名音频和字幕文件
+        emotion: 语音情感类型，默认为happy
+        on_progress: 进度回调，参数为 0~1 的完成比例
+        compaction_jobs: 压缩存储转码任务列表，传入时由调用方统一等待，否则返回前等待完成
+
+    Returns:
+        Dict[str, Any]: 段落音频、字幕和波形峰值文件路径以及音频时长
+    """
     # 确保目录存在
     subtitle_dir = settings.SUBTITLE_DIR
     os.makedirs(subtitle_dir, exist_ok=True)
@@ -570,182 +927,252 @@ async def generate_paragraph_audio(title: str, paragraphs: List[str], emotion: s
     temp_audio_dir = settings.TEMP_AUDIO_DIR
     os.makedirs(temp_audio_dir, exist_ok=True)
 
-    paragraphs = [title] + paragraphs
-
-    for idx, paragraph in enumerate(paragraphs):
-        try:
-            # 创建段落标识符
-            para_id = f"paragraph_{idx+1}_{int(time.time())}"
-
-            # 1. 使用split_text拆分文本
-            sentences = split_text(
-                paragraph, use_newline=True, use_punctuation=True)
+    local_compactions = compaction_jobs is None
+    if local_compactions:
+        compaction_jobs = []
 
-            # 2. 为每个句子生成临时语音文件并直接保存到临时目录
-            temp_audio_files = []
-            sentence_timings = []
-            current_time = 0.0
+    # 1. 使用split_text拆分文本
+    sentences = split_text(
+        paragraph, use_newline=True, use_punctuation=True)
 
-            for i, sentence in enumerate(sentences):
-                if not sentence.strip():
-                    continue
+    # 2. 为每个句子生成临时语音文件并直接保存到临时目录
+    temp_audio_files = []
+    sentence_timings = []
+    current_time = 0.0
+    concat_file = None
+    try:
+        for i, sentence in enumerate(sentences):
+            if not sentence.strip():
+                continue
 
-                # 生成语音文件
-                speech_url = await generate_speech(sentence, emotion)
+            # 生成语音文件
+            speech_url = await generate_speech(sentence, emotion)
 
-                # 获取源文件路径 (绝对路径)
-                src_file_path = os.path.abspath(
-                    speech_url.replace("/static/", "static/"))
+            # 获取源文件路径 (绝对路径)
+            src_file_path = os.path.abspath(
+                speech_url.replace("/static/", "static/"))
 
-                # 生成唯一的目标文件路径 (绝对路径)
-                temp_filename = f"temp_{para_id}_sentence_{i}.mp3"
-                temp_audio_path = os.path.abspath(
-                    os.path.join(str(temp_audio_dir), temp_filename))
+            # 生成唯一的目标文件路径 (绝对路径)
+            temp_filename = f"temp_{para_id}_sentence_{i}.mp3"
+            temp_audio_path = os.path.abspath(
+                os.path.join(str(temp_audio_dir), temp_filename))
 
-                # 将生成的语音文件复制到临时目录
-                try:
-                    if os.path.exists(src_file_path):
-                        import shutil
-                        shutil.copy2(src_file_path, temp_audio_path)
-                        # print(f"已复制文件: {src_file_path} -> {temp_audio_path}")
-                        # 将绝对路径添加到列表
+            # 将生成的语音文件复制到临时目录
+            try:
+                if os.path.exists(src_file_path):
+                    import shutil
+                    shutil.copy2(src_file_path, temp_audio_path)
+                    # print(f"已复制文件: {src_file_path} -> {temp_audio_path}")
+                    # 将绝对路径添加到列表
+                    temp_audio_files.append(temp_audio_path)
+                    compaction_jobs.append(schedule_compaction(speech_url))
+                else:
+                    logger.error(f"源文件不存在: {src_file_path}")
+                    # 尝试查找在当前目录下的文件
+                    alt_path = os.path.join(os.getcwd(), src_file_path)
+                    if os.path.exists(alt_path):
+                        shutil.copy2(alt_path, temp_audio_path)
+                        logger.info(
+                            f"使用替代路径复制文件: {alt_path} -> {temp_audio_path}")
                         temp_audio_files.append(temp_audio_path)
                     else:
-                        logger.error(f"源文件不存在: {src_file_path}")
-                        # 尝试查找在当前目录下的文件
-                        alt_path = os.path.join(os.getcwd(), src_file_path)
-                        if os.path.exists(alt_path):
-                            shutil.copy2(alt_path, temp_audio_path)
-                            logger.info(
-                                f"使用替代路径复制文件: {alt_path} -> {temp_audio_path}")
-                            temp_audio_files.append(temp_audio_path)
-                        else:
-                            logger.error(
-                                f"无法找到源文件，尝试的路径: {src_file_path}, {alt_path}")
-                except Exception as e:
-                    logger.error(f"复制语音文件失败: {e}")
-                    continue
-
-                # 估算语音持续时间（每个中文字符约0.3秒，每个英文单词约0.4秒）
-                chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', sentence))
-                english_words = len(re.findall(r'[a-zA-Z]+', sentence))
-                duration = chinese_chars * 0.3 + english_words * 0.4
-                duration = max(duration, 1.0)  # 最小1秒
-
-                # 记录时间轴
-                start_time = current_time
-                end_time = current_time + duration
-                sentence_timings.append((sentence, start_time, end_time))
-                current_time = end_time
-
-            # 3. 生成字幕文件
-            subtitle_file = subtitle_dir / f"{para_id}.srt"
-            generate_subtitle_file(sentence_timings, str(subtitle_file))
-
-            # 4. 合并所有语音文件
-            merged_audio = audio_dir / f"{para_id}.mp3"
-            merged_audio_abs = os.path.abspath(str(merged_audio))
-
-            # 使用ffmpeg合并音频文件
-            if len(temp_audio_files) > 0:
-                # 创建输入文件列表 (使用绝对路径)
-                concat_file = os.path.abspath(os.path.join(
-                    str(temp_audio_dir), f"{para_id}_list.txt"))
-
-                with open(concat_file, 'w', encoding='utf-8') as f:
-                    for audio_file in temp_audio_files:
-                        # 使用单引号包裹的绝对路径
-                        f.write(f"file '{audio_file}'\n")
-
-                # 打印concat文件内容用于调试
-                # print(f"concat文件内容 ({concat_file}):")
-                # with open(concat_file, 'r', encoding='utf-8') as f:
-                #     print(f.read())
-
-                # 执行合并命令 (使用绝对路径)
+                        logger.error(
+                            f"无法找到源文件，尝试的路径: {src_file_path}, {alt_path}")
+            except Exception as e:
+                logger.error(f"复制语音文件失败: {e}")
+                continue
+
+            # 估算语音持续时间（每个中文字符约0.3秒，每个英文单词约0.4秒）
+            chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', sentence))
+            english_words = len(re.findall(r'[a-zA-Z]+', sentence))
+            duration = chinese_chars * 0.3 + english_words * 0.4
+            duration = max(duration, 1.0)  # 最小1秒
+
+            # 记录时间轴
+            start_time = current_time
+            end_time = current_time + duration
+            sentence_timings.append((sentence, start_time, end_time))
+            current_time = end_time
+            if on_progress:
+                on_progress(0.8 * (i + 1) / len(sentences))
+
+        # 3. 生成字幕文件
+        subtitle_file = subtitle_dir / f"{para_id}.srt"
+        generate_subtitle_file(sentence_timings, str(subtitle_file))
+
+        # 4. 合并所有语音文件
+        merged_audio = audio_dir / f"{para_id}.mp3"
+        merged_audio_abs = os.path.abspath(str(merged_audio))
+
+        # 使用ffmpeg合并音频文件
+        if len(temp_audio_files) > 0:
+            # 创建输入文件列表 (使用绝对路径)
+            concat_file = os.path.abspath(os.path.join(
+                str(temp_audio_dir), f"{para_id}_list.txt"))
+
+            with open(concat_file, 'w', encoding='utf-8') as f:
+                for audio_file in temp_audio_files:
+                    # 使用单引号包裹的绝对路径
+                    f.write(f"file '{audio_file}'\n")
+
+            # 打印concat文件内容用于调试
+            # print(f"concat文件内容 ({concat_file}):")
+            # with open(concat_file, 'r', encoding='utf-8') as f:
+            #     print(f.read())
+
+            # 拼接前校验所有片段均为规范格式，保证走 -c copy 快速路径
+            await _conform_before_concat(temp_audio_files, conform_audio_clip)
+
+            # 执行合并命令 (使用绝对路径)
+            try:
+                cmd = [
+                    'ffmpeg',
+                    '-f', 'concat',
+                    '-safe', '0',
+                    '-i', concat_file,
+                    '-c', 'copy',
+                    merged_audio_abs
+                ]
+                # print(f"执行命令: {' '.join(cmd)}")
+                await run_ffmpeg(cmd, on_progress=progress_range(on_progress, 0.8, 0.95),
+                                 duration=current_time)
+                metrics.incr("audio.concat.copy")
+                # print(f"成功合并音频文件: {merged_audio_abs}")
+            except ProcessError as e:
+                logger.error(f"合并音频文件失败: {e}")
+                metrics.incr("audio.concat.fallback")
+                logger.error(
+                    f"错误输出: {e.stderr or '无错误输出'}")
+
+                # 尝试使用替代方法
                 try:
-                    cmd = [
+                    alternate_cmd = [
                         'ffmpeg',
-                        '-f', 'concat',
-                        '-safe', '0',
-                        '-i', concat_file,
-                        '-c', 'copy',
-                        merged_audio_abs
+                        '-i', temp_audio_files[0]  # 使用第一个文件
                     ]
-                    # print(f"执行命令: {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True)
-                    # print(f"成功合并音频文件: {merged_audio_abs}")
-                except subprocess.CalledProcessError as e:
-                    logger.error(f"合并音频文件失败: {e}")
+
+                    # 添加其余文件
+                    for audio_file in temp_audio_files[1:]:
+                        alternate_cmd.extend(['-i', audio_file])
+
+                    # 添加合并滤镜
+                    filter_complex = ""
+                    for i in range(len(temp_audio_files)):
+                        filter_complex += f"[{i}:0]"
+                    filter_complex += f"concat=n={len(temp_audio_files)}:v=0:a=1[out]"
+
+                    alternate_cmd.extend([
+                        '-filter_complex', filter_complex,
+                        '-map', '[out]',
+                        *canonical_audio_args(),
+                        merged_audio_abs
+                    ])
+
+                    logger.info(f"尝试替代命令: {' '.join(alternate_cmd)}")
+                    await run_ffmpeg(alternate_cmd)
+                    logger.info(
+                        f"使用替代方法成功合并音频文件: {merged_audio_abs}")
+                except ProcessError as alt_e:
+                    logger.error(f"替代方法合并失败: {alt_e}")
                     logger.error(
-                        f"错误输出: {e.stderr.decode() if e.stderr else '无错误输出'}")
-
-                    # 尝试使用替代方法
-                    try:
-                        alternate_cmd = [
-                            'ffmpeg',
-                            '-i', temp_audio_files[0]  # 使用第一个文件
-                        ]
-
-                        # 添加其余文件
-                        for audio_file in temp_audio_files[1:]:
-                            alternate_cmd.extend(['-i', audio_file])
-
-                        # 添加合并滤镜
-                        filter_complex = ""
-                        for i in range(len(temp_audio_files)):
-                            filter_complex += f"[{i}:0]"
-                        filter_complex += f"concat=n={len(temp_audio_files)}:v=0:a=1[out]"
-
-                        alternate_cmd.extend([
-                            '-filter_complex', filter_complex,
-                            '-map', '[out]',
-                            merged_audio_abs
-                        ])
-
-                        logger.info(f"尝试替代命令: {' '.join(alternate_cmd)}")
-                        subprocess.run(alternate_cmd, check=True,
-                                       capture_output=True)
-                        logger.info(
-                            f"使用替代方法成功合并音频文件: {merged_audio_abs}")
-                    except subprocess.CalledProcessError as alt_e:
-                        logger.error(f"替代方法合并失败: {alt_e}")
-                        logger.error(
-                            f"错误输出: {alt_e.stderr.decode() if alt_e.stderr else '无错误输出'}")
-
-                        # 如果合并失败，使用第一个音频文件作为结果
-                        if temp_audio_files:
-                            # 复制第一个文件到最终位置
-                            try:
-                                import shutil
-                                shutil.copy2(
-                                    temp_audio_files[0], merged_audio_abs)
-                                logger.info(
-                                    f"已将第一个音频文件复制到最终位置: {merged_audio_abs}")
-                            except Exception as copy_err:
-                                logger.error(
-                                    f"复制第一个音频文件失败: {copy_err}")
-
-                # 删除临时的concat文件
+                        f"错误输出: {alt_e.stderr or '无错误输出'}")
+
+                    # 如果合并失败，使用第一个音频文件作为结果
+                    if temp_audio_files:
+                        # 复制第一个文件到最终位置
+                        try:
+                            import shutil
+                            shutil.copy2(
+                                temp_audio_files[0], merged_audio_abs)
+                            logger.info(
+                                f"已将第一个音频文件复制到最终位置: {merged_audio_abs}")
+                        except Exception as copy_err:
+                            logger.error(
+                                f"复制第一个音频文件失败: {copy_err}")
+
+            # 删除临时的concat文件
+            try:
+                os.remove(concat_file)
+            except Exception as rm_err:
+                logger.error(f"删除临时文件失败: {rm_err}")
+
+            # 清理临时音频文件
+            for temp_file in temp_audio_files:
                 try:
-                    os.remove(concat_file)
+                    os.remove(temp_file)
                 except Exception as rm_err:
-                    logger.error(f"删除临时文件失败: {rm_err}")
+                    logger.error(
+                        f"删除临时音频文件失败: {temp_file}, {rm_err}")
+    except (asyncio.CancelledError, DeadlineExceeded):
+        # 任务被取消或超过截止时间：删除已复制到 temp/ 的句子音频和拼接列表，不留下残留文件
+        _remove_files(temp_audio_files + ([concat_file] if concat_file else []))
+        raise
+
+    # 5. 预先计算波形峰值，播放器无需下载整段音频即可绘制波形
+    audio_url = f"/static/audio/{merged_audio.name}"
+    peaks_url = None
+    duration = None
+    if len(temp_audio_files) > 0:
+        try:
+            peaks = await write_waveform_peaks(audio_url)
+            peaks_url = f"/static/audio/{peaks_path_for(audio_url).name}"
+            duration = peaks["duration"]
+        except Exception as peaks_err:
+            logger.error(f"计算波形峰值失败: {peaks_err}")
 
-                # 清理临时音频文件
-                for temp_file in temp_audio_files:
-                    try:
-                        os.remove(temp_file)
-                    except Exception as rm_err:
-                        logger.error(
-                            f"删除临时音频文件失败: {temp_file}, {rm_err}")
+        # 合并后的段落音频转为压缩存储格式
+        compaction_jobs.append(schedule_compaction(merged_audio))
 
-            # 添加结果
-            results.append({
-                "paragraph_id": para_id,
-                "audio_path": f"/static/audio/{merged_audio.name}",
-                "subtitle_path": f"/static/subtitles/{subtitle_file.name}",
-            })
+    if on_progress:
+        on_progress(1.0)
+
+    if local_compactions:
+        # 未由调用方统一等待时，返回前等待本段落的压缩转码完成
+        await wait_compactions(compaction_jobs)
+
+    return {
+        "paragraph_id": para_id,
+        "audio_path": audio_url,
+        "subtitle_path": f"/static/subtitles/{subtitle_file.name}",
+        "peaks_path": peaks_url,
+        "duration": duration,
+    }
+
+
+# 为段落生成语音、字幕和视频文件
+async def generate_paragraph_audio(
+    title: str,
+    paragraphs: List[str],
+    emotion: str = "happy",
+    on_progress: ProgressCallback = None
+) -> List[Dict[str, str]]:
+    """
+    为一组段落文本生成语音文件、字幕文件和合并后的视频文件
+
+    Args:
+        paragraphs: 段落文本列表
+        emotion: 语音情感类型，默认为happy
+        on_progress: 进度回调，参数为 0~1 的完成比例
+
+    Returns:
+        List[Dict[str, str]]: 每个段落对应的语音、字幕和视频文件路径
+    """
+    results = []
+
+    paragraphs = [title] + paragraphs
+
+    # 压缩存储转码任务，在工作池中与后续段落的语音生成并行执行
+    compaction_jobs = []
+
+    for idx, paragraph in enumerate(paragraphs):
+        # 每个段落占整体进度的相同份额
+        paragraph_progress = progress_range(
+            on_progress, idx / len(paragraphs), (idx + 1) / len(paragraphs))
+        try:
+            # 创建段落标识符
+            para_id = f"paragraph_{idx+1}_{int(time.time())}"
+            results.append(await generate_page_audio(
+                paragraph, para_id, emotion, paragraph_progress, compaction_jobs))
 
         except Exception as e:
             logger.error(f"处理段落 {idx+1} 时出错: {str(e)}")
@@ -756,133 +1183,572 @@ async def generate_paragraph_audio(title: str, paragraphs: List[str], emotion: s
                 "error": str(e),
             })
 
+    # 等待压缩转码完成，保证返回后磁盘上的文件已稳定
+    await wait_compactions(compaction_jobs)
+
     return results
 
 
-# 为段落生成完整视频
-async def create_paragraph_video(
+async def probe_duration(path: str) -> float:
+    """使用ffprobe获取媒体文件时长(秒)"""
+    duration_cmd = ['ffprobe', '-v', 'error', '-show_entries',
+                    'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', path]
+    result = await run_ffprobe(duration_cmd)
+    return float(result.text.strip())
+
+
+def segment_parallelism(segment_count: int, cpu_budget: int = None) -> Tuple[int, int]:
+    """
+    计算片段并行编码的并发数和每个ffmpeg进程的线程数，保证总线程数不超过CPU预算
+
+    Args:
+        segment_count: 待编码的片段数
+        cpu_budget: 本次渲染分配到的CPU令牌数，默认为全部可用核数
+
+    Returns:
+        Tuple[int, int]: (并发进程数, 每个进程的编码线程数)
+    """
+    cpus = cpu_budget or available_cpus()
+    workers = settings.VIDEO_SEGMENT_WORKERS or cpus
+    workers = max(1, min(workers, segment_count, cpus))
+    threads = settings.VIDEO_THREADS_PER_SEGMENT or max(1, cpus // workers)
+    return workers, threads
+
+
+def build_segment_cmd(
+    image_path: str,
+    audio_path: str,
+    subtitle_path: str,
+    duration: float,
+    output_path: str,
+    fade_duration: float = 0.5,
+    extra_delay: float = 0.0,
+    threads: int = None,
+    profile: Dict[str, Any] = None
+) -> List[str]:
+    """
+    构建单个页面视频片段（图片+音频+字幕）的ffmpeg编码命令
+
+    Args:
+        image_path: 图片文件路径
+        audio_path: 音频文件路径
+        subtitle_path: 要烧录的字幕文件路径，None表示不烧录
+        duration: 音频时长(秒)
+        output_path: 片段输出路径
+        fade_duration: 淡入淡出持续时间(秒)
+        extra_delay: 音频结束后额外保持画面的时长(秒)，封面使用
+        threads: ffmpeg编码线程数，None表示由ffmpeg自行决定
+        profile: 渲染档位，默认为最终成片档位
+
+    Returns:
+        List[str]: ffmpeg命令参数列表
+    """
+    total_duration = duration + extra_delay
+
+    # 创建带有音频和字幕的视频片段
+    # 所有片段使用同一套规范编码参数，保证拼接时可以直接复制流
+    segment_cmd = [
+        'ffmpeg', '-y',
+        '-loop', '1',
+        '-i', image_path,
+        '-i', audio_path,
+        *canonical_segment_args(profile),
+        '-shortest'
+    ]
+    if threads:
+        segment_cmd.extend(['-threads', str(threads)])
+
+    # 构建视频过滤器（先统一分辨率）
+    vf_filter = f"{canonical_frame_filter(profile)},fade=t=in:st=0:d={fade_duration}"
+
+    if extra_delay > 0:
+        # 音频结束后保持图像显示，使用apad过滤器延长音频
+        segment_cmd.extend([
+            '-af', f"apad=pad_dur={extra_delay}"
+        ])
+    # 淡出效果从（延长后的）总时长开始
+    vf_filter += f",fade=t=out:st={total_duration-fade_duration}:d={fade_duration}"
+
+    # 烧录字幕（Windows系统下字幕过滤器路径不能带引号）
+    if subtitle_path:
+        if os.name == 'nt':
+            vf_filter += f",subtitles={subtitle_path}"
+        else:
+            vf_filter += f",subtitles='{subtitle_path}'"
+    segment_cmd.extend(['-vf', vf_filter])
+
+    # 设置总时长
+    segment_cmd.extend([
+        '-t', str(total_duration + 0.5),  # 额外添加0.5秒确保字幕完全显示
+        output_path
+    ])
+    return segment_cmd
+
+
+def build_filtergraph_cmd(
     image_paths: List[str],
     audio_paths: List[str],
-    subtitle_paths: List[str],
-    output_filename: str = None,
+    durations: List[float],
+    output_path: str,
+    subtitle_path: str = None,
+    fade_duration: float = 0.5,
     transition_duration: float = 1.0,
-    fade_duration: float = 0.5
-) -> str:
+    cover_delay: float = 2.0,
+    threads: int = None,
+    profile: Dict[str, Any] = None
+) -> Tuple[List[str], List[float], float]:
     """
-    根据图片、音频和字幕文件合成视频
+    构建单条ffmpeg滤镜图命令：所有页面一次编码完成，页面之间使用 xfade/acrossfade 过渡
+
+    每页画面时长 = 旁白时长（封面额外停留 cover_delay）+ 前后各一个过渡时长，
+    页面音频在过渡区间前后补静音，交叉淡化只发生在静音部分，旁白不会互相重叠。
 
     Args:
-        image_paths: 图片文件路径列表，第一张作为封面
-        audio_paths: 音频文件路径列表，每段音频对应一张图片
-        subtitle_paths: 字幕文件路径列表，每个字幕对应一段音频
-        output_filename: 输出视频文件名，默认为根据时间戳生成
-        transition_duration: 图片过渡持续时间(秒)
-        fade_duration: 淡入淡出持续时间(秒)
+        image_paths: 图片文件路径列表
+        audio_paths: 音频文件路径列表
+        durations: 每段音频时长(秒)
+        output_path: 输出视频路径
+        subtitle_path: 已按时间轴合并好的字幕文件，None表示不烧录字幕
+        fade_duration: 视频开头淡入和结尾淡出时长(秒)
+        transition_duration: 页面之间的过渡时长(秒)
+        cover_delay: 封面旁白结束后额外停留时长(秒)
+        threads: ffmpeg编码线程数
+        profile: 渲染档位，默认为最终成片档位
 
     Returns:
-        str: 生成的视频文件URL路径
+        Tuple[List[str], List[float], float]: ffmpeg命令、每页旁白在输出时间轴上的起始时间、输出总时长
     """
-    if len(image_paths) < 2:
-        raise ValueError("至少需要两张图片（一张封面和一张内容图片）")
+    count = len(image_paths)
+    # 过渡时长不能超过最短页面时长的一半
+    transition = max(0.0, min(transition_duration, min(durations) / 2)) if count > 1 else 0.0
+    profile = profile or get_render_profile()
+    fps = profile["fps"]
+
+    # 每页画面时长与在输出时间轴上的起点
+    lead_ins = [transition if i > 0 else 0.0 for i in range(count)]
+    tails = [transition if i < count - 1 else 0.0 for i in range(count)]
+    page_lengths = [
+        lead_ins[i] + durations[i] + (cover_delay if i == 0 else 0.0) + tails[i]
+        for i in range(count)
+    ]
+    page_starts = []
+    current = 0.0
+    for length in page_lengths:
+        page_starts.append(current)
+        current += length - transition
+    total_duration = sum(page_lengths) - transition * (count - 1)
+    narration_starts = [page_starts[i] + lead_ins[i] for i in range(count)]
+
+    cmd = ['ffmpeg', '-y']
+    for image_path, length in zip(image_paths, page_lengths):
+        cmd.extend(['-loop', '1', '-framerate', str(fps),
+                   '-t', f"{length:.3f}", '-i', image_path])
+    for audio_path in audio_paths:
+        cmd.extend(['-i', audio_path])
+
+    channel_layout = "mono" if settings.AUDIO_CHANNELS == 1 else "stereo"
+    filters = []
+    for i in range(count):
+        filters.append(
+            f"[{i}:v]{canonical_frame_filter(profile)},fps={fps},format={settings.VIDEO_PIX_FMT},settb=AVTB[v{i}]")
+        filters.append(
+            f"[{count + i}:a]aresample={settings.AUDIO_SAMPLE_RATE},"
+            f"aformat=sample_fmts=fltp:channel_layouts={channel_layout},"
+            f"adelay={int(lead_ins[i] * 1000)}:all=1,"
+            f"apad=whole_dur={page_lengths[i]:.3f},atrim=0:{page_lengths[i]:.3f},asetpts=PTS-STARTPTS[a{i}]")
+
+    # 逐页串联过渡
+    video_label, audio_label = "v0", "a0"
+    for i in range(1, count):
+        filters.append(
+            f"[{video_label}][v{i}]xfade=transition=fade:duration={transition:.3f}:offset={page_starts[i]:.3f}[xv{i}]")
+        filters.append(
+            f"[{audio_label}][a{i}]acrossfade=d={transition:.3f}:c1=tri:c2=tri[xa{i}]")
+        video_label, audio_label = f"xv{i}", f"xa{i}"
+
+    # 整体淡入淡出和字幕
+    final_video = (f"[{video_label}]fade=t=in:st=0:d={fade_duration},"
+                   f"fade=t=out:st={max(total_duration - fade_duration, 0):.3f}:d={fade_duration}")
+    if subtitle_path:
+        if os.name == 'nt':
+            final_video += f",subtitles={subtitle_path}"
+        else:
+            final_video += f",subtitles='{subtitle_path}'"
+    filters.append(final_video + "[vout]")
+
+    cmd.extend([
+        '-filter_complex', ';'.join(filters),
+        '-map', '[vout]', '-map', f"[{audio_label}]",
+        *canonical_segment_args(profile),
+        '-t', f"{total_duration:.3f}",
+    ])
+    if threads:
+        cmd.extend(['-threads', str(threads)])
+    cmd.append(output_path)
+    return cmd, narration_starts, total_duration
+
+
+# 片段缓存版本号，片段命令构建方式变化时递增以使旧缓存失效
+SEGMENT_CACHE_VERSION = 1
+# 缓存目录下存放编码中片段的子目录，与缓存位于同一文件系统，编码完成后原子地发布
+SEGMENT_TEMP_DIR = "tmp"
+
+# 本进程中正在编码或拼接的缓存片段及其引用次数，淘汰缓存时跳过
+_segments_in_use: Dict[str, int] = {}
+
+
+def segment_cache_key(
+    image_path: str,
+    audio_path: str,
+    subtitle_path: str,
+    fade_duration: float,
+    extra_delay: float,
+    profile: Dict[str, Any] = None
+) -> str:
+    """
+    计算页面视频片段的缓存键：图片、音频、字幕内容以及淡入淡出和编码参数的哈希
 
-    if len(audio_paths) != len(image_paths):
-        raise ValueError("音频文件数量应等于图片数量")
+    编码线程数不影响画面内容，不计入缓存键
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{SEGMENT_CACHE_VERSION}".encode())
+    for path in (image_path, audio_path, subtitle_path):
+        if path is None:
+            digest.update(b'\1')
+            continue
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    params = [fade_duration, extra_delay,
+              canonical_frame_filter(profile), *canonical_segment_args(profile)]
+    digest.update(json.dumps(params).encode())
+    return digest.hexdigest()
+
+
+@contextmanager
+def _using_segments(paths: List[str]):
+    """标记片段正在被本进程的渲染使用，期间不会被淘汰"""
+    for path in paths:
+        _segments_in_use[path] = _segments_in_use.get(path, 0) + 1
+    try:
+        yield
+    finally:
+        for path in paths:
+            _segments_in_use[path] -= 1
+            if not _segments_in_use[path]:
+                del _segments_in_use[path]
 
-    if len(subtitle_paths) != len(audio_paths):
-        raise ValueError("字幕文件数量应等于音频文件数量")
 
-    # 创建输出文件名
-    timestamp = int(time.time())
-    if not output_filename or output_filename == "string" or not output_filename.strip():
-        output_filename = f"video_{timestamp}.mp4"
-    else:
-        # 确保文件名有效并以.mp4结尾
-        output_filename = output_filename.strip()
-        if not output_filename.endswith('.mp4'):
-            output_filename = f"{output_filename}.mp4"
+def _touch_cached_segment(path: str) -> bool:
+    """命中缓存时更新访问时间供LRU淘汰使用，返回False表示片段不存在（或恰好已被淘汰）"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
 
-    # 确保输出目录存在
-    output_dir = Path("static/videos")
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = output_dir / output_filename
 
-    # 打印输出文件路径用于调试
-    logger.info(
-        f"视频将输出到: {output_path} (绝对路径: {os.path.abspath(output_path)})")
+def _segment_temp_path(cached_segment: str) -> str:
+    """
+    片段编码时的临时输出路径
 
-    # 创建临时目录
-    temp_dir = tempfile.mkdtemp()
-    logger.info(f"使用临时目录: {temp_dir}")
+    位于缓存目录下，与缓存片段在同一文件系统，编码完成后通过 os.replace 原子地发布，
+    其他渲染命中缓存时不会读到写了一半的文件
+    """
+    temp_dir = settings.SEGMENT_CACHE_DIR / SEGMENT_TEMP_DIR
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.abspath(temp_dir / f"{uuid.uuid4().hex}_{os.path.basename(cached_segment)}")
 
+
+def _discard_file(path: str):
     try:
-        # 创建段落视频片段
-        segment_paths = []
-
-        # 为每个段落创建视频
-        for i in range(len(audio_paths)):
-            # 处理路径（去掉/static/前缀）
-            image_path = image_paths[i].replace("/static/", "static/")
-            audio_path = audio_paths[i].replace("/static/", "static/")
-            subtitle_path = subtitle_paths[i].replace("/static/", "static/")
-
-            # 获取音频持续时间
-            duration_cmd = ['ffprobe', '-v', 'error', '-show_entries',
-                            'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', audio_path]
-            result = subprocess.run(
-                duration_cmd, capture_output=True, text=True, check=True)
-            duration = float(result.stdout.strip())
-
-            # 段落视频输出路径
-            segment_output = os.path.join(temp_dir, f"segment_{i}.mp4")
-
-            # 如果是第一个段落（封面），添加额外的2秒延迟
-            extra_delay = 2.0 if i == 0 else 0.0
-            total_duration = duration + extra_delay
-
-            # 创建带有音频和字幕的视频片段
-            segment_cmd = [
-                'ffmpeg', '-y',
-                '-loop', '1',
-                '-i', image_path,
-                '-i', audio_path,
-                '-i', subtitle_path,
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-shortest',
-                '-pix_fmt', 'yuv420p'
-            ]
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-            # 构建视频过滤器
-            vf_filter = f"fade=t=in:st=0:d={fade_duration}"
-
-            # 如果是第一个段落（封面），添加额外的延迟
-            if i == 0:
-                # 音频结束后保持图像显示2秒
-                # 使用apad过滤器延长音频
-                segment_cmd.extend([
-                    '-af', f"apad=pad_dur={extra_delay}"
-                ])
-                # 淡出效果从延长后的总时长开始
-                vf_filter += f",fade=t=out:st={total_duration-fade_duration}:d={fade_duration}"
-            else:
-                vf_filter += f",fade=t=out:st={duration-fade_duration}:d={fade_duration}"
 
-            # 添加字幕
-            vf_filter += f",subtitles='{subtitle_path}'"
-            segment_cmd.extend(['-vf', vf_filter])
+def _remove_stale_temp_segments(temp_dir: Path, now: float):
+    """清理中断的编码遗留的临时片段（超过ffmpeg超时时间仍未发布，说明编码进程已不存在）"""
+    if not settings.FFMPEG_TIMEOUT or not temp_dir.exists():
+        return
+    for path in temp_dir.glob("*.mp4"):
+        try:
+            if now - path.stat().st_mtime > settings.FFMPEG_TIMEOUT:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def prune_segment_cache():
+    """
+    片段缓存超过容量上限时，按最近使用时间淘汰最旧的片段
+
+    本进程中正在编码或拼接的片段，以及最近 SEGMENT_CACHE_MIN_AGE 秒内生成或命中的片段
+    （可能即将被其他渲染或其他进程拼接）不淘汰
+    """
+    cache_dir = settings.SEGMENT_CACHE_DIR
+    if not cache_dir.exists():
+        return
+    now = time.time()
+    _remove_stale_temp_segments(cache_dir / SEGMENT_TEMP_DIR, now)
+    entries = []
+    for path in cache_dir.glob("*.mp4"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # 已被其他进程淘汰
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= settings.SEGMENT_CACHE_MAX_BYTES:
+            break
+        if now - mtime < settings.SEGMENT_CACHE_MIN_AGE or os.path.abspath(path) in _segments_in_use:
+            continue
+        try:
+            path.unlink()
+            total -= size
+            metrics.incr("video.segment_cache.evicted")
+        except FileNotFoundError:
+            total -= size
+        except OSError as e:
+            logger.error(f"淘汰片段缓存失败: {path}, {e}")
+
+
+async def _render_with_filtergraph(
+    image_paths: List[str],
+    audio_paths: List[str],
+    subtitle_paths: List[str],
+    output_path: str,
+    temp_dir: str,
+    fade_duration: float,
+    transition_duration: float,
+    profile: Dict[str, Any],
+    burn_subtitles: bool = True,
+    on_progress: ProgressCallback = None,
+    cpu_budget: int = None
+) -> List[float]:
+    """
+    使用单条滤镜图渲染整本绘本视频，不产生中间片段文件
+
+    Returns:
+        List[float]: 每页旁白在输出时间轴上的起始时间
+    """
+    image_files = [p.replace("/static/", "static/") for p in image_paths]
+    audio_files = [str(resolve_audio_file(p)) for p in audio_paths]
+    subtitle_files = [p.replace("/static/", "static/") for p in subtitle_paths]
+    durations = await asyncio.gather(*[probe_duration(p) for p in audio_files])
+
+    # 先计算各页旁白在输出时间轴上的位置，再据此合并字幕
+    _, narration_starts, _ = build_filtergraph_cmd(
+        image_files, audio_files, durations, output_path,
+        fade_duration=fade_duration, transition_duration=transition_duration,
+        profile=profile)
+    merged_subtitle = None
+    if burn_subtitles:
+        merged_subtitle = os.path.join(temp_dir, "merged.srt")
+        merge_subtitle_files(subtitle_files, narration_starts, merged_subtitle)
+
+    cmd, _, total_duration = build_filtergraph_cmd(
+        image_files, audio_files, durations, output_path,
+        subtitle_path=merged_subtitle,
+        fade_duration=fade_duration,
+        transition_duration=transition_duration,
+        threads=cpu_budget or available_cpus(),
+        profile=profile)
+
+    logger.info(f"使用滤镜图引擎渲染 {len(image_files)} 页，预计时长 {total_duration:.2f} 秒")
+    await run_ffmpeg(cmd, on_progress=on_progress, duration=total_duration)
+    metrics.incr("video.render.filtergraph")
+    return narration_starts
+
+
+def _page_segment_spec(
+    image_url: str,
+    audio_url: str,
+    subtitle_url: str,
+    page_index: int,
+    fade_duration: float,
+    profile: Dict[str, Any],
+    burn_subtitles: bool
+) -> Tuple[str, str, Optional[str], float, str]:
+    """
+    计算单个页面片段的编码输入和缓存位置
+
+    Returns:
+        Tuple: (图片路径, 音频路径, 要烧录的字幕路径或None, 额外停留时长, 缓存片段路径)
+    """
+    # 处理路径（去掉/static/前缀）
+    image_path = image_url.replace("/static/", "static/")
+    # 音频可能以压缩格式存储，需要找到实际文件
+    audio_path = str(resolve_audio_file(audio_url))
+    # 不烧录字幕时字幕不影响画面，也不计入缓存键
+    subtitle_path = subtitle_url.replace(
+        "/static/", "static/") if burn_subtitles else None
+    # 如果是第一个段落（封面），添加额外的2秒延迟
+    extra_delay = 2.0 if page_index == 0 else 0.0
+
+    cache_key = segment_cache_key(
+        image_path, audio_path, subtitle_path, fade_duration, extra_delay, profile)
+    cached_segment = os.path.abspath(
+        settings.SEGMENT_CACHE_DIR / f"{cache_key}.mp4")
+    return image_path, audio_path, subtitle_path, extra_delay, cached_segment
+
+
+async def encode_page_segment(
+    image_url: str,
+    audio_url: str,
+    subtitle_url: str,
+    page_index: int,
+    fade_duration: float = 0.5,
+    profile: str = "final",
+    subtitle_mode: str = None,
+    priority: int = None
+) -> str:
+    """
+    预先编码单个页面的视频片段并放入片段缓存
+
+    参数与 create_paragraph_video 的 segments 引擎一致，之后合成整本视频时该页直接命中缓存，
+    用于页面图片和语音就绪后立即开始编码，不必等待所有页面完成
+
+    Returns:
+        str: 缓存片段的路径
+    """
+    render_profile = get_render_profile(profile)
+    burn_subtitles = (subtitle_mode or settings.VIDEO_SUBTITLE_MODE) == "burn"
+    os.makedirs(settings.SEGMENT_CACHE_DIR, exist_ok=True)
+    image_path, audio_path, subtitle_path, extra_delay, cached_segment = _page_segment_spec(
+        image_url, audio_url, subtitle_url, page_index, fade_duration, render_profile, burn_subtitles)
+
+    if _touch_cached_segment(cached_segment):
+        metrics.incr("video.segment_cache.hit")
+        return cached_segment
+
+    metrics.incr("video.segment_cache.miss")
+    if priority is None:
+        priority = render_profile.get("priority", 0)
+    duration = await probe_duration(audio_path)
+    # 单个片段只申请一个令牌，多个页面的片段由调度器并行安排
+    async with get_render_scheduler().slot(tokens=1, priority=priority) as cpu_budget:
+        # 先编码到缓存目录下的临时文件，成功后原子地发布到缓存，避免留下或读到不完整的缓存文件
+        segment_output = _segment_temp_path(cached_segment)
+        cmd = build_segment_cmd(
+            image_path, audio_path, subtitle_path, duration, segment_output,
+            fade_duration=fade_duration, extra_delay=extra_delay,
+            threads=cpu_budget, profile=render_profile)
+        try:
+            await run_ffmpeg(cmd)
+            os.replace(segment_output, cached_segment)
+        finally:
+            _discard_file(segment_output)
+    return cached_segment
+
+
+async def _render_with_segments(
+    image_paths: List[str],
+    audio_paths: List[str],
+    subtitle_paths: List[str],
+    output_path: str,
+    temp_dir: str,
+    fade_duration: float,
+    profile: Dict[str, Any],
+    burn_subtitles: bool = True,
+    on_progress: ProgressCallback = None,
+    cpu_budget: int = None
+) -> List[float]:
+    """
+    逐页编码视频片段（命中缓存的页面直接复用）后无损拼接
+
+    Returns:
+        List[float]: 每页旁白在输出时间轴上的起始时间
+    """
+    # 1. 按内容哈希查找片段缓存，只为缓存未命中的页面构建编码命令
+    os.makedirs(settings.SEGMENT_CACHE_DIR, exist_ok=True)
+    segment_paths = []
+    pending = []  # 需要编码的页面参数、临时输出路径和缓存路径
+
+    for i in range(len(audio_paths)):
+        image_path, audio_path, subtitle_path, extra_delay, cached_segment = _page_segment_spec(
+            image_paths[i], audio_paths[i], subtitle_paths[i], i, fade_duration, profile, burn_subtitles)
+        segment_paths.append(cached_segment)
+
+        if _touch_cached_segment(cached_segment):
+            # 命中缓存：拼接时直接复制流
+            metrics.incr("video.segment_cache.hit")
+            continue
 
-            # 设置总时长
-            segment_cmd.extend([
-                '-t', str(total_duration + 0.5),  # 额外添加0.5秒确保字幕完全显示
-                segment_output
-            ])
+        metrics.incr("video.segment_cache.miss")
+        # 先编码到缓存目录下的临时文件，成功后原子地发布到缓存，避免留下或读到不完整的缓存文件
+        segment_output = _segment_temp_path(cached_segment)
+        pending.append((image_path, audio_path, subtitle_path, extra_delay,
+                        segment_output, cached_segment))
+
+    # 编码和拼接期间本渲染用到的片段不会被淘汰
+    with _using_segments(segment_paths):
+        # 2. 未命中的片段互不依赖，限制并发数并行编码，结果按原顺序拼接
+        if pending:
+            workers, threads = segment_parallelism(len(pending), cpu_budget)
+            durations = await asyncio.gather(*[probe_duration(job[1]) for job in pending])
+            segment_cmds = [
+                build_segment_cmd(
+                    image_path,
+                    audio_path,
+                    subtitle_path,
+                    duration,
+                    segment_output,
+                    fade_duration=fade_duration,
+                    extra_delay=extra_delay,
+                    threads=threads,
+                    profile=profile
+                )
+                for (image_path, audio_path, subtitle_path, extra_delay, segment_output, _), duration
+                in zip(pending, durations)
+            ]
+            logger.info(
+                f"并行编码 {len(segment_cmds)}/{len(segment_paths)} 个视频片段: {workers} 个并发 x 每个 {threads} 线程")
+            semaphore = asyncio.Semaphore(workers)
+
+            # 编码阶段占整体进度的90%，按各片段已编码时长之和计算
+            encode_progress = progress_range(on_progress, 0.0, 0.9)
+            segment_lengths = [duration + job[3] for job, duration in zip(pending, durations)]
+            encoded = [0.0] * len(segment_cmds)
+
+            def segment_reporter(index):
+                if encode_progress is None:
+                    return None
+
+                def report(fraction):
+                    encoded[index] = fraction * segment_lengths[index]
+                    encode_progress(sum(encoded) / sum(segment_lengths))
+                return report
+
+            async def encode(index, cmd):
+                async with semaphore:
+                    await run_ffmpeg(cmd, on_progress=segment_reporter(index),
+                                     duration=segment_lengths[index])
+
+            # 任一片段失败时取消其余编码任务，不留下运行中的ffmpeg进程
+            try:
+                await gather_or_cancel(*[encode(i, cmd) for i, cmd in enumerate(segment_cmds)])
+                for *_, segment_output, cached_segment in pending:
+                    os.replace(segment_output, cached_segment)
+            finally:
+                for *_, segment_output, _ in pending:
+                    _discard_file(segment_output)
+        else:
+            logger.info(f"全部 {len(segment_paths)} 个视频片段命中缓存，无需重新编码")
 
-            # 对于Windows系统，需要修改字幕过滤器路径格式
-            if os.name == 'nt':
-                segment_cmd[-2] = segment_cmd[-2].replace("'", "")
+        # 拼接前校验所有片段的编码参数一致，保证走 -c copy 快速路径
+        await _conform_before_concat(
+            segment_paths, lambda path: conform_segment(path, profile))
 
-            subprocess.run(segment_cmd, check=True, capture_output=True)
-            segment_paths.append(segment_output)
+        # 每页字幕从对应片段的起点开始
+        narration_starts = []
+        current = 0.0
+        for segment_duration in await asyncio.gather(*[probe_duration(p) for p in segment_paths]):
+            narration_starts.append(current)
+            current += segment_duration
 
         # 3. 创建合并文件列表
         concat_file = os.path.join(temp_dir, "concat_list.txt")
@@ -890,66 +1756,430 @@ async def create_paragraph_video(
             for segment in segment_paths:
                 f.write(f"file '{segment}'\n")
 
-        # 4. 合并所有视频片段
+        # 4. 合并所有视频片段（缓存片段直接复制流，不重新编码）
         merge_cmd = [
             'ffmpeg', '-y',
             '-f', 'concat',
             '-safe', '0',
             '-i', concat_file,
             '-c', 'copy',
-            str(output_path)
+            output_path
         ]
         logger.info(f"执行合并命令: {' '.join(merge_cmd)}")
         try:
-            result = subprocess.run(merge_cmd, check=True, capture_output=True)
+            await run_ffmpeg(merge_cmd, on_progress=progress_range(on_progress, 0.9, 1.0),
+                             duration=current)
+            metrics.incr("video.concat.copy")
             logger.info(f"视频成功生成: {output_path}")
 
             # 检查生成的视频文件
             if os.path.exists(output_path):
                 file_size = os.path.getsize(output_path)
                 logger.info(f"生成的视频文件大小: {file_size} 字节")
-
-                # 获取视频元数据
-                try:
-                    probe_cmd = ['ffprobe', '-v', 'error', '-show_format',
-                                 '-show_streams', '-of', 'json', str(output_path)]
-                    probe_result = subprocess.run(
-                        probe_cmd, capture_output=True, text=True)
-                    # print(f"视频文件元数据: {probe_result.stdout}")
-                except Exception as probe_err:
-                    logger.error(f"获取视频元数据失败: {probe_err}")
             else:
                 logger.warning(f"警告: 视频文件不存在: {output_path}")
-
-            return f"/static/videos/{output_filename}"
-        except subprocess.CalledProcessError as e:
+        except ProcessError as e:
             logger.error(f"视频生成失败: {e}")
             logger.error(
-                f"错误输出: {e.stderr.decode() if e.stderr else '无错误输出'}")
+                f"错误输出: {e.stderr or '无错误输出'}")
+            metrics.incr("video.concat.fallback")
 
-            # 尝试使用替代方法 - 使用较为保守的参数
+            # 尝试使用替代方法 - 按规范参数整体重新编码
             try:
                 alt_merge_cmd = [
                     'ffmpeg', '-y',
                     '-f', 'concat',
                     '-safe', '0',
                     '-i', concat_file,
-                    '-c:v', 'libx264',  # 使用固定编码器
-                    '-c:a', 'aac',      # 添加音频编码器
-                    '-preset', 'medium',  # 使用中等压缩率
-                    '-crf', '23',       # 合理的质量
-                    str(output_path)
+                    *canonical_segment_args(profile),
+                    output_path
                 ]
                 logger.info(f"尝试替代命令: {' '.join(alt_merge_cmd)}")
-                subprocess.run(alt_merge_cmd, check=True, capture_output=True)
+                await run_ffmpeg(alt_merge_cmd)
                 logger.info(f"使用替代方法成功生成视频: {output_path}")
-                return f"/static/videos/{output_filename}"
-            except subprocess.CalledProcessError as alt_e:
+            except ProcessError as alt_e:
                 logger.error(f"替代方法也失败: {alt_e}")
                 logger.error(
-                    f"错误输出: {alt_e.stderr.decode() if alt_e.stderr else '无错误输出'}")
+                    f"错误输出: {alt_e.stderr or '无错误输出'}")
                 raise ValueError(f"无法合并视频: {e}")
 
+        return narration_starts
+
+
+def subtitle_timeline_path(video_path: Union[str, Path]) -> Path:
+    """视频对应的字幕时间轴文件，记录每页旁白起始时间，用于只更新字幕时免重新渲染"""
+    return Path(video_path).with_suffix(".subtitles.json")
+
+
+def write_webvtt(srt_path: str, vtt_path: str):
+    """将srt字幕转换为WebVTT格式"""
+    with open(vtt_path, 'w', encoding='utf-8') as f:
+        f.write("WEBVTT\n\n")
+        for text, start_time, end_time in parse_subtitle_file(srt_path):
+            start = _format_srt_time(start_time).replace(',', '.')
+            end = _format_srt_time(end_time).replace(',', '.')
+            f.write(f"{start} --> {end}\n{text}\n\n")
+
+
+async def mux_soft_subtitles(video_path: str, srt_path: str):
+    """将字幕作为 mov_text 轨道封装进MP4（音视频流直接复制，原有字幕轨道会被替换）"""
+    muxed_path = f"{video_path}.mux.mp4"
+    cmd = [
+        'ffmpeg', '-y',
+        '-i', video_path,
+        '-i', srt_path,
+        '-map', '0:v', '-map', '0:a', '-map', '1:0',
+        '-c:v', 'copy', '-c:a', 'copy', '-c:s', 'mov_text',
+        '-movflags', '+faststart',
+        muxed_path
+    ]
+    await run_ffmpeg(cmd)
+    os.replace(muxed_path, video_path)
+
+
+async def apply_subtitle_track(
+    video_path: str,
+    subtitle_paths: List[str],
+    narration_starts: List[float],
+    subtitle_mode: str,
+    work_dir: str
+) -> Optional[str]:
+    """
+    按时间轴合并各页字幕，封装为软字幕轨道或写出WebVTT旁路文件
+
+    Returns:
+        Optional[str]: 旁路字幕模式下返回WebVTT文件的URL路径，否则返回None
+    """
+    subtitle_files = [p.replace("/static/", "static/") for p in subtitle_paths]
+    merged_subtitle = os.path.join(work_dir, "merged.srt")
+    merge_subtitle_files(subtitle_files, narration_starts, merged_subtitle)
+
+    if subtitle_mode == "soft":
+        await mux_soft_subtitles(video_path, merged_subtitle)
+        metrics.incr("video.subtitles.muxed")
+        return None
+
+    vtt_path = Path(video_path).with_suffix(".vtt")
+    write_webvtt(merged_subtitle, str(vtt_path))
+    metrics.incr("video.subtitles.sidecar")
+    return f"/static/videos/{vtt_path.name}"
+
+
+def _static_file_in(url: str, directory: Path, label: str) -> Path:
+    """
+    把 /static/ 开头的URL解析为 directory 目录下已存在的文件
+
+    Raises:
+        ValueError: URL格式不对、经 .. 或符号链接指向目录之外，或文件不存在
+    """
+    if not isinstance(url, str) or not url.startswith("/static/"):
+        raise ValueError(f"{label}路径无效: {url}")
+    path = Path(url.replace("/static/", "static/", 1))
+    try:
+        path.resolve().relative_to(directory.resolve())
+    except ValueError:
+        raise ValueError(f"{label}路径必须位于 /{directory.as_posix()}/ 目录下: {url}")
+    if not path.is_file():
+        raise ValueError(f"{label}不存在: {url}")
+    return path
+
+
+async def remux_subtitles(video_url: str, subtitle_paths: List[str], subtitle_mode: str = "soft") -> Optional[str]:
+    """
+    只更新已生成视频的字幕：重新封装软字幕轨道或重写WebVTT，无需重新渲染画面
+
+    Args:
+        video_url: 视频文件URL路径
+        subtitle_paths: 新的字幕文件路径列表，与生成视频时的页面一一对应
+        subtitle_mode: soft（封装进MP4）或 sidecar（WebVTT旁路文件）
+
+    Returns:
+        Optional[str]: 旁路字幕模式下返回WebVTT文件的URL路径
+
+    Raises:
+        ValueError: 参数无效，视频不在 static/videos 下或字幕不在字幕目录下
+    """
+    if subtitle_mode not in ("soft", "sidecar"):
+        raise ValueError("烧录字幕需要重新渲染视频，只能对软字幕或旁路字幕重新封装")
+
+    # 路径来自请求，只允许改写视频目录中生成的MP4，字幕只能读取字幕目录中的文件
+    video_path = _static_file_in(video_url, Path("static/videos"), "视频")
+    if video_path.suffix != ".mp4":
+        raise ValueError(f"只能重新封装MP4视频: {video_url}")
+    for subtitle_url in subtitle_paths:
+        _static_file_in(subtitle_url, settings.SUBTITLE_DIR, "字幕文件")
+    timeline_path = subtitle_timeline_path(video_path)
+    if not timeline_path.exists():
+        raise ValueError(f"字幕时间轴不存在: {video_url}")
+
+    with open(timeline_path, 'r', encoding='utf-8') as f:
+        timeline = json.load(f)
+    if timeline.get("subtitle_mode") == "burn":
+        raise ValueError("该视频的字幕已烧录到画面中，需要重新渲染")
+
+    narration_starts = timeline["narration_starts"]
+    if len(subtitle_paths) != len(narration_starts):
+        raise ValueError("字幕文件数量应等于视频页数")
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        return await apply_subtitle_track(
+            str(video_path), subtitle_paths, narration_starts, subtitle_mode, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def hls_playlist_path(video_path: Union[str, Path]) -> Path:
+    """视频对应的HLS主播放列表路径（与视频同目录的 <文件名>_hls 子目录）"""
+    video_path = Path(video_path)
+    return video_path.with_name(f"{video_path.stem}_hls") / "master.m3u8"
+
+
+def _build_hls_cmd(video_path: str, rendition: Dict[str, Any], output_dir: Path, threads: int = None) -> List[str]:
+    """构建单个码率档位的HLS切片命令"""
+    segment_seconds = settings.HLS_SEGMENT_SECONDS
+    cmd = ['ffmpeg', '-y', '-i', video_path, '-map', '0:v:0', '-map', '0:a:0']
+    if rendition.get("copy"):
+        # 直接复制流，切片边界落在成片的关键帧上
+        cmd.extend(['-c', 'copy'])
+    else:
+        video_bitrate = rendition["video_bitrate"]
+        cmd.extend([
+            '-vf', canonical_frame_filter(rendition),
+            '-c:v', settings.VIDEO_CODEC,
+            '-preset', 'veryfast',
+            '-tune', 'stillimage',
+            '-b:v', video_bitrate,
+            '-maxrate', video_bitrate,
+            '-bufsize', video_bitrate,
+            '-pix_fmt', settings.VIDEO_PIX_FMT,
+            # 按切片时长强制关键帧，保证各档位切片对齐、时长固定
+            '-force_key_frames', f"expr:gte(t,n_forced*{segment_seconds})",
+            '-sc_threshold', '0',
+            '-c:a', settings.VIDEO_AUDIO_CODEC,
+            '-b:a', rendition["audio_bitrate"],
+            '-ar', str(settings.AUDIO_SAMPLE_RATE),
+        ])
+        if threads:
+            cmd.extend(['-threads', str(threads)])
+    cmd.extend([
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', str(output_dir / "segment_%04d.ts"),
+        str(output_dir / "index.m3u8")
+    ])
+    return cmd
+
+
+def _hls_bandwidth(playlist_path: Path) -> Tuple[int, int]:
+    """根据切片大小和时长计算档位的峰值码率和平均码率(bit/s)"""
+    peak, total_bytes, total_duration = 0, 0, 0.0
+    segment_duration = None
+    with open(playlist_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                segment_duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif line and not line.startswith("#") and segment_duration:
+                size = (playlist_path.parent / line).stat().st_size
+                peak = max(peak, int(size * 8 / segment_duration))
+                total_bytes += size
+                total_duration += segment_duration
+                segment_duration = None
+    average = int(total_bytes * 8 / total_duration) if total_duration else 0
+    return peak, average
+
+
+async def package_hls(
+    video_path: str,
+    renditions: List[str] = None,
+    on_progress: ProgressCallback = None,
+    cpu_budget: int = None
+) -> str:
+    """
+    将成片MP4切分为HLS分片，按码率档位生成子播放列表和主播放列表
+
+    Args:
+        video_path: 成片MP4文件路径
+        renditions: 码率档位名称列表，默认使用配置值
+        on_progress: 进度回调，参数为 0~1 的完成比例
+        cpu_budget: 分配到的CPU令牌数，由各档位的编码线程平分
+
+    Returns:
+        str: 主播放列表的URL路径
+    """
+    names = renditions or [n.strip() for n in settings.VIDEO_HLS_RENDITIONS.split(",") if n.strip()]
+    unknown = [n for n in names if n not in HLS_RENDITIONS]
+    if not names or unknown:
+        raise ValueError(f"不支持的HLS码率档位: {unknown or names}")
+
+    master_path = hls_playlist_path(video_path)
+    hls_dir = master_path.parent
+    # 重新生成时清理旧的分片
+    shutil.rmtree(hls_dir, ignore_errors=True)
+
+    duration = await probe_duration(video_path)
+    source_video = [s for s in await probe_media_streams(video_path)
+                    if s.get("codec_type") == "video"][0]
+
+    progress = [0.0] * len(names)
+
+    def reporter(index):
+        if on_progress is None:
+            return None
+
+        def report(fraction):
+            progress[index] = fraction
+            on_progress(sum(progress) / len(progress))
+        return report
+
+    threads = max(1, (cpu_budget or available_cpus()) // len(names))
+    cmds = []
+    for name in names:
+        os.makedirs(hls_dir / name, exist_ok=True)
+        cmds.append(_build_hls_cmd(video_path, HLS_RENDITIONS[name], hls_dir / name, threads))
+    await gather_or_cancel(*[
+        run_ffmpeg(cmd, on_progress=reporter(i), duration=duration) for i, cmd in enumerate(cmds)
+    ])
+
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for name in names:
+        rendition = HLS_RENDITIONS[name]
+        width = rendition.get("width", source_video["width"])
+        height = rendition.get("height", source_video["height"])
+        peak, average = _hls_bandwidth(hls_dir / name / "index.m3u8")
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={peak},AVERAGE-BANDWIDTH={average},RESOLUTION={width}x{height}")
+        lines.append(f"{name}/index.m3u8")
+    with open(master_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+    metrics.incr("video.hls.packaged")
+    logger.info(f"HLS播放列表已生成: {master_path} ({', '.join(names)})")
+    return f"/static/videos/{hls_dir.name}/{master_path.name}"
+
+
+# 为段落生成完整视频
+async def create_paragraph_video(
+    image_paths: List[str],
+    audio_paths: List[str],
+    subtitle_paths: List[str],
+    output_filename: str = None,
+    transition_duration: float = 1.0,
+    fade_duration: float = 0.5,
+    render_engine: str = None,
+    profile: str = "final",
+    subtitle_mode: str = None,
+    output_format: str = None,
+    hls_renditions: List[str] = None,
+    priority: int = None,
+    on_progress: ProgressCallback = None
+) -> str:
+    """
+    根据图片、音频和字幕文件合成视频
+
+    Args:
+        image_paths: 图片文件路径列表，第一张作为封面
+        audio_paths: 音频文件路径列表，每段音频对应一张图片
+        subtitle_paths: 字幕文件路径列表，每个字幕对应一段音频
+        output_filename: 输出视频文件名，默认为根据时间戳生成
+        transition_duration: 图片过渡持续时间(秒)，仅 filtergraph 引擎使用
+        fade_duration: 淡入淡出持续时间(秒)
+        render_engine: 渲染引擎，segments（逐页编码后拼接）或 filtergraph（单条滤镜图一次编码，
+                       页面间交叉淡化），默认使用配置值
+        profile: 渲染档位，preview（低分辨率低帧率的快速预览）或 final（最终成片）
+        subtitle_mode: 字幕模式，burn（烧录到画面）、soft（mov_text软字幕轨道）
+                       或 sidecar（WebVTT旁路文件），默认使用配置值
+        output_format: 输出格式，mp4 或 hls（在MP4成片之外生成HLS分片，主播放列表路径见
+                       hls_playlist_path），默认使用配置值
+        hls_renditions: HLS码率档位名称列表，默认使用配置值
+        priority: 渲染调度优先级，数值越小越先调度，默认使用渲染档位的优先级
+        on_progress: 进度回调，参数为 0~1 的完成比例
+
+    Returns:
+        str: 生成的视频文件URL路径
+    """
+    if len(image_paths) < 2:
+        raise ValueError("至少需要两张图片（一张封面和一张内容图片）")
+
+    if len(audio_paths) != len(image_paths):
+        raise ValueError("音频文件数量应等于图片数量")
+
+    if len(subtitle_paths) != len(audio_paths):
+        raise ValueError("字幕文件数量应等于音频文件数量")
+
+    render_engine = render_engine or settings.VIDEO_RENDER_ENGINE
+    if render_engine not in VIDEO_RENDER_ENGINES:
+        raise ValueError(f"不支持的渲染引擎: {render_engine}")
+    render_profile = get_render_profile(profile)
+    subtitle_mode = subtitle_mode or settings.VIDEO_SUBTITLE_MODE
+    if subtitle_mode not in SUBTITLE_MODES:
+        raise ValueError(f"不支持的字幕模式: {subtitle_mode}")
+    output_format = output_format or settings.VIDEO_OUTPUT_FORMAT
+    if output_format not in VIDEO_OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    # 输出HLS时为切片预留一部分进度
+    render_share = 0.85 if output_format == "hls" else 0.98
+
+    # 创建输出文件名
+    timestamp = int(time.time())
+    if not output_filename or output_filename == "string" or not output_filename.strip():
+        output_filename = f"video_{timestamp}.mp4"
+    else:
+        # 确保文件名有效并以.mp4结尾
+        output_filename = output_filename.strip()
+        if not output_filename.endswith('.mp4'):
+            output_filename = f"{output_filename}.mp4"
+
+    # 确保输出目录存在
+    output_dir = Path("static/videos")
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = output_dir / output_filename
+
+    # 打印输出文件路径用于调试
+    logger.info(
+        f"视频将输出到: {output_path} (绝对路径: {os.path.abspath(output_path)})")
+
+    # 创建临时目录
+    temp_dir = tempfile.mkdtemp()
+    logger.info(f"使用临时目录: {temp_dir}")
+
+    try:
+        burn_subtitles = subtitle_mode == "burn"
+        if priority is None:
+            priority = render_profile.get("priority", 0)
+        # 在全局CPU令牌预算内渲染，并发请求过多时排队等待
+        async with get_render_scheduler().slot(priority=priority) as cpu_budget:
+            if render_engine == "filtergraph":
+                narration_starts = await _render_with_filtergraph(
+                    image_paths, audio_paths, subtitle_paths, str(output_path),
+                    temp_dir, fade_duration, transition_duration, render_profile, burn_subtitles,
+                    on_progress=progress_range(on_progress, 0.0, render_share), cpu_budget=cpu_budget)
+            else:
+                narration_starts = await _render_with_segments(
+                    image_paths, audio_paths, subtitle_paths, str(output_path),
+                    temp_dir, fade_duration, render_profile, burn_subtitles,
+                    on_progress=progress_range(on_progress, 0.0, render_share), cpu_budget=cpu_budget)
+
+            # 记录字幕时间轴，之后只改字幕时可直接重新封装
+            with open(subtitle_timeline_path(output_path), 'w', encoding='utf-8') as f:
+                json.dump({"subtitle_mode": subtitle_mode,
+                          "narration_starts": narration_starts}, f)
+
+            if not burn_subtitles:
+                await apply_subtitle_track(
+                    str(output_path), subtitle_paths, narration_starts, subtitle_mode, temp_dir)
+
+            if output_format == "hls":
+                await package_hls(str(output_path), hls_renditions,
+                                  on_progress=progress_range(on_progress, render_share, 0.99),
+                                  cpu_budget=cpu_budget)
+
+        if on_progress:
+            on_progress(1.0)
+        return f"/static/videos/{output_filename}"
+
     except Exception as e:
         logger.error(f"视频生成失败: {e}")
         import traceback
@@ -957,6 +2187,12 @@ async def create_paragraph_video(
         raise e
 
     finally:
+        # 控制片段缓存占用的磁盘空间
+        try:
+            prune_segment_cache()
+        except Exception as e:
+            logger.error(f"清理片段缓存时出错: {e}")
+
         # 在生产环境中，应该清理临时文件
         try:
             # 检查临时目录内容用于调试
@@ -0,0 +1,120 @@
+"""
+相同请求合并（single-flight）
+
+重复点击或前端重试会同时发出两个完全相同的生成请求，导致重复调用付费API。
+按请求体的规范哈希（或客户端提供的 Idempotency-Key）合并：相同的请求在执行中时共享同一个结果，
+完成后的结果在短时间内直接重放，不再重新生成。
+所有等待者都离开（如客户端断开）时取消执行中的工作，不再为无人等待的结果占用生成容量。
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .config import settings
+from . import metrics
+
+
+class IdempotencyConflict(Exception):
+    """同一个 Idempotency-Key 对应了不同的请求体"""
+
+
+def request_fingerprint(body: Any) -> str:
+    """请求体的规范哈希：键排序、紧凑分隔符，字段顺序和空白不影响结果"""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    按请求合并执行，只能在同一个事件循环中使用
+
+    实际工作在独立的任务中执行，发起请求的客户端断开连接时不会中断其他等待者共享的结果
+    """
+
+    def __init__(self, name: str, ttl: float = None):
+        self.name = name
+        self.ttl = settings.SINGLE_FLIGHT_REPLAY_TTL if ttl is None else ttl
+        # 键 -> (请求体哈希, 执行中的任务)
+        self._inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+        # 键 -> (请求体哈希, 过期时间, 结果)
+        self._completed: Dict[str, Tuple[str, float, Any]] = {}
+        # 键 -> 等待结果的请求数
+        self._waiters: Dict[str, int] = {}
+
+    def _prune(self, now: float):
+        for key in [k for k, (_, expires, _) in self._completed.items() if expires <= now]:
+            del self._completed[key]
+
+    def _finish(self, key: str, fingerprint: str, task: asyncio.Task):
+        if key in self._inflight and self._inflight[key][1] is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is None and self.ttl > 0:
+            self._completed[key] = (fingerprint, time.monotonic() + self.ttl, task.result())
+
+    async def run(
+        self,
+        body: Any,
+        fn: Callable[[], Awaitable[Any]],
+        idempotency_key: Optional[str] = None
+    ) -> Any:
+        """
+        执行或合并一次请求
+
+        Args:
+            body: 请求体（可JSON序列化），用于计算规范哈希
+            fn: 实际执行请求的协程函数
+            idempotency_key: 客户端提供的幂等键，提供时按幂等键而不是请求体合并
+
+        Returns:
+            Any: 请求结果（合并或重放时与首个请求的结果相同）
+
+        Raises:
+            IdempotencyConflict: 幂等键已用于不同的请求体
+        """
+        fingerprint = request_fingerprint(body)
+        key = f"idempotency:{idempotency_key}" if idempotency_key else fingerprint
+        now = time.monotonic()
+        self._prune(now)
+
+        completed = self._completed.get(key)
+        if completed:
+            self._check_fingerprint(completed[0], fingerprint)
+            metrics.incr(f"single_flight.{self.name}.replayed")
+            return completed[2]
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            self._check_fingerprint(inflight[0], fingerprint)
+            metrics.incr(f"single_flight.{self.name}.coalesced")
+            return await self._wait(key, inflight[1])
+
+        metrics.incr(f"single_flight.{self.name}.executed")
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = (fingerprint, task)
+        task.add_done_callback(lambda t: self._finish(key, fingerprint, t))
+        return await self._wait(key, task)
+
+    async def _wait(self, key: str, task: asyncio.Task) -> Any:
+        """等待共享的执行任务，单个等待者被取消不影响其他等待者，最后一个等待者离开时取消执行"""
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                if not task.done():
+                    metrics.incr(f"single_flight.{self.name}.abandoned")
+                    # 立即移出执行中列表，之后的相同请求重新执行而不是等待已取消的任务
+                    if self._inflight.get(key, (None, None))[1] is task:
+                        del self._inflight[key]
+                    task.cancel()
+
+    def _check_fingerprint(self, expected: str, actual: str):
+        if expected != actual:
+            metrics.incr(f"single_flight.{self.name}.conflicts")
+            raise IdempotencyConflict("Idempotency-Key 已用于不同的请求内容")
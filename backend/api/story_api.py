@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any, Optional
 import json
 import os
 from pathlib import Path
 
-from .database import get_db
-from . import db_models, db_service, models
+from .database import get_db, get_async_db
+from . import db_models, db_service, async_db_service, models, job_queue
 from .config import settings
+from .priority import BATCH
+from .services import peaks_path_for, write_waveform_peaks
+from utils.logger import logger
 
 story_db_router = APIRouter(tags=["故事数据库API"])
 
@@ -22,11 +27,26 @@ def get_all_stories(
     stories = db_service.get_stories(db, skip=skip, limit=limit)
     return [db_service.story_to_response(story) for story in stories]
 
+# 获取故事列表摘要
+@story_db_router.get("/summaries", response_model=List[Dict[str, Any]])
+def get_story_summaries(
+    skip: int = Query(0, description="跳过的记录数"),
+    limit: int = Query(100, description="返回的最大记录数"),
+    db: Session = Depends(get_db)
+):
+    """
+    获取故事列表摘要
+
+    只返回标题、主题、类型、封面图片、页数、是否已生成视频和创建/更新时间，不包含段落、图片、语音和视频详情；
+    列表页使用该接口，详情通过 GET /stories/{story_id} 获取
+    """
+    return db_service.get_story_summaries(db, skip=skip, limit=limit)
+
 # 获取单个故事
 @story_db_router.get("/{story_id}", response_model=Dict[str, Any])
 def get_story(story_id: str, db: Session = Depends(get_db)):
     """获取单个故事详情"""
-    story = db_service.get_story(db, story_id)
+    story = db_service.get_story(db, story_id, with_details=True)
     if not story:
         raise HTTPException(status_code=404, detail="故事不存在")
     return db_service.story_to_response(story)
@@ -243,4 +263,52 @@ def add_video(
         "message": "视频添加成功",
         "video_id": db_video.id,
         "file_path": db_video.file_path
-    } 
\ No newline at end of file
+    }
+
+# 获取语音波形峰值
+@story_db_router.get("/{story_id}/speeches/{paragraph_id}/peaks")
+async def get_speech_peaks(story_id: str, paragraph_id: str, db: AsyncSession = Depends(get_async_db)):
+    """获取段落语音的波形峰值，播放器可在音频加载前绘制波形和进度"""
+    speech = await async_db_service.get_speech(db, story_id, paragraph_id)
+    if not speech:
+        raise HTTPException(status_code=404, detail="语音不存在")
+
+    # 峰值旁路文件与语音文件同目录；缺失时（如上传的语音）现场计算一次
+    peaks_path = peaks_path_for(speech.file_path)
+    if not peaks_path.exists():
+        try:
+            await write_waveform_peaks(speech.file_path)
+        except Exception as e:
+            logger.error(f"计算波形峰值失败: {e}")
+            raise HTTPException(status_code=500, detail="计算波形峰值失败")
+
+    return FileResponse(
+        path=peaks_path,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=86400"}
+    )
+
+# 一键生成绘本
+@story_db_router.post("/{story_id}/build", response_model=Dict[str, Any])
+def build_story(
+    story_id: str,
+    request: models.StoryBuildRequest,
+    lane: str = Query(BATCH, description="优先级通道：batch（默认）或 interactive"),
+    deadline_seconds: Optional[float] = Query(None, description="时间预算(秒)，超过后返回已完成页面的部分结果，默认使用配置值"),
+    db: Session = Depends(get_db)
+):
+    """
+    以持久化后台任务方式生成整本绘本
+
+    按页面并行生成故事文本、图片描述、配图、语音和视频片段，最后合成视频；
+    任务保存在数据库中，服务重启或失败重试时从已完成的页面继续。
+    立即返回任务ID，通过 GET /jobs/{job_id} 轮询或 GET /jobs/{job_id}/events 订阅进度
+    """
+    if not db_service.get_story(db, story_id):
+        raise HTTPException(status_code=404, detail="故事不存在")
+
+    job = job_queue.enqueue_job(db, "story_build", {
+        "story_id": story_id,
+        "request": request.dict(),
+    }, lane=lane, deadline_seconds=deadline_seconds)
+    return {"status": job.status, "job_id": job.id}
@@ -0,0 +1,255 @@
+"""
+批量生成绘本
+
+一次提交一个JSONL文件（每行一个 StoryRequest），每本书作为一个持久化任务进入批量通道，
+由任务工作进程按 BATCH_CONCURRENCY 和 BATCH_ITEMS_PER_MINUTE 限制并发和速率执行；
+外部API调用另受密钥池和准入闸门的全局限制。每本书完成后以NDJSON逐行返回结果。
+
+批量任务以批次ID标识：使用同一批次ID重新提交时跳过已入队或已完成的条目，只重新执行失败或取消的条目，
+新的JSONL行数更少时删除多出的旧条目；中断的结果流可以通过批次ID重新订阅。
+
+命令行用法：
+
+    python -m api.story_batch stories.jsonl [--batch-id ID] [--build] [--worker]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import async_db_service, db_models, job_queue, metrics, models
+from .config import settings, per_process
+from .database import AsyncSessionLocal, SessionLocal
+from .deadline import deadline_scope
+from .jobs import JOB_PENDING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED, FINISHED_STATES
+from .job_queue import JobContext, register_job_handler
+from .priority import BATCH
+from .story_build import build_story, ensure_story_text
+from utils.logger import logger
+
+BATCH_ITEM_KIND = "story_batch_item"
+
+
+class BatchConflict(Exception):
+    """同一批次ID下相同序号的条目内容与之前提交的不一致"""
+
+
+def parse_jsonl(text: str) -> List[models.StoryRequest]:
+    """
+    解析JSONL，跳过空行
+
+    Raises:
+        ValueError: 某一行不是合法的 StoryRequest，错误信息包含行号
+    """
+    requests = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            requests.append(models.StoryRequest(**json.loads(line)))
+        except (json.JSONDecodeError, TypeError, ValidationError) as e:
+            raise ValueError(f"第 {line_no} 行无效: {e}")
+    if not requests:
+        raise ValueError("没有可生成的条目")
+    if len(requests) > settings.BATCH_MAX_ITEMS:
+        raise ValueError(f"单个批次最多 {settings.BATCH_MAX_ITEMS} 个条目")
+    return requests
+
+
+def _batch_jobs(db: Session, batch_id: str) -> List[db_models.BackgroundJob]:
+    job = db_models.BackgroundJob
+    return db.query(job).filter(job.batch_id == batch_id).order_by(job.batch_index).all()
+
+
+def submit_batch(
+    db: Session,
+    requests: List[models.StoryRequest],
+    batch_id: str = None,
+    build: bool = False
+) -> Dict[str, Any]:
+    """
+    提交或续跑批量任务
+
+    Args:
+        requests: 各条目的故事参数，按顺序编号
+        batch_id: 批次ID，已存在时续跑该批次
+        build: 是否在生成正文后继续生成配图、语音和视频
+
+    Returns:
+        Dict[str, Any]: 批次ID和本次新入队、重新入队、跳过、删除的条目数
+
+    Raises:
+        BatchConflict: 同一序号的条目内容与之前提交的不一致
+    """
+    batch_id = batch_id or uuid.uuid4().hex
+    existing = {job.batch_index: job for job in _batch_jobs(db, batch_id)}
+    enqueued = requeued = skipped = 0
+    for index, request in enumerate(requests):
+        payload = {"request": json.loads(request.json()), "build": build}
+        job = existing.get(index)
+        if job is None:
+            # 条目可能排队很久，时间预算从开始执行时计算（见 run_story_batch_item）
+            job_queue.enqueue_job(db, BATCH_ITEM_KIND, payload, lane=BATCH, deadline_seconds=0,
+                                  batch_id=batch_id, batch_index=index, commit=False)
+            enqueued += 1
+        elif job.payload != payload:
+            db.rollback()
+            raise BatchConflict(f"批次 {batch_id} 的第 {index + 1} 个条目与之前提交的内容不一致")
+        elif job.status in (JOB_FAILED, JOB_CANCELLED):
+            # 失败或取消的条目重新执行，已保存的检查点（如已创建的故事）继续复用
+            job.status = JOB_PENDING
+            job.attempts = 0
+            job.error = None
+            job.available_at = time.time()
+            requeued += 1
+        else:
+            skipped += 1
+    # 重新提交的行数更少时，多出的旧条目不再属于该批次：连同检查点一起删除，不再出现在结果中
+    # （执行中的条目在下一次续约失败时停止）
+    removed = [job for index, job in existing.items() if index >= len(requests)]
+    for job in removed:
+        db.delete(job)
+    db.commit()
+    metrics.incr("batch.items_enqueued", enqueued + requeued)
+    logger.info(f"批量任务 {batch_id}: 新入队 {enqueued}，重新入队 {requeued}，跳过 {skipped}，删除 {len(removed)}")
+    return {
+        "batch_id": batch_id,
+        "total": len(requests),
+        "enqueued": enqueued,
+        "requeued": requeued,
+        "skipped": skipped,
+        "removed": len(removed),
+    }
+
+
+def item_to_dict(job: db_models.BackgroundJob) -> Dict[str, Any]:
+    """单个条目的NDJSON结果行"""
+    result = job.result or {}
+    return {
+        "batch_id": job.batch_id,
+        "index": job.batch_index,
+        "job_id": job.id,
+        "status": job.status,
+        "story_id": result.get("story_id"),
+        "result": job.result,
+        "error": job.error,
+    }
+
+
+def batch_summary(db: Session, batch_id: str) -> Optional[Dict[str, Any]]:
+    """批次各状态的条目数，批次不存在时返回None"""
+    jobs = _batch_jobs(db, batch_id)
+    if not jobs:
+        return None
+    counts: Dict[str, int] = {}
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    return {
+        "batch_id": batch_id,
+        "total": len(jobs),
+        "finished": sum(counts.get(status, 0) for status in FINISHED_STATES),
+        "counts": counts,
+    }
+
+
+def _poll_batch(db: Session, batch_id: str, emitted: Set[int]) -> Tuple[List[Dict[str, Any]], int]:
+    """返回尚未输出的已结束条目和未结束的条目数"""
+    jobs = _batch_jobs(db, batch_id)
+    finished = [item_to_dict(job) for job in jobs
+                if job.status in FINISHED_STATES and job.batch_index not in emitted]
+    return finished, sum(1 for job in jobs if job.status not in FINISHED_STATES)
+
+
+async def watch_batch(batch_id: str, interval: float = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    按完成顺序返回批次中每个条目的最终结果（已完成的条目先返回），所有条目结束后停止
+
+    条目可能由其他进程执行，按固定间隔在工作线程中轮询数据库
+    """
+    interval = interval or settings.JOB_POLL_INTERVAL
+    emitted: Set[int] = set()
+    while True:
+        finished, pending = await job_queue.in_session(_poll_batch, batch_id, set(emitted))
+        for item in finished:
+            emitted.add(item["index"])
+            yield item
+        if not pending:
+            return
+        await asyncio.sleep(interval)
+
+
+# 开始速率在领取前检查（多工作进程部署时各进程均分），超出速率的条目留在队列中，不占用执行名额和租约
+@register_job_handler(BATCH_ITEM_KIND, concurrency=settings.BATCH_CONCURRENCY,
+                      starts_per_minute=per_process(settings.BATCH_ITEMS_PER_MINUTE))
+async def run_story_batch_item(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """持久化任务处理函数：payload 包含 StoryRequest 参数 request 和是否完整生成 build"""
+    request = models.StoryRequest(**payload["request"])
+    with deadline_scope(settings.JOB_DEADLINE_SECONDS):
+        # 故事记录创建后保存为检查点，重新执行时不会重复创建
+        story_id = context.checkpoints.get("story_id")
+        async with AsyncSessionLocal() as db:
+            story = await async_db_service.get_story(db, story_id) if story_id else None
+            if story is None:
+                story = await async_db_service.create_story(db, request)
+        if story.id != story_id:
+            await context.save_checkpoint("story_id", story.id)
+
+        if not payload.get("build"):
+            paragraphs = await ensure_story_text(story.id, request.pages)
+            return {"story_id": story.id, "paragraphs": len(paragraphs)}
+
+        build_request = models.StoryBuildRequest(title=story.theme)
+        result = await build_story(story, build_request, context.on_progress,
+                                   context.checkpoints, context.save_checkpoint)
+        return {"story_id": story.id, **result}
+
+
+async def _run_cli(args) -> int:
+    with open(args.file, encoding="utf-8") as f:
+        requests = parse_jsonl(f.read())
+
+    db = SessionLocal()
+    try:
+        summary = submit_batch(db, requests, args.batch_id, args.build)
+    finally:
+        db.close()
+    print(json.dumps(summary, ensure_ascii=False), flush=True)
+
+    worker = None
+    if args.worker:
+        from .job_worker import JobWorker
+        worker = JobWorker()
+        worker.start()
+    failed = 0
+    try:
+        async for item in watch_batch(summary["batch_id"]):
+            failed += item["status"] != JOB_SUCCEEDED
+            print(json.dumps(item, ensure_ascii=False), flush=True)
+    finally:
+        if worker:
+            await worker.stop()
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成绘本，逐行输出每本书的结果(NDJSON)")
+    parser.add_argument("file", help="JSONL文件，每行一个 StoryRequest")
+    parser.add_argument("--batch-id", default=None, help="续跑已有批次时指定批次ID")
+    parser.add_argument("--build", action="store_true", help="生成正文后继续生成配图、语音和视频")
+    parser.add_argument("--worker", action="store_true",
+                        help="在当前进程中运行任务工作协程（API进程或独立工作进程未运行时使用）")
+    args = parser.parse_args()
+
+    from .db_init import init_db
+    init_db()
+    sys.exit(asyncio.run(_run_cli(args)))
+
+
+if __name__ == "__main__":
+    main()
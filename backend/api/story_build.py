@@ -0,0 +1,309 @@
+"""
+一键生成绘本
+
+按页面拆分的任务图：故事文本 → 图片描述 → 每页配图；故事文本 → 每页语音；
+某一页的配图和语音都就绪后立即预编码该页的视频片段，最后拼接成整本视频。
+每个阶段的产物都通过 async_db_service 保存，重复执行时跳过已有产物，只补齐缺失的部分；
+并行执行的节点各自使用短期的异步数据库会话，不共享会话，写库也不阻塞事件循环上的其他页面和请求。
+作为持久化任务执行时，封面语音等不入库的产物和成片保存为任务检查点。
+"""
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import async_db_service, db_models, models
+from .audio_storage import resolve_audio_file
+from .config import settings, RENDER_PROFILES
+from .database import AsyncSessionLocal
+from .jobs import ProgressCallback
+from .job_queue import JobContext, register_job_handler
+from .pipeline import TaskGraph
+from .services import (
+    generate_story, generate_image_descriptions, generate_images, generate_page_audio,
+    encode_page_segment, create_paragraph_video, hls_playlist_path, probe_duration
+)
+from utils.logger import logger
+
+T = TypeVar("T")
+
+
+async def _with_session(operation: Callable[..., Awaitable[T]], *args) -> T:
+    """在新的异步数据库会话中执行一次 async_db_service 操作"""
+    async with AsyncSessionLocal() as db:
+        return await operation(db, *args)
+
+
+def _static_file_exists(url: Optional[str]) -> bool:
+    return bool(url) and os.path.exists(url.replace("/static/", "static/"))
+
+
+def _subtitle_url_for(audio_url: str) -> str:
+    """段落音频对应的字幕URL（两者以同一个段落标识命名）"""
+    return f"/static/subtitles/{Path(audio_url).stem}.srt"
+
+
+async def _existing_audio(db: AsyncSession, story_id: str, paragraph_id: str) -> Optional[Dict[str, Any]]:
+    """段落已有可用的语音和字幕时返回，否则返回None"""
+    speech = await async_db_service.get_speech(db, story_id, paragraph_id)
+    if not speech or not resolve_audio_file(speech.file_path).exists():
+        return None
+    subtitle_url = _subtitle_url_for(speech.file_path)
+    if not _static_file_exists(subtitle_url):
+        return None
+    return {"audio_path": speech.file_path, "subtitle_path": subtitle_url}
+
+
+async def _existing_image(db: AsyncSession, story_id: str, description_id: str) -> Optional[str]:
+    """按图片描述查找最近一张文件仍存在的图片"""
+    images = [
+        image for image in await async_db_service.get_images(db, story_id)
+        if image.image_description_id == description_id and _static_file_exists(image.file_path)
+    ]
+    if not images:
+        return None
+    return max(images, key=lambda image: image.created_at).file_path
+
+
+async def ensure_story_text(story_id: str, pages: int) -> List[db_models.Paragraph]:
+    """返回故事的段落，尚未生成时按故事设定生成正文和人物并保存（使用独立的数据库会话）"""
+    async with AsyncSessionLocal() as db:
+        story = await async_db_service.get_story(db, story_id)
+        paragraphs = await async_db_service.get_paragraphs(db, story_id)
+    if paragraphs:
+        return paragraphs
+    texts, characters = await generate_story(
+        theme=story.theme,
+        story_type=story.story_type,
+        age_range=story.age_range,
+        language=story.language,
+        word_count=story.word_count,
+        pages=pages
+    )
+    async with AsyncSessionLocal() as db:
+        paragraphs = await async_db_service.create_paragraphs(db, story_id, texts)
+        await async_db_service.create_characters(db, story_id, [
+            models.CharacterDescription(
+                name=char.name,
+                role=char.role,
+                appearance=char.appearance,
+                traits=char.traits,
+                age=char.age
+            ) for char in characters
+        ])
+    return paragraphs
+
+
+async def build_story(
+    story: db_models.Story,
+    request: models.StoryBuildRequest,
+    on_progress: ProgressCallback = None,
+    checkpoints: Dict[str, Any] = None,
+    on_checkpoint: Callable[[str, Any], Awaitable[None]] = None
+) -> Dict[str, Any]:
+    """
+    生成绘本的全部内容并合成视频
+
+    Args:
+        story: 故事记录（只在开始时读取字段，各节点使用自己的数据库会话）
+        request: 生成参数
+        on_progress: 进度回调，参数为 0~1 的完成比例
+        checkpoints: 上次执行保存的检查点，命中的步骤直接复用
+        on_checkpoint: 步骤完成后保存检查点的协程回调
+
+    Returns:
+        Dict[str, Any]: 视频、图片、语音和字幕路径；超过截止时间时 partial 为True，
+            只包含已完成页面的图片和语音，video_path 为None
+    """
+    story_id = story.id
+    theme, pages = story.theme, story.pages
+    title = request.title or theme
+    # 已有段落时以段落数为准，否则按故事设定的页数生成；加上封面共 page_count 页
+    page_count = (len(await _with_session(async_db_service.get_paragraphs, story_id)) or pages) + 1
+    render_engine = request.render_engine or settings.VIDEO_RENDER_ENGINE
+    # 同一次构建生成的文件使用相同的前缀，便于识别
+    build_tag = f"{story_id[:8]}_{int(time.time())}"
+
+    graph = TaskGraph({
+        "image": settings.BUILD_IMAGE_CONCURRENCY,
+        "tts": settings.BUILD_TTS_CONCURRENCY,
+        "segment": settings.BUILD_SEGMENT_CONCURRENCY,
+    }, retries=settings.JOB_STEP_RETRIES)
+
+    async def story_text() -> List[db_models.Paragraph]:
+        return await ensure_story_text(story_id, page_count - 1)
+
+    async def descriptions(paragraphs: List[db_models.Paragraph]) -> List[db_models.ImageDescription]:
+        """按页面顺序返回图片描述记录，第一个为封面"""
+        async with AsyncSessionLocal() as db:
+            existing = await async_db_service.get_image_descriptions(db, story_id)
+            stored_characters = await async_db_service.get_characters(db, story_id)
+        cover = next((desc for desc in existing if desc.is_cover), None)
+        by_paragraph = {desc.paragraph_id: desc for desc in existing if not desc.is_cover}
+        if cover and all(p.id in by_paragraph for p in paragraphs):
+            return [cover] + [by_paragraph[p.id] for p in paragraphs]
+
+        characters = [
+            models.CharacterDescription(
+                name=char.name,
+                role=char.role,
+                appearance=char.appearance,
+                traits=char.traits,
+                age=char.age
+            ) for char in stored_characters
+        ]
+        cover_description, texts = await generate_image_descriptions(
+            theme=theme,
+            paragraphs=[p.content for p in paragraphs],
+            style=request.style.value,
+            age_range=request.age_range.value,
+            characters=characters
+        )
+        # 上次执行只保存了部分描述时只补齐缺失的页面，已有描述对应的图片继续有效
+        return await _with_session(
+            async_db_service.add_missing_image_descriptions,
+            story_id, texts, cover_description, request.style.value, paragraphs)
+
+    def page_image(page: int):
+        async def run(paragraphs: List[db_models.Paragraph], descs: List[db_models.ImageDescription]) -> str:
+            desc = descs[page]
+            existing = await _with_session(_existing_image, story_id, desc.id)
+            if existing:
+                return existing
+            image_paths = await generate_images(
+                title=title,
+                descriptions=[d.description for d in descs],
+                aspect_ratio=request.aspect_ratio,
+                image_model=request.image_model,
+                seed=request.seed,
+                index=page + 1
+            )
+            if not image_paths or not image_paths[0]:
+                raise RuntimeError(f"第 {page} 页图片生成失败")
+            await _with_session(
+                async_db_service.create_image,
+                story_id,
+                desc.id,
+                image_paths[0],
+                page == 0,
+                request.aspect_ratio,
+                request.image_model,
+                request.seed,
+                None if page == 0 else paragraphs[page - 1].id
+            )
+            return image_paths[0]
+        return run
+
+    def page_audio(page: int):
+        async def run(paragraphs: List[db_models.Paragraph]) -> Dict[str, Any]:
+            if page == 0:
+                # 封面朗读标题，语音记录必须关联段落，封面语音只保留在本次结果中
+                return await generate_page_audio(title, f"{build_tag}_cover", request.emotion)
+            paragraph = paragraphs[page - 1]
+            existing = await _with_session(_existing_audio, story_id, paragraph.id)
+            if existing:
+                return existing
+            result = await generate_page_audio(
+                paragraph.content, f"{build_tag}_page_{page}", request.emotion)
+            await _with_session(
+                async_db_service.create_speech,
+                story_id, paragraph.id, result["audio_path"], request.emotion, result["duration"])
+            return result
+        return run
+
+    def page_segment(page: int):
+        async def run(image_path: str, audio: Dict[str, Any]) -> str:
+            return await encode_page_segment(
+                image_path, audio["audio_path"], audio["subtitle_path"], page,
+                profile=request.profile, subtitle_mode=request.subtitle_mode)
+        return run
+
+    async def video(*page_results) -> Dict[str, Any]:
+        # 依赖结果依次为各页图片、各页语音（和各页预编码片段）
+        image_paths = list(page_results[:page_count])
+        audios = page_results[page_count:2 * page_count]
+        audio_paths = [audio["audio_path"] for audio in audios]
+        subtitle_paths = [audio["subtitle_path"] for audio in audios]
+        video_path = await create_paragraph_video(
+            image_paths=image_paths,
+            audio_paths=audio_paths,
+            subtitle_paths=subtitle_paths,
+            output_filename=f"story_{build_tag}.mp4",
+            render_engine=render_engine,
+            profile=request.profile,
+            subtitle_mode=request.subtitle_mode,
+            output_format=request.output_format
+        )
+        subtitle_path = None
+        if (request.subtitle_mode or settings.VIDEO_SUBTITLE_MODE) == "sidecar":
+            subtitle_path = str(Path(video_path).with_suffix(".vtt"))
+        playlist_path = None
+        if (request.output_format or settings.VIDEO_OUTPUT_FORMAT) == "hls":
+            playlist_path = str(hls_playlist_path(video_path))
+
+        render_profile = RENDER_PROFILES.get(request.profile, RENDER_PROFILES["final"])
+        duration = await probe_duration(video_path.replace("/static/", "static/"))
+        await _with_session(
+            async_db_service.create_video,
+            story_id,
+            video_path,
+            duration,
+            f"{render_profile['width']}x{render_profile['height']}",
+            playlist_path
+        )
+        return {
+            "story_id": story_id,
+            "video_path": video_path,
+            "subtitle_path": subtitle_path,
+            "playlist_path": playlist_path,
+            "image_paths": image_paths,
+            "audio_paths": audio_paths,
+            "subtitle_paths": subtitle_paths,
+        }
+
+    graph.add("story", "llm", story_text)
+    graph.add("descriptions", "llm", descriptions, deps=["story"])
+    # 第0页为封面，其余每页对应一个段落
+    for page in range(page_count):
+        graph.add(f"image:{page}", "image", page_image(page), deps=["story", "descriptions"])
+        graph.add(f"audio:{page}", "tts", page_audio(page), deps=["story"], checkpoint=True)
+        if render_engine == "segments":
+            # 预编码的片段与合成视频时的缓存键一致，最终合成时直接命中缓存
+            graph.add(f"segment:{page}", "segment", page_segment(page),
+                      deps=[f"image:{page}", f"audio:{page}"])
+    video_deps = [f"image:{page}" for page in range(page_count)] + \
+        [f"audio:{page}" for page in range(page_count)]
+    if render_engine == "segments":
+        video_deps += [f"segment:{page}" for page in range(page_count)]
+    graph.add("video", "video", video, deps=video_deps, checkpoint=True)
+
+    logger.info(f"开始生成绘本: {story_id}，共 {page_count - 1} 页，{len(graph)} 个任务节点")
+    results = await graph.run(on_progress, checkpoints, on_checkpoint, allow_partial=True)
+    if "video" in results:
+        return results["video"]
+
+    # 时间预算用尽：返回已完成页面的产物，未完成的页面为None
+    audios = [results.get(f"audio:{page}") for page in range(page_count)]
+    return {
+        "story_id": story_id,
+        "partial": True,
+        "video_path": None,
+        "subtitle_path": None,
+        "playlist_path": None,
+        "image_paths": [results.get(f"image:{page}") for page in range(page_count)],
+        "audio_paths": [audio["audio_path"] if audio else None for audio in audios],
+        "subtitle_paths": [audio["subtitle_path"] if audio else None for audio in audios],
+    }
+
+
+@register_job_handler("story_build")
+async def run_story_build_job(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """持久化任务处理函数：payload 包含 story_id 和生成参数 request"""
+    story = await _with_session(async_db_service.get_story, payload["story_id"])
+    if not story:
+        raise ValueError("故事不存在")
+    request = models.StoryBuildRequest(**payload["request"])
+    return await build_story(
+        story, request, context.on_progress, context.checkpoints, context.save_checkpoint)
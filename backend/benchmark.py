@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+视频渲染基准测试脚本
+
+使用ffmpeg合成一本参考绘本（纯色图片 + 正弦波旁白 + 字幕），不调用任何外部API，
+对比不同渲染引擎、渲染档位的耗时和输出文件大小，以及修改单页后增量重新渲染的耗时。
+
+用法:
+    python benchmark.py --pages 20 --engines segments filtergraph --profiles preview final --concurrency 4
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加当前目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from api.config import settings, VIDEO_RENDER_ENGINES, RENDER_PROFILES
+from api.services import (
+    create_paragraph_video, generate_subtitle_file, probe_duration, canonical_audio_args, subtitle_timeline_path
+)
+
+
+def build_reference_book(work_dir: Path, pages: int):
+    """生成参考绘本素材，返回 (图片路径, 音频路径, 字幕路径) 三个列表"""
+    image_paths, audio_paths, subtitle_paths = [], [], []
+    for i in range(pages):
+        image_path = work_dir / f"page_{i}.png"
+        audio_path = work_dir / f"page_{i}.mp3"
+        subtitle_path = work_dir / f"page_{i}.srt"
+        # 旁白时长在4~8秒之间变化，接近真实绘本每页的朗读时长
+        duration = 4 + (i * 7) % 5
+        color = f"0x{(i * 40) % 256:02x}{(i * 90) % 256:02x}{(i * 150) % 256:02x}"
+
+        subprocess.run([
+            'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi',
+            '-i', f"color=c={color}:s=1024x576:d=1", '-frames:v', '1', str(image_path)
+        ], check=True)
+        subprocess.run([
+            'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi',
+            '-i', f"sine=frequency={220 + i * 20}:duration={duration}",
+            *canonical_audio_args(), str(audio_path)
+        ], check=True)
+        generate_subtitle_file(
+            [(f"第{i + 1}页 第一句", 0.0, duration / 2),
+             (f"第{i + 1}页 第二句", duration / 2, duration)],
+            str(subtitle_path)
+        )
+
+        image_paths.append(str(image_path))
+        audio_paths.append(str(audio_path))
+        subtitle_paths.append(str(subtitle_path))
+    return image_paths, audio_paths, subtitle_paths
+
+
+async def run_case(name: str, book, **kwargs) -> dict:
+    """渲染一次并记录耗时、输出大小和时长"""
+    output_filename = f"benchmark_{name}.mp4"
+    start = time.perf_counter()
+    video_url = await create_paragraph_video(*book, output_filename=output_filename, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    output_path = Path(video_url.replace("/static/", "static/"))
+    result = {
+        "case": name,
+        "seconds": elapsed,
+        "size_kb": output_path.stat().st_size / 1024,
+        "duration": await probe_duration(str(output_path)),
+    }
+    output_path.unlink()
+    subtitle_timeline_path(output_path).unlink(missing_ok=True)
+    return result
+
+
+async def run_concurrent(book, concurrency: int, profile: str) -> dict:
+    """同时提交多个渲染任务（经过全局渲染调度器），记录总耗时和平均每个任务的耗时"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        run_case(f"concurrent_{i}", book, render_engine="filtergraph", profile=profile)
+        for i in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    return {
+        "case": f"filtergraph_{profile}_x{concurrency}",
+        "seconds": elapsed,
+        "size_kb": sum(r["size_kb"] for r in results) / concurrency,
+        "duration": results[0]["duration"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="视频渲染基准测试")
+    parser.add_argument("--pages", type=int, default=20, help="参考绘本页数（含封面）")
+    parser.add_argument("--engines", nargs="+", default=list(VIDEO_RENDER_ENGINES),
+                        choices=VIDEO_RENDER_ENGINES, help="要对比的渲染引擎")
+    parser.add_argument("--profiles", nargs="+", default=["final"],
+                        choices=list(RENDER_PROFILES), help="要对比的渲染档位")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="额外测试同时提交多个渲染任务时的总耗时（0表示不测试）")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="benchmark_"))
+    try:
+        print(f"生成 {args.pages} 页参考绘本素材: {work_dir}")
+        book = build_reference_book(work_dir, args.pages)
+
+        # 使用独立的片段缓存目录，避免受已有缓存影响
+        settings.SEGMENT_CACHE_DIR = work_dir / "segment_cache"
+
+        results = []
+        for profile in args.profiles:
+            for engine in args.engines:
+                results.append(await run_case(
+                    f"{engine}_{profile}", book, render_engine=engine, profile=profile))
+
+        if "segments" in args.engines:
+            # 替换一页图片后重新渲染，其余页面命中片段缓存
+            edited_image = Path(book[0][args.pages // 2])
+            subprocess.run([
+                'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi',
+                '-i', "color=c=white:s=1024x576:d=1", '-frames:v', '1', str(edited_image)
+            ], check=True)
+            for profile in args.profiles:
+                results.append(await run_case(
+                    f"segments_{profile}_1_page_edit", book, render_engine="segments", profile=profile))
+
+        if args.concurrency > 1:
+            for profile in args.profiles:
+                results.append(await run_concurrent(book, args.concurrency, profile))
+
+        print(f"\n{'case':<34}{'wall time(s)':>14}{'size(KB)':>12}{'duration(s)':>14}")
+        for r in results:
+            print(f"{r['case']:<34}{r['seconds']:>14.2f}{r['size_kb']:>12.1f}{r['duration']:>14.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,21 +1,25 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-import uvicorn
-import os
+from api.audio_storage import NegotiatedStaticFiles
+import mimetypes
 from pathlib import Path
 from api.generate_story import story_router
 from api.generate_images import image_router
 from api.generate_speech import speech_router
-from api.config import settings, validate_settings
-from api.db_init import init_db
+from api.config import settings
+from api.bootstrap import ensure_runtime, STATIC_ROOT
 from api.story_api import story_db_router
+from api.job_api import job_router
+from api.batch_api import batch_router
+from api.job_worker import JobWorker
+from api.priority import PriorityLaneMiddleware
+from api.disconnect import CancelOnDisconnectMiddleware
+from api.deadline import DeadlineExceeded
+from api import metrics
 
-# 验证所有必要设置
-validate_settings()
-
-# 初始化数据库
-init_db()
+# 验证设置、初始化数据库并创建所需目录（多工作进程部署时已由主进程完成）
+ensure_runtime()
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -31,35 +35,55 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 客户端断开时取消请求处理（生成调用和ffmpeg子进程随之终止）
+app.add_middleware(CancelOnDisconnectMiddleware)
+# 按 X-Priority 请求头区分交互请求和批量请求（最外层，断开处理任务继承所属通道）
+app.add_middleware(PriorityLaneMiddleware)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    """未被接口自行处理的截止时间超时统一返回504"""
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+# HLS分片的媒体类型（系统mimetypes中可能缺失）
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
 
-# 确保各种目录存在
-# 静态文件目录 - 所有静态文件都放在backend/static下
-STATIC_ROOT = "static"
-os.makedirs(STATIC_ROOT, exist_ok=True)
-os.makedirs(os.path.join(STATIC_ROOT, "images"), exist_ok=True)
-os.makedirs(os.path.join(STATIC_ROOT, "speech"), exist_ok=True)
-os.makedirs(os.path.join(STATIC_ROOT, "subtitles"), exist_ok=True)
-os.makedirs(os.path.join(STATIC_ROOT, "audio"), exist_ok=True)
-os.makedirs(os.path.join(STATIC_ROOT, "videos"), exist_ok=True)
-
-# 临时文件目录 - 所有临时文件都放在backend/temp下
-TEMP_ROOT = "temp"
-os.makedirs(TEMP_ROOT, exist_ok=True)
-os.makedirs(os.path.join(TEMP_ROOT, "audio"), exist_ok=True)
-os.makedirs(os.path.join(TEMP_ROOT, "video"), exist_ok=True)
-
-# 数据库目录
-DB_ROOT = "database"
-os.makedirs(DB_ROOT, exist_ok=True)
-
-# 挂载静态文件目录
-app.mount("/static", StaticFiles(directory=STATIC_ROOT), name="static")
+# 挂载静态文件目录（音频目录按Accept头协商压缩格式或MP3）
+app.mount("/static", NegotiatedStaticFiles(directory=STATIC_ROOT), name="static")
 
 # 添加路由
 app.include_router(story_router, prefix="/story")
 app.include_router(image_router, prefix="/image")
 app.include_router(speech_router, prefix="/speech")
 app.include_router(story_db_router, prefix="/stories")
+app.include_router(job_router, prefix="/jobs")
+app.include_router(batch_router, prefix="/batches")
+
+
+# 持久化任务工作协程（JOB_WORKER_MODE=external 时由独立进程执行）
+job_worker = JobWorker() if settings.JOB_WORKER_MODE == "in_process" else None
+
+
+@app.on_event("startup")
+async def start_job_worker():
+    if job_worker:
+        job_worker.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_worker():
+    # 执行中的任务归还队列，重启后从检查点继续
+    if job_worker:
+        await job_worker.stop()
+
+
+# 运行指标
+@app.get("/metrics", tags=["运行指标"])
+async def get_metrics():
+    """获取进程内运行指标（如拼接兜底路径的触发次数）"""
+    return metrics.snapshot()
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    import run
+    run.main()
@@ -1,28 +1,103 @@
 #!/usr/bin/env python
 """
 启动儿童故事生成API服务器的脚本
+
+SERVER_MODE=development（默认）单进程运行并在代码修改后自动重载；
+SERVER_MODE=production 按 SERVER_WORKERS 启动多个工作进程，使用 uvloop/httptools，不启用重载。
+验证配置、初始化数据库等准备工作在主进程中执行一次，生产模式的工作进程不再重复执行；
+开发模式的重载子进程每次启动都重新执行。
 """
+import importlib.util
+import os
+
 import uvicorn
-from api.config import settings, validate_settings
+from api.config import settings, per_process
+from api.bootstrap import prepare_runtime, mark_prepared
+from api.render_scheduler import available_cpus
+
+# 需要单独安装的事件循环和HTTP解析实现
+_OPTIONAL_IMPLEMENTATIONS = ("uvloop", "httptools")
+
+
+def _implementation(value: str, setting: str) -> str:
+    """auto 交给 uvicorn 选择（已安装时使用 uvloop/httptools）；显式指定但未安装时报错"""
+    value = (value or "auto").lower()
+    if value in _OPTIONAL_IMPLEMENTATIONS and not _installed(value):
+        raise ValueError(f"{setting}={value} 需要先安装 {value}")
+    return value
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options() -> dict:
+    """按 SERVER_MODE 生成 uvicorn 启动参数"""
+    options = {
+        "host": settings.HOST,
+        "port": settings.PORT,
+        "loop": _implementation(settings.SERVER_LOOP, "SERVER_LOOP"),
+        "http": _implementation(settings.SERVER_HTTP, "SERVER_HTTP"),
+        "timeout_keep_alive": settings.SERVER_KEEPALIVE_TIMEOUT,
+        "backlog": settings.SERVER_BACKLOG,
+        "timeout_graceful_shutdown": settings.SERVER_GRACEFUL_TIMEOUT,
+    }
+    if settings.SERVER_MODE == "production":
+        options["workers"] = settings.SERVER_WORKERS or os.cpu_count() or 1
+        # 访问日志逐条写入，压测和生产环境下占用可观的CPU
+        options["access_log"] = False
+    else:
+        options["reload"] = True
+    return options
+
+
+def _share_processes(processes: int):
+    """
+    告知工作进程实际进程数：渲染CPU令牌、准入闸门、密钥额度和批量开始速率都在进程内实现，
+    各工作进程按该数量均分配置的总量（见 config.per_process）
+    """
+    os.environ["SERVER_PROCESS_COUNT"] = str(processes)
+    settings.SERVER_PROCESS_COUNT = processes
+
+
+def _print_process_limits():
+    """打印每个工作进程分到的限额"""
+    render_tokens = per_process(settings.RENDER_CPU_TOKENS or available_cpus())
+    admission = "，".join(
+        f"{name} {per_process(getattr(settings, f'ADMISSION_{name.upper()}_CONCURRENCY'))}"
+        for name in ("llm", "image", "tts", "render"))
+    print(f"每个工作进程: 渲染CPU令牌 {render_tokens}，准入并发 {admission}，"
+          f"DeepInfra每密钥RPM {per_process(settings.DEEPINFRA_RPM)}，"
+          f"SiliconFlow每密钥RPM {per_process(settings.SILICONFLOW_RPM)}")
+    print("提示: 相同请求合并(SingleFlight)只在同一工作进程内生效，不同进程收到的重复请求会各自执行")
 
 
 def main():
     """启动API服务器"""
     try:
-        # 验证设置
-        validate_settings()
+        # 验证设置、初始化数据库并创建目录，启动失败时尽早报错
+        prepare_runtime()
+        options = server_options()
 
-        print(f"启动 {settings.APP_NAME} v{settings.APP_VERSION}")
+        print(f"启动 {settings.APP_NAME} v{settings.APP_VERSION}（{settings.SERVER_MODE}）")
         print(f"服务器地址: http://{settings.HOST}:{settings.PORT}")
         print(f"API文档地址: http://{settings.HOST}:{settings.PORT}/docs")
+        if "workers" in options:
+            loop = options["loop"] if options["loop"] != "auto" else (
+                "uvloop" if _installed("uvloop") else "asyncio")
+            http = options["http"] if options["http"] != "auto" else (
+                "httptools" if _installed("httptools") else "h11")
+            print(f"工作进程: {options['workers']}，事件循环: {loop}，HTTP解析: {http}")
+            # 生产工作进程通过环境变量得知准备工作已完成
+            mark_prepared()
+            _share_processes(options["workers"])
+            _print_process_limits()
+            if settings.JOB_WORKER_MODE == "in_process":
+                print("提示: 每个工作进程都会运行持久化任务工作协程，"
+                      "可设置 JOB_WORKER_MODE=external 并单独运行 python -m api.job_worker")
 
         # 启动服务器
-        uvicorn.run(
-            "main:app",
-            host=settings.HOST,
-            port=settings.PORT,
-            reload=True
-        )
+        uvicorn.run("main:app", **options)
     except Exception as e:
         print(f"启动失败: {str(e)}")
 
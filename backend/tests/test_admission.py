@@ -0,0 +1,77 @@
+"""
+准入闸门：并发上限内立即执行，超出时排队；队列已满返回429，排队超时返回503，都带 Retry-After
+"""
+import asyncio
+
+import pytest
+
+from api.admission import AdmissionGate, AdmissionRejected
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        gate = AdmissionGate("test", limit=1, queue_size=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate.admit():
+                await release.wait()
+
+        running = asyncio.ensure_future(hold())
+        queued = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        assert gate.running == 1 and gate.queued == 1
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with gate.admit():
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+        assert gate.running == 0
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    assert rejected.to_http_exception().headers["Retry-After"] == str(rejected.retry_after)
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def scenario():
+        gate = AdmissionGate("test", limit=1, queue_size=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate.admit():
+                await release.wait()
+
+        running = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with gate.admit(timeout=0.05):
+                pass
+        assert gate.queued == 0
+        release.set()
+        await running
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.retry_after >= 1
+
+
+def test_released_slot_is_handed_to_the_waiter():
+    async def scenario():
+        gate = AdmissionGate("test", limit=1, queue_size=2, queue_timeout=5)
+        order = []
+
+        async def work(name: str):
+            async with gate.admit():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(work("a"), work("b"), work("c"))
+        assert gate.running == 0
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b", "c"]
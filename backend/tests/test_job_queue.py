@@ -0,0 +1,100 @@
+"""
+持久化任务队列的领取和租约：同一任务只能被一个工作进程领取，租约过期后可以重新领取，
+执行次数用尽的任务标记失败
+"""
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api import db_models, job_queue
+from api.database import Base
+from api.jobs import JOB_CANCELLED, JOB_FAILED, JOB_PENDING, JOB_RUNNING
+
+KIND = "paragraph_audio"
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _expire_lease(db, job_id: str):
+    """模拟工作进程退出：租约已过期"""
+    db.query(db_models.BackgroundJob).filter(db_models.BackgroundJob.id == job_id) \
+        .update({db_models.BackgroundJob.lease_expires_at: time.time() - 1})
+    db.commit()
+
+
+def test_job_is_claimed_by_one_worker_only(db):
+    job = job_queue.enqueue_job(db, KIND, {})
+
+    claimed = job_queue.claim_job(db, "worker-a", [KIND])
+    assert claimed.id == job.id
+    assert claimed.status == JOB_RUNNING
+    assert claimed.worker_id == "worker-a"
+    assert claimed.attempts == 1
+
+    assert job_queue.claim_job(db, "worker-b", [KIND]) is None
+    assert job_queue.claim_job(db, "worker-a", ["story_build"]) is None
+
+
+def test_expired_lease_is_reclaimed(db):
+    job = job_queue.enqueue_job(db, KIND, {}, max_attempts=2)
+    job_queue.claim_job(db, "worker-a", [KIND])
+    assert job_queue.renew_lease(db, job.id, "worker-a")
+
+    _expire_lease(db, job.id)
+    reclaimed = job_queue.claim_job(db, "worker-b", [KIND])
+    assert reclaimed.id == job.id
+    assert reclaimed.worker_id == "worker-b"
+    assert reclaimed.attempts == 2
+
+    # 原工作进程不再拥有该任务
+    assert not job_queue.renew_lease(db, job.id, "worker-a")
+
+
+def test_abandoned_job_fails_when_attempts_are_used_up(db):
+    job = job_queue.enqueue_job(db, KIND, {}, max_attempts=1)
+    job_queue.claim_job(db, "worker-a", [KIND])
+
+    _expire_lease(db, job.id)
+    assert job_queue.claim_job(db, "worker-b", [KIND]) is None
+    db.expire_all()
+    assert job_queue.get_job(db, job.id).status == JOB_FAILED
+
+
+def test_failed_job_is_retried_then_fails(db, monkeypatch):
+    monkeypatch.setattr(job_queue.settings, "JOB_RETRY_BACKOFF", 0)
+    job = job_queue.enqueue_job(db, KIND, {}, max_attempts=2)
+
+    job_queue.claim_job(db, "worker-a", [KIND])
+    assert job_queue.fail_job(db, job.id, "boom")
+    assert job_queue.get_job(db, job.id).status == JOB_PENDING
+
+    job_queue.claim_job(db, "worker-a", [KIND])
+    assert job_queue.fail_job(db, job.id, "boom")
+    assert job_queue.get_job(db, job.id).status == JOB_FAILED
+
+
+def test_cancelled_job_is_not_claimed_or_completed(db):
+    job = job_queue.enqueue_job(db, KIND, {})
+    job_queue.claim_job(db, "worker-a", [KIND])
+    assert job_queue.cancel_job(db, job.id)
+    assert not job_queue.cancel_job(db, job.id)
+
+    # 处理函数在取消之后完成时保留已取消状态
+    assert not job_queue.complete_job(db, job.id, {"ok": True})
+    db.expire_all()
+    assert job_queue.get_job(db, job.id).status == JOB_CANCELLED
+    assert job_queue.count_unfinished(db, KIND) == 0
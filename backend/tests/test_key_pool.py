@@ -0,0 +1,55 @@
+"""
+密钥池：令牌桶按每分钟额度补充，收到429的密钥冷却期内不再被选中
+"""
+import asyncio
+
+import pytest
+
+from api.deadline import DeadlineExceeded, deadline_scope
+from api.key_pool import KeyPool, TokenBucket, parse_retry_after
+
+
+def test_token_bucket_refills_at_rate_per_minute():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == 0
+    # 超过容量的请求按容量计算
+    assert bucket.wait_time(1000, now + 1) == pytest.approx(59.0)
+
+
+def test_zero_capacity_is_unlimited():
+    bucket = TokenBucket(0)
+    bucket.consume(1000)
+    assert bucket.wait_time(1000, bucket.updated_at) == 0
+
+
+def test_rate_limited_key_is_skipped_during_cooldown():
+    async def scenario():
+        pool = KeyPool("test", ["key-a", "key-b"], cooldown=30)
+        first = await pool.acquire()
+        pool.mark_rate_limited(first)
+        picks = {(await pool.acquire()).key for _ in range(5)}
+        return first.key, picks
+
+    limited, picks = asyncio.run(scenario())
+    assert picks == {"key-a", "key-b"} - {limited}
+
+
+def test_exhausted_pool_gives_up_at_deadline():
+    async def scenario():
+        pool = KeyPool("test", ["key-a"], rpm=1)
+        await pool.acquire()
+        with deadline_scope(0.5):
+            await pool.acquire()
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+
+
+def test_retry_after_header_is_parsed_as_seconds():
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+    assert parse_retry_after(None) is None
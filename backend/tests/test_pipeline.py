@@ -0,0 +1,72 @@
+"""
+阶段化任务图：失败的节点按配置重试，检查点节点的结果被保存，重新执行时直接复用
+"""
+import asyncio
+
+import pytest
+
+from api.pipeline import TaskGraph
+
+
+def test_failed_node_is_retried():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("temporary")
+        return "ok"
+
+    graph = TaskGraph(retries=2, retry_delay=0.01)
+    graph.add("flaky", "tts", flaky)
+    assert asyncio.run(graph.run()) == {"flaky": "ok"}
+    assert len(attempts) == 3
+
+
+def test_node_fails_when_retries_are_used_up():
+    async def broken():
+        raise RuntimeError("permanent")
+
+    graph = TaskGraph(retries=1, retry_delay=0.01)
+    graph.add("broken", "tts", broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(graph.run())
+
+
+def test_checkpointed_nodes_are_reused():
+    calls = []
+
+    def build() -> TaskGraph:
+        async def image():
+            calls.append("image")
+            return "page1.png"
+
+        async def video(image_url):
+            calls.append("video")
+            return f"{image_url}.mp4"
+
+        graph = TaskGraph()
+        graph.add("image", "image", image, checkpoint=True)
+        graph.add("video", "render", video, deps=["image"])
+        return graph
+
+    saved = {}
+
+    async def on_checkpoint(key, value):
+        saved[key] = value
+
+    first = asyncio.run(build().run(on_checkpoint=on_checkpoint))
+    assert saved == {"image": "page1.png"}
+
+    second = asyncio.run(build().run(checkpoints=saved))
+    assert first == second == {"image": "page1.png", "video": "page1.png.mp4"}
+    assert calls == ["image", "video", "video"]
+
+
+def test_dependencies_must_be_added_first():
+    async def noop():
+        return None
+
+    graph = TaskGraph()
+    with pytest.raises(ValueError):
+        graph.add("video", "render", noop, deps=["image"])
@@ -0,0 +1,57 @@
+"""
+子进程执行：超时或调用方取消时子进程被终止并回收，不留下孤儿进程
+"""
+import asyncio
+import os
+
+import pytest
+
+from api import process_runner
+from api.process_runner import ProcessError, run_process
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    """记录 run_process 创建的子进程"""
+    processes = []
+    create = asyncio.create_subprocess_exec
+
+    async def create_and_record(*args, **kwargs):
+        proc = await create(*args, **kwargs)
+        processes.append(proc)
+        return proc
+
+    monkeypatch.setattr(process_runner.asyncio, "create_subprocess_exec", create_and_record)
+    return processes
+
+
+def _assert_reaped(proc):
+    assert proc.returncode is not None
+    with pytest.raises(ProcessLookupError):
+        os.kill(proc.pid, 0)
+
+
+def test_timeout_kills_process(spawned):
+    with pytest.raises(ProcessError) as error:
+        asyncio.run(run_process(["sleep", "30"], timeout=0.2))
+    assert error.value.timed_out
+    _assert_reaped(spawned[0])
+
+
+def test_cancel_kills_process(spawned):
+    async def scenario():
+        task = asyncio.ensure_future(run_process(["sleep", "30"]))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    _assert_reaped(spawned[0])
+
+
+def test_nonzero_exit_raises_with_stderr():
+    with pytest.raises(ProcessError) as error:
+        asyncio.run(run_process(["sh", "-c", "echo broken >&2; exit 3"]))
+    assert error.value.returncode == 3
+    assert "broken" in error.value.stderr
@@ -0,0 +1,68 @@
+"""
+相同请求合并：执行中的相同请求共享结果，完成后短时间内重放，所有等待者离开时取消执行
+"""
+import asyncio
+
+import pytest
+
+from api.single_flight import IdempotencyConflict, SingleFlight
+
+
+def test_identical_requests_share_one_execution():
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"url": "a.mp3"}
+
+    async def scenario():
+        flight = SingleFlight("test", ttl=60)
+        # 字段顺序不影响合并
+        results = await asyncio.gather(
+            flight.run({"text": "你好", "voice": "a"}, generate),
+            flight.run({"voice": "a", "text": "你好"}, generate))
+        replayed = await flight.run({"text": "你好", "voice": "a"}, generate)
+        return results + [replayed]
+
+    assert asyncio.run(scenario()) == [{"url": "a.mp3"}] * 3
+    assert len(calls) == 1
+
+
+def test_idempotency_key_with_different_body_conflicts():
+    async def generate():
+        return "ok"
+
+    async def scenario():
+        flight = SingleFlight("test", ttl=60)
+        await flight.run({"text": "a"}, generate, idempotency_key="k")
+        await flight.run({"text": "b"}, generate, idempotency_key="k")
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(scenario())
+
+
+def test_work_is_cancelled_when_all_waiters_leave():
+    async def scenario():
+        flight = SingleFlight("test", ttl=60)
+        started = asyncio.Event()
+        stopped = asyncio.Event()
+
+        async def generate():
+            started.set()
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        waiters = [asyncio.ensure_future(flight.run({"text": "a"}, generate)) for _ in range(2)]
+        await started.wait()
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+        assert not stopped.is_set()
+        waiters[1].cancel()
+        await asyncio.wait_for(stopped.wait(), 1)
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,98 @@
+"""
+故事列表和详情的查询次数不随故事数量增长（关联关系批量加载，无逐个懒加载）
+"""
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api import db_service, models
+from api.config import Language, StoryType
+from api.database import Base
+
+# get_stories / get_story(with_details=True)：故事一条 + 六个关联各一条
+EXPECTED_QUERIES = 7
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def query_counter(db):
+    counter = {"count": 0}
+
+    def count(*args):
+        counter["count"] += 1
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    yield counter
+    event.remove(engine, "before_cursor_execute", count)
+
+
+def _add_stories(db, n: int):
+    """创建 n 个所有关联都有数据的故事"""
+    request = models.StoryRequest(
+        theme="太空探险", story_type=StoryType.ADVENTURE, age_range="3-6岁",
+        language=Language.CHINESE, word_count=500, pages=3)
+    for _ in range(n):
+        story = db_service.create_story(db, request)
+        paragraphs = db_service.create_paragraphs(db, story.id, ["第一页", "第二页"])
+        db_service.create_characters(db, story.id, [models.CharacterDescription(
+            name="小明", role="主角", appearance="短发", traits=["勇敢"], age="6")])
+        descriptions = db_service.create_image_descriptions(
+            db, story.id, ["场景一", "场景二"], "封面", "picture_book", paragraphs)
+        db_service.create_image(db, story.id, descriptions[0].id, "cover.png", True, "16:9")
+        db_service.create_image(
+            db, story.id, descriptions[1].id, "page1.png", False, "16:9", paragraph_id=paragraphs[0].id)
+        db_service.create_speech(db, story.id, paragraphs[0].id, "page1.mp3")
+        db_service.create_video(db, story.id, "story.mp4")
+    # 清空会话，避免已加载的对象掩盖懒加载查询
+    db.expunge_all()
+
+
+def _list_queries(db, counter) -> int:
+    counter["count"] = 0
+    responses = [db_service.story_to_response(story) for story in db_service.get_stories(db)]
+    assert all(r["paragraphs"] and r["characters"] and r["images"] and r["speeches"] and r["videos"]
+               for r in responses)
+    db.expunge_all()
+    return counter["count"]
+
+
+def _detail_queries(db, counter, story_id: str) -> int:
+    counter["count"] = 0
+    response = db_service.story_to_response(db_service.get_story(db, story_id, with_details=True))
+    assert response["image_descriptions"] and response["videos"]
+    db.expunge_all()
+    return counter["count"]
+
+
+def test_story_list_query_count_does_not_grow(db, query_counter):
+    _add_stories(db, 1)
+    assert _list_queries(db, query_counter) == EXPECTED_QUERIES
+
+    _add_stories(db, 29)
+    assert len(db_service.get_stories(db)) == 30
+    db.expunge_all()
+    assert _list_queries(db, query_counter) == EXPECTED_QUERIES
+
+
+def test_story_detail_query_count_does_not_grow(db, query_counter):
+    _add_stories(db, 1)
+    story_id = db_service.get_stories(db)[0].id
+    db.expunge_all()
+    assert _detail_queries(db, query_counter, story_id) == EXPECTED_QUERIES
+
+    _add_stories(db, 29)
+    assert _detail_queries(db, query_counter, story_id) == EXPECTED_QUERIES
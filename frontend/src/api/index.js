@@ -30,9 +30,9 @@ api.interceptors.response.use(
 
 // 故事相关 API
 export const storyApi = {
-    // 生成故事
-    generateStory(data) {
-        return api.post('/story/generate-story', data)
+    // 生成故事，config.signal 可用于中止请求（服务端随之取消生成）
+    generateStory(data, config = {}) {
+        return api.post('/story/generate-story', data, config)
     },
 
     // 生成图片描述
@@ -70,9 +70,24 @@ export const storyApi = {
         return api.get('/stories')
     },
 
+    // 获取故事列表摘要（标题、封面、页数和时间，不含段落和媒体详情）
+    getStorySummaries(params = {}) {
+        return api.get('/stories/summaries', { params })
+    },
+
     // 获取故事详情
     getStory(storyId) {
         return api.get(`/stories/${storyId}`)
+    },
+
+    // 获取段落语音的波形峰值（音频加载前即可绘制波形）
+    getSpeechPeaks(storyId, paragraphId) {
+        return api.get(`/stories/${storyId}/speeches/${paragraphId}/peaks`)
+    },
+
+    // 后台一键生成整本绘本，返回任务ID（进度通过 jobApi 查询或订阅）
+    buildStory(storyId, options = {}) {
+        return api.post(`/stories/${storyId}/build`, options)
     }
 }
 
@@ -123,11 +138,44 @@ export const speechApi = {
 
         console.log('发送视频生成请求:', requestData);
         return api.post('/speech/generate_paragraph_video', requestData);
+    },
+
+    // 以后台任务方式生成段落视频，立即返回任务ID
+    createParagraphVideoJob(data) {
+        return api.post('/speech/generate_paragraph_video/jobs', data);
+    }
+}
+
+// 后台任务相关 API
+export const jobApi = {
+    // 查询任务状态和进度
+    getJob(jobId) {
+        return api.get(`/jobs/${jobId}`)
+    },
+
+    // 取消任务，执行中的生成和渲染随之停止
+    cancelJob(jobId) {
+        return api.post(`/jobs/${jobId}/cancel`)
+    },
+
+    // 订阅任务进度事件，onUpdate 在每次状态变化时调用，任务结束后自动关闭
+    subscribeJob(jobId, onUpdate) {
+        const source = new EventSource(`/api/jobs/${jobId}/events`)
+        source.onmessage = event => {
+            const job = JSON.parse(event.data)
+            onUpdate(job)
+            if (job.status === 'succeeded' || job.status === 'failed' || job.status === 'cancelled') {
+                source.close()
+            }
+        }
+        source.onerror = () => source.close()
+        return source
     }
 }
 
 export default {
     storyApi,
     imageApi,
-    speechApi
+    speechApi,
+    jobApi
 } 
\ No newline at end of file